@@ -2,15 +2,40 @@
 Servidor FastAPI ultra-ligero para servir modelos ONNX
 Optimizado para uso en móviles con mínima latencia
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Optional
 import onnxruntime as ort
-import numpy as np
-from transformers import MarianTokenizer, MarianMTModel
+from starlette.concurrency import iterate_in_threadpool
 from pathlib import Path
+import asyncio
 import logging
-import torch
+import os
+import sys
+import time
+import json
+import threading
+from onnx_decoder import OnnxMarianGenerator, arena_session_options, preload_model_bytes, register_arena
+from batching import MicroBatcher, InferenceExecutor, QueueFullError, SingleFlight, run_bucketed
+from concurrent.futures import ThreadPoolExecutor
+from translation_cache import TranslationCache
+import metrics
+from metrics import timed
+from segmentation import split_segments, join_segments
+from marian_tokenizer import load_tokenizer
+from model_loader import has_local_weights, load_marian_mmap, build_draft_model, parse_layers
+from shortlist import Shortlist, patch_lm_head, restrict
+from model_registry import ModelRegistry, PairModel, parse_pairs
+from decoding_policy import DecodingChoice, DecodingPolicy
+from encoder_cache import EncoderCache
+from translation_memory import TranslationMemory
+from jobs import JobRunner, JobStore
+from serving import (check_quality, inference_load, interactive_idle, job_chunk_translator, jobs_router,
+                     memory_lookup, register_metrics, resolve_pair)
+from thread_tuning import ThreadConfig, configure_threads
+# torch y transformers se importan solo si el backend PyTorch los necesita
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
@@ -31,123 +56,657 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Modelos globales
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    """Cuenta peticiones y mide la latencia de cada endpoint"""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    endpoint = getattr(route, "path", request.url.path)
+    metrics.REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    return response
+
+def observe_stage(stage: str, seconds: float):
+    """Callback para el generador ONNX y el micro-batcher"""
+    metrics.STAGE_SECONDS.observe(seconds, stage=stage)
+
+# Modelos globales (par de arranque; el resto de pares viven en registry)
 model_session = None
 tokenizer = None
 use_onnx = True
+model_id = None  # Identifica modelo + backend en las claves del cache
+draft_model = None  # Draft PyTorch para la decodificación especulativa
+vocab_shortlist = None  # Shortlist léxica de la proyección de salida
+ready = False  # Modelos cargados y calentados: /health/ready
+load_error = None
+import_time = time.perf_counter()
+startup_seconds = None
+
+# Backend: "onnx-int8" (default), "onnx-fp32" o "pytorch"
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "onnx-int8")
+NUM_BEAMS = int(os.getenv("NUM_BEAMS", "4"))
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "./onnx_models")
+INTRA_OP_THREADS = int(os.getenv("INTRA_OP_THREADS", "2"))  # Threads por proceso (start.py lo ajusta por worker)
+INTER_OP_THREADS = int(os.getenv("INTER_OP_THREADS", "1"))  # Solo ONNX: >1 ejecuta ramas del grafo en paralelo
+# Auto-ajuste al arrancar: mide combinaciones de threads intra/inter-op y sesiones concurrentes con
+# el modelo real y guarda la mejor para THREAD_TUNING_OBJECTIVE (latency, throughput o balanced)
+THREAD_TUNING = os.getenv("THREAD_TUNING", "0") == "1"
+THREAD_TUNING_OBJECTIVE = os.getenv("THREAD_TUNING_OBJECTIVE", "balanced")
+THREAD_TUNING_PATH = os.getenv("THREAD_TUNING_PATH", "thread_tuning.json")  # Decisiones para los siguientes arranques
+THREAD_TUNING_SECONDS = float(os.getenv("THREAD_TUNING_SECONDS", "2"))  # Medida por combinación
+thread_decision = None  # Configuración de threads en uso y su origen (/health)
+# ONNX: decodificación con IO binding sobre buffers reutilizables (por thread de inferencia)
+ONNX_IO_BINDING = os.getenv("ONNX_IO_BINDING", "1") == "1"
+ONNX_BUFFER_RETAIN_MB = float(os.getenv("ONNX_BUFFER_RETAIN_MB", "64"))
+# ONNX: longitudes de entrada fijas (p. ej. "16,32,64,128,256,512"): cada entrada se rellena hasta el
+# menor bucket y el calentamiento ejecuta todos, para que onnxruntime no replanifique con cada longitud nueva
+ONNX_LENGTH_BUCKETS = tuple(int(b) for b in os.getenv("ONNX_LENGTH_BUCKETS", "").split(",") if b.strip())
+# ONNX: arena de memoria compartido por todas las sesiones y limitado (0 = un arena por sesión, sin límite)
+ONNX_ARENA_MAX_MB = float(os.getenv("ONNX_ARENA_MAX_MB", "0"))
+
+# Varios pares de idiomas: el de arranque (DEFAULT_PAIR, modelos de arriba) más los
+# de MODEL_PAIRS, que se cargan al primer uso y se descargan (LRU) por encima de MODEL_MEMORY_MB
+DEFAULT_PAIR = os.getenv("DEFAULT_PAIR", "en-es")
+DEFAULT_SOURCE, DEFAULT_TARGET = DEFAULT_PAIR.split("-", 1)
+MODEL_PAIRS = parse_pairs(os.getenv("MODEL_PAIRS", ""),
+                          os.getenv("HF_MODEL_TEMPLATE", "Helsinki-NLP/opus-mt-{source}-{target}"))
+MODEL_MEMORY_MB = float(os.getenv("MODEL_MEMORY_MB", "2048"))
+
+# Decodificación especulativa (solo greedy, NUM_BEAMS=1): un draft con menos
+# capas propone tokens y el modelo principal los verifica; misma salida que greedy
+SPECULATIVE = os.getenv("SPECULATIVE", "0") == "1"
+DRAFT_TOKENS = int(os.getenv("DRAFT_TOKENS", "4"))
+DRAFT_LAYERS = os.getenv("DRAFT_LAYERS", "0,5")  # Solo PyTorch; el draft ONNX lo fija convert_to_onnx.py
+
+# Shortlist léxica (shortlist.py build): la proyección de salida solo cubre los
+# candidatos de cada lote en lugar de los 65k tokens del vocabulario
+SHORTLIST_PATH = os.getenv("SHORTLIST_PATH", "")
+
+# Decodificación adaptativa: beams, length_penalty y max_length por petición según la
+# longitud del texto, la pista del cliente (quality, latency_budget_ms) y la carga.
+# NUM_BEAMS es el valor sin carga; ADAPTIVE_DECODING=0 usa siempre NUM_BEAMS
+ADAPTIVE_DECODING = os.getenv("ADAPTIVE_DECODING", "1") == "1"
+MAX_BEAMS = int(os.getenv("MAX_BEAMS", "4"))  # quality="best"
+decoding_policy = DecodingPolicy(
+    NUM_BEAMS, MAX_BEAMS,
+    reduce_load=float(os.getenv("POLICY_REDUCE_LOAD", "0.4")),
+    greedy_load=float(os.getenv("POLICY_GREEDY_LOAD", "0.75")),
+    enabled=ADAPTIVE_DECODING
+)
+
+# Traducción de calentamiento antes de declararse listo (WARMUP_RUNS=0 la desactiva)
+WARMUP_TEXT = os.getenv("WARMUP_TEXT", "Hello, how are you today?")
+WARMUP_RUNS = int(os.getenv("WARMUP_RUNS", "1"))
+
+# Bucketing por longitud para documentos largos
+BUCKET_MAX_TOKENS = int(os.getenv("BUCKET_MAX_TOKENS", "4096"))  # len(lote) * tokens del texto más largo
+BUCKET_MAX_SIZE = int(os.getenv("BUCKET_MAX_SIZE", "64"))
+BUCKET_WORKERS = int(os.getenv("BUCKET_WORKERS", "1"))  # >1 traduce buckets en paralelo
+bucket_executor = ThreadPoolExecutor(max_workers=BUCKET_WORKERS) if BUCKET_WORKERS > 1 else None
+
+# Inferencia fuera del event loop: pool acotado + cola con límite (429) + timeout por petición
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "64"))
+REQUEST_TIMEOUT_S = float(os.getenv("REQUEST_TIMEOUT_S", "30"))
+inference_executor = InferenceExecutor(max_workers=INFERENCE_WORKERS, max_queue=INFERENCE_QUEUE_SIZE)
+
+# Cache de salidas del encoder: re-traducciones con otros parámetros saltan el encoder (ENCODER_CACHE_MB=0 lo desactiva)
+ENCODER_CACHE_MB = float(os.getenv("ENCODER_CACHE_MB", "32"))
+encoder_cache = EncoderCache(int(ENCODER_CACHE_MB * 1024 * 1024)) if ENCODER_CACHE_MB > 0 else None
+
+# Cache de traducciones (LRU en memoria + SQLite opcional que sobrevive reinicios)
+translation_cache = TranslationCache(
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "10000")),
+    max_bytes=int(float(os.getenv("CACHE_MAX_MB", "64")) * 1024 * 1024),
+    db_path=os.getenv("CACHE_DB_PATH") or None
+)
+
+# Memoria de traducción (translation_memory.py build): las coincidencias exactas se devuelven sin
+# pasar por el modelo. Con TM_FUZZY_THRESHOLD < 1 las aproximadas se añaden como sugerencia junto a
+# la traducción del modelo (por defecto solo exactas)
+TM_PATH = os.getenv("TM_PATH", "")
+TM_FUZZY_THRESHOLD = float(os.getenv("TM_FUZZY_THRESHOLD", "1.0"))
+translation_memory = TranslationMemory(TM_PATH, TM_FUZZY_THRESHOLD) if TM_PATH else None
 
 class TranslationRequest(BaseModel):
     text: str
     max_length: int = 512
+    source_language: str = DEFAULT_SOURCE
+    target_language: str = DEFAULT_TARGET
+    quality: Optional[str] = None  # "fast", "balanced" o "best"
+    latency_budget_ms: Optional[float] = None
     
 class TranslationResponse(BaseModel):
     translated_text: str
-    source_language: str = "en"
-    target_language: str = "es"
+    source_language: str = DEFAULT_SOURCE
+    target_language: str = DEFAULT_TARGET
+    decoding: Optional[dict] = None  # Parámetros elegidos por la política de decodificación
+    origin: str = "model"  # "memory" (memoria de traducción) o "model"
+    memory: Optional[dict] = None  # Coincidencia de la memoria: match ("exact"/"fuzzy"), score, source y target
+
+class DocumentTranslationResponse(TranslationResponse):
+    segments: int
 
-def load_models(model_dir: str = "./onnx_models", use_quantized: bool = True, fallback_to_pytorch: bool = True):
-    """Carga los modelos ONNX y el tokenizer"""
-    global model_session, tokenizer, use_onnx
+def load_pytorch_model(model_path: Path):
+    """Carga el modelo MarianMT de PyTorch desde el directorio del modelo"""
+    global model_session, use_onnx, draft_model
+    import torch
     
-    model_path = Path(model_dir)
+    # Los pesos PyTorch están en el directorio padre de onnx_models
+    tokenizer_path = model_path.parent if model_path.name == "onnx_models" else model_path
     
-    # Determinar qué modelo usar
-    if use_quantized:
-        model_file = "model_quantized.onnx"
+    if has_local_weights(str(tokenizer_path)):
+        # Pesos mmap'd desde model.safetensors, sin inicializar el modelo dos veces
+        model_session = load_marian_mmap(str(tokenizer_path))
     else:
-        model_file = "model.onnx"
+        from transformers import MarianMTModel
+        model_session = MarianMTModel.from_pretrained(str(tokenizer_path))
+        model_session.eval()
+    torch.set_num_threads(INTRA_OP_THREADS)
     
-    onnx_model_path = model_path / model_file
+    if vocab_shortlist is not None:
+        # Antes de crear el draft: comparte el mismo lm_head
+        patch_lm_head(model_session)
     
-    try:
-        logger.info(f"Intentando cargar modelo ONNX desde {onnx_model_path}")
-        
-        # Configurar opciones de sesión para optimización
-        sess_options = ort.SessionOptions()
-        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
-        sess_options.intra_op_num_threads = 2  # Limitar threads para móviles
-        
-        # Cargar modelo ONNX
-        model_session = ort.InferenceSession(str(onnx_model_path), sess_options)
-        use_onnx = True
-        
-        logger.info("✅ Modelo ONNX cargado exitosamente")
-        
-    except Exception as e:
-        if fallback_to_pytorch:
-            logger.warning(f"No se pudo cargar modelo ONNX: {e}")
-            logger.info("Usando modelo PyTorch como fallback...")
+    if SPECULATIVE:
+        # Comparte pesos con el modelo principal: no ocupa memoria extra
+        draft_model = build_draft_model(model_session, parse_layers(DRAFT_LAYERS))
+        logger.info(f"✅ Draft para decodificación especulativa: capas {DRAFT_LAYERS}")
+    use_onnx = False
+    
+    logger.info("✅ Modelo PyTorch cargado exitosamente")
+
+def onnx_session_options():
+    """Opciones de sesión de onnxruntime para todos los modelos"""
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess_options.intra_op_num_threads = INTRA_OP_THREADS
+    sess_options.inter_op_num_threads = INTER_OP_THREADS
+    if INTER_OP_THREADS > 1:
+        sess_options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    if ONNX_ARENA_MAX_MB > 0:
+        register_arena(int(ONNX_ARENA_MAX_MB * 1024 * 1024))
+        arena_session_options(sess_options)
+    return sess_options
+
+def onnx_generator_options() -> dict:
+    """Opciones de OnnxMarianGenerator comunes a todos los pares"""
+    return {"io_binding": ONNX_IO_BINDING, "buffer_retain_bytes": int(ONNX_BUFFER_RETAIN_MB * 1024 * 1024),
+            "length_buckets": ONNX_LENGTH_BUCKETS}
+
+def warm_up_buckets(generator: OnnxMarianGenerator):
+    """Ejecuta cada bucket de ONNX_LENGTH_BUCKETS con una frase y con cada número de beams posible"""
+    if not ONNX_LENGTH_BUCKETS or WARMUP_RUNS <= 0:
+        return
+    start = time.perf_counter()
+    beams = {1, NUM_BEAMS, MAX_BEAMS} if ADAPTIVE_DECODING else {1, NUM_BEAMS}
+    shapes = generator.warm_up_buckets(tuple(sorted(beams)))
+    logger.info(f"✅ {shapes} formas de entrada precalentadas en {time.perf_counter() - start:.2f}s")
+
+def load_models(model_dir: str = ONNX_MODEL_DIR, use_quantized: bool = True, fallback_to_pytorch: bool = True,
+                prefer_onnx: bool = True):
+    """Carga los modelos ONNX (o PyTorch si prefer_onnx=False) y el tokenizer"""
+    global model_session, tokenizer, use_onnx, model_id, vocab_shortlist
+    
+    model_path = Path(model_dir)
+    if SHORTLIST_PATH:
+        vocab_shortlist = Shortlist.load(SHORTLIST_PATH)
+        logger.info(f"✅ Shortlist cargada desde {SHORTLIST_PATH}")
+    
+    if not prefer_onnx:
+        logger.info("Backend PyTorch solicitado")
+        load_pytorch_model(model_path)
+    else:
+        try:
+            logger.info(f"Intentando cargar modelos ONNX (encoder + decoder) desde {model_path}")
             
-            # Cargar tokenizer desde el directorio padre
-            tokenizer_path = model_path.parent if model_path.name == "onnx_models" else model_path
+            # Cargar encoder, decoder y decoder con cache KV
+            model_session = OnnxMarianGenerator.from_pretrained(
+                str(model_path), onnx_session_options(), use_quantized=use_quantized,
+                speculative=SPECULATIVE, num_draft_tokens=DRAFT_TOKENS, shortlist=vocab_shortlist,
+                **onnx_generator_options()
+            )
+            model_session.observer = observe_stage
+            model_session.encoder_cache = encoder_cache
+            use_onnx = True
             
-            # Cargar modelo PyTorch
-            model_session = MarianMTModel.from_pretrained(str(tokenizer_path))
-            model_session.eval()
-            use_onnx = False
+            logger.info("✅ Modelo ONNX cargado exitosamente")
             
-            logger.info("✅ Modelo PyTorch cargado exitosamente")
-        else:
-            raise
+        except Exception as e:
+            if fallback_to_pytorch:
+                logger.warning(f"No se pudo cargar modelo ONNX: {e}")
+                logger.info("Usando modelo PyTorch como fallback...")
+                load_pytorch_model(model_path)
+            else:
+                raise
     
-    # Cargar tokenizer
+    # Cargar tokenizer: artefacto precompilado (tokenizer.bin) o source/target.spm + vocab.json
     tokenizer_path = model_path.parent if model_path.name == "onnx_models" else model_path
-    tokenizer = MarianTokenizer.from_pretrained(str(tokenizer_path))
+    if (tokenizer_path / "source.spm").exists():
+        tokenizer = load_tokenizer(str(tokenizer_path))
+    else:
+        from transformers import MarianTokenizer
+        tokenizer = MarianTokenizer.from_pretrained(str(tokenizer_path))
     
     logger.info(f"✅ Tokenizer cargado desde {tokenizer_path}")
+    
+    backend = ("onnx-int8" if use_quantized else "onnx-fp32") if use_onnx else "pytorch"
+    if shortlist_enabled():
+        # La shortlist puede cambiar alguna traducción: no mezclar entradas del cache
+        backend += f"+shortlist:{Path(SHORTLIST_PATH).resolve()}"
+    model_id = f"{tokenizer_path.resolve()}:{backend}"
+    registry.register(DEFAULT_PAIR, PairModel(DEFAULT_PAIR, model_session, tokenizer, model_id, use_onnx, draft_model))
+    
+    if SPECULATIVE and NUM_BEAMS != 1 and not ADAPTIVE_DECODING:
+        logger.warning("SPECULATIVE=1 solo tiene efecto con NUM_BEAMS=1 (greedy)")
 
-def translate_text(text: str, max_length: int = 512) -> str:
+def load_pair(pair: str, location: str) -> PairModel:
     """
-    Traduce texto usando ONNX o PyTorch
+    Carga un par de MODEL_PAIRS: ONNX si location/onnx_models tiene los modelos
+    (y el backend es ONNX), si no PyTorch desde un directorio local o el Hub.
+    El draft especulativo y la shortlist son solo del par de arranque
     """
-    if use_onnx:
-        # Usar modelo ONNX
-        inputs = tokenizer(text, return_tensors="np", padding=True, truncation=True, max_length=max_length)
+    path = Path(location)
+    use_quantized = MODEL_BACKEND != "onnx-fp32"
+    suffix = "_quantized" if use_quantized else ""
+    onnx_dir = path / "onnx_models"
+    
+    if MODEL_BACKEND != "pytorch" and any((onnx_dir / f"encoder_model{suffix}{ext}").exists() for ext in (".onnx", ".ort")):
+        pair_model = OnnxMarianGenerator.from_pretrained(str(onnx_dir), onnx_session_options(), use_quantized=use_quantized,
+                                                         **onnx_generator_options())
+        pair_model.observer = observe_stage
+        pair_model.encoder_cache = encoder_cache
+        warm_up_buckets(pair_model)
+        backend = MODEL_BACKEND
+    elif has_local_weights(location):
+        pair_model = load_marian_mmap(location)
+        backend = "pytorch"
+    else:
+        from transformers import MarianMTModel
+        pair_model = MarianMTModel.from_pretrained(location, token=os.getenv("HF_TOKEN"))
+        pair_model.eval()
+        backend = "pytorch"
+    
+    if (path / "source.spm").exists():
+        pair_tokenizer = load_tokenizer(location)
+    else:
+        from transformers import MarianTokenizer
+        pair_tokenizer = MarianTokenizer.from_pretrained(location, token=os.getenv("HF_TOKEN"))
+    
+    name = str(path.resolve()) if path.exists() else location
+    return PairModel(pair, pair_model, pair_tokenizer, f"{name}:{backend}", backend != "pytorch")
+
+registry = ModelRegistry(load_pair, MODEL_PAIRS, max_bytes=int(MODEL_MEMORY_MB * 1024 * 1024))
+
+def encode_pytorch(entry: PairModel, inputs):
+    """Salidas del encoder PyTorch, reutilizando las frases que ya estén en el cache del encoder"""
+    encoder = entry.model.get_encoder()
+    if encoder_cache is None:
+        return encoder(**inputs)
+    from transformers.modeling_outputs import BaseModelOutput
+    hidden_states = encoder_cache.encode(
+        inputs["input_ids"], inputs["attention_mask"],
+        lambda input_ids, attention_mask: encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state,
+        entry.model_id
+    )
+    return BaseModelOutput(last_hidden_state=hidden_states)
+
+def translate_texts(texts: list[str], max_length: int = 512, pair: str = DEFAULT_PAIR, num_beams: int = NUM_BEAMS,
+                    length_penalty: float = 1.0) -> list[str]:
+    """
+    Traduce un lote de textos en una sola pasada usando ONNX o PyTorch
+    """
+    metrics.BATCH_SIZE.observe(len(texts))
+    entry = registry.get(pair)
+    session, tokenizer = entry.model, entry.tokenizer
+    
+    if entry.use_onnx:
+        # Usar modelo ONNX: encoder una vez + decodificación paso a paso con cache KV
+        with timed("tokenize"):
+            inputs = tokenizer(texts, return_tensors="np", padding=True, truncation=True, max_length=max_length)
         
-        # Ejecutar modelo ONNX
-        outputs = model_session.run(
-            None,
-            {
-                "input_ids": inputs["input_ids"].astype(np.int64),
-                "attention_mask": inputs["attention_mask"].astype(np.int64)
-            }
+        # El generador reporta encoder, decoder y decoder_step vía observe_stage
+        start = time.perf_counter()
+        output_ids = session.generate(
+            inputs["input_ids"],
+            inputs["attention_mask"],
+            max_length=max_length,
+            num_beams=num_beams,
+            length_penalty=length_penalty
         )
-        
-        # El output es una tupla, tomar el primer elemento (logits)
-        output_ids = outputs[0]
-        
-        # Decodificar - tomar el token con mayor probabilidad para cada posición
-        if len(output_ids.shape) == 3:  # (batch, seq, vocab)
-            predicted_ids = np.argmax(output_ids[0], axis=-1)
-        else:
-            predicted_ids = output_ids[0]
-        
-        translated_text = tokenizer.decode(predicted_ids, skip_special_tokens=True)
+        decoder_seconds = time.perf_counter() - start
         
     else:
         # Usar modelo PyTorch
-        inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True, max_length=max_length)
+        import torch
+        with timed("tokenize"):
+            inputs = tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=max_length)
         
-        with torch.no_grad():
-            outputs = model_session.generate(
-                **inputs,
+        vocab = None
+        if vocab_shortlist is not None and pair == DEFAULT_PAIR:
+            vocab = vocab_shortlist.candidates(inputs["input_ids"].numpy())
+        with torch.no_grad(), restrict(vocab):
+            # Encoder por separado para poder medir cada etapa
+            with timed("encoder"):
+                encoder_outputs = encode_pytorch(entry, inputs)
+            
+            # Generación asistida: HF solo la admite con lotes de una frase. El draft
+            # comparte encoder con el modelo principal, así que reutiliza sus salidas
+            assisted = {}
+            if entry.draft_model is not None and num_beams == 1 and len(texts) == 1:
+                assisted = {"assistant_model": entry.draft_model, "assistant_encoder_outputs": encoder_outputs}
+            
+            start = time.perf_counter()
+            output_ids = session.generate(
+                encoder_outputs=encoder_outputs,
+                attention_mask=inputs["attention_mask"],
                 max_length=max_length,
-                num_beams=4,
-                early_stopping=True
+                num_beams=num_beams,
+                length_penalty=length_penalty,
+                early_stopping=True,
+                **assisted
             )
+            decoder_seconds = time.perf_counter() - start
+            observe_stage("decoder", decoder_seconds)
+            observe_stage("decoder_step", decoder_seconds / max(output_ids.shape[1] - 1, 1))
+    
+    # Tiempo por paso con estos beams para el presupuesto de latencia de la política
+    decoding_policy.record_step(num_beams, decoder_seconds / max(output_ids.shape[1] - 1, 1))
+    metrics.INPUT_TOKENS.inc(int(inputs["attention_mask"].sum()))
+    metrics.OUTPUT_TOKENS.inc(int((output_ids != tokenizer.pad_token_id).sum()))
+    
+    with timed("detokenize"):
+        return tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+def translate_text(text: str, max_length: int = 512, pair: str = DEFAULT_PAIR, num_beams: int = NUM_BEAMS,
+                   length_penalty: float = 1.0) -> str:
+    """
+    Traduce texto usando ONNX o PyTorch
+    """
+    return translate_texts([text], max_length, pair, num_beams, length_penalty)[0]
+
+def translate_texts_bucketed(texts: list[str], max_length: int = 512, pair: str = DEFAULT_PAIR,
+                             num_beams: int = NUM_BEAMS, length_penalty: float = 1.0) -> list[str]:
+    """
+    Traduce textos de longitudes mezcladas en lotes de longitud similar
+    (menos padding) y devuelve los resultados en el orden original
+    """
+    encoded = registry.get(pair).tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]
+    return run_bucketed(
+        [len(ids) for ids in encoded],
+        lambda indices: translate_texts([texts[i] for i in indices], max_length, pair, num_beams, length_penalty),
+        max_tokens_per_batch=BUCKET_MAX_TOKENS,
+        max_batch_size=BUCKET_MAX_SIZE,
+        executor=bucket_executor
+    )
+
+def translate_many(texts: list[str], max_length: int = 512, pair: str = DEFAULT_PAIR, num_beams: int = NUM_BEAMS,
+                   length_penalty: float = 1.0) -> list[str]:
+    """
+    Traduce una lista de textos consultando el cache por texto; los fallos
+    se traducen (una vez por texto distinto) en lotes de longitud similar
+    para reducir el padding
+    """
+    entry = registry.get(pair)
+    translations = [translation_cache.get(t, entry.model_id, max_length, num_beams) for t in texts]
+    misses = [i for i, translated_text in enumerate(translations) if translated_text is None]
+    
+    if misses:
+        miss_texts = list(dict.fromkeys(texts[i] for i in misses))
+        by_text = dict(zip(miss_texts, translate_texts_bucketed(miss_texts, max_length, pair, num_beams,
+                                                                length_penalty)))
+        for text, translated_text in by_text.items():
+            translation_cache.put(text, translated_text, entry.model_id, max_length, num_beams)
+        for i in misses:
+            translations[i] = by_text[texts[i]]
+    
+    return translations
+
+def translate_document(text: str, max_length: int = 512, pair: str = DEFAULT_PAIR, num_beams: int = NUM_BEAMS,
+                       length_penalty: float = 1.0) -> tuple[str, int]:
+    """
+    Traduce un documento largo frase a frase (sin truncarlo) y lo reconstruye
+    con los espacios y saltos de línea originales. Devuelve (texto, nº de segmentos)
+    """
+    segments, separators = split_segments(text)
+    if not segments:
+        return text, 0
+    translations = translate_many(segments, max_length, pair, num_beams, length_penalty)
+    return join_segments(translations, separators), len(segments)
+
+def stream_translation(text: str, max_length: int = 512, pair: str = DEFAULT_PAIR):
+    """
+    Traduce texto de forma incremental, devolviendo fragmentos de texto a
+    medida que el decoder genera tokens. Usa decodificación greedy: beam
+    search no puede confirmar ningún token hasta el final.
+    """
+    entry = registry.get(pair)
+    session, tokenizer = entry.model, entry.tokenizer
+    if entry.use_onnx:
+        inputs = tokenizer(text, return_tensors="np", truncation=True, max_length=max_length)
         
-        translated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
+        token_ids = []
+        emitted = ""
+        for token_id in session.stream(inputs["input_ids"], inputs["attention_mask"], max_length=max_length):
+            token_ids.append(token_id)
+            # Detokenizar todo lo generado y emitir solo lo nuevo
+            partial = tokenizer.decode(token_ids, skip_special_tokens=True)
+            if len(partial) > len(emitted) and partial.startswith(emitted):
+                yield partial[len(emitted):]
+                emitted = partial
     
-    return translated_text
+    else:
+        import torch
+        from transformers import TextIteratorStreamer
+        inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=max_length)
+        streamer = TextIteratorStreamer(tokenizer, skip_special_tokens=True)
+        
+        vocab = None
+        if vocab_shortlist is not None and pair == DEFAULT_PAIR:
+            vocab = vocab_shortlist.candidates(inputs["input_ids"].numpy())
+        
+        def generate():
+            with torch.no_grad(), restrict(vocab):
+                session.generate(**inputs, max_length=max_length, num_beams=1, streamer=streamer)
+        
+        thread = threading.Thread(target=generate, daemon=True)
+        thread.start()
+        for piece in streamer:
+            if piece:
+                yield piece
+        thread.join()
 
-@app.on_event("startup")
-async def startup_event():
-    """Cargar modelos al iniciar el servidor"""
+# Micro-batching: agrupa peticiones concurrentes de /translate en un solo lote
+batcher = MicroBatcher(
+    translate_texts,
+    max_batch_size=int(os.getenv("BATCH_MAX_SIZE", "16")),
+    max_wait_ms=float(os.getenv("BATCH_MAX_WAIT_MS", "5")),
+    observer=observe_stage,
+    executor=inference_executor,
+    max_queue=int(os.getenv("BATCH_MAX_QUEUE", "256"))
+)
+
+# Peticiones idénticas en vuelo (mismo texto, par y parámetros) comparten una sola traducción
+inflight = SingleFlight()
+
+def overloaded_error() -> HTTPException:
+    """429 con Retry-After para que el cliente reintente más tarde"""
+    return HTTPException(status_code=429, detail="Servidor saturado, reintenta en unos segundos",
+                         headers={"Retry-After": "1"})
+
+def timeout_error() -> HTTPException:
+    return HTTPException(status_code=504, detail="La traducción superó el tiempo máximo")
+
+def current_load() -> float:
+    """
+    Ocupación de la inferencia (0 = libre, 1 = colas llenas) para la política
+    de decodificación, con el lote de un trabajo en segundo plano en curso
+    """
+    return inference_load(inference_executor, batcher, int(job_runner.busy))
+
+def choose_decoding(text: str, max_length: int, quality: Optional[str] = None,
+                    latency_budget_ms: Optional[float] = None) -> DecodingChoice:
+    """Parámetros de generación para la petición con la carga actual (400 si la pista no es válida)"""
+    check_quality(quality)
+    return decoding_policy.choose(text, max_length, current_load(), quality, latency_budget_ms)
+
+def count_decoding(choice: DecodingChoice):
+    """Cuenta la elección en translation_decoding_choices_total (solo lo que llega al modelo)"""
+    metrics.DECODING_CHOICES.inc(num_beams=choice.num_beams, reason=choice.reason)
+
+def cached_translation(text: str, entry: PairModel, choice: DecodingChoice) -> Optional[str]:
+    """
+    Busca en el cache con los beams elegidos o con más: bajo carga se
+    aprovechan las traducciones de mejor calidad hechas sin carga
+    """
+    for num_beams in sorted({choice.num_beams, NUM_BEAMS, MAX_BEAMS}, reverse=True):
+        if num_beams >= choice.num_beams:
+            translated = translation_cache.get(text, entry.model_id, choice.max_length, num_beams)
+            if translated is not None:
+                return translated
+    return None
+
+# Trabajos en segundo plano (/jobs): listas o ficheros grandes que se traducen por bloques,
+# guardados en disco (un reinicio los retoma) y con prioridad para el tráfico interactivo
+job_store = JobStore(
+    os.getenv("JOBS_DIR", "./jobs"),
+    max_texts=int(os.getenv("JOB_MAX_TEXTS", "100000")),
+    retention_s=float(os.getenv("JOB_RETENTION_H", "24")) * 3600
+)
+job_runner = JobRunner(
+    job_store, job_chunk_translator(registry, translation_memory, translate_many),
+    lambda: interactive_idle(ready, inference_executor, batcher),
+    chunk_size=int(os.getenv("JOB_CHUNK_SIZE", "32")), batch_size=int(os.getenv("JOB_BATCH_SIZE", "8"))
+)
+
+def preload_models():
+    """
+    Precarga para el modo pre-fork de start.py (se ejecuta en el maestro antes del fork)
+    
+    - PyTorch: carga el modelo completo; los workers lo heredan copy-on-write.
+    - ONNX: solo lee los bytes de los modelos .ort. Las sesiones de onnxruntime
+      no sobreviven a un fork (sus thread pools no se heredan), así que cada
+      worker crea las suyas en el startup usando esos bytes como pesos compartidos.
+    """
+    if MODEL_BACKEND == "pytorch":
+        load_models(prefer_onnx=False)
+        return
+    found = preload_model_bytes(ONNX_MODEL_DIR, use_quantized=MODEL_BACKEND != "onnx-fp32")
+    if found:
+        logger.info(f"✅ {found} modelos ORT precargados para compartir entre workers")
+    else:
+        logger.warning("No hay modelos .ort en el directorio ONNX: cada worker cargará su propia copia")
+
+def speculative_enabled() -> bool:
+    """
+    La decodificación especulativa solo se usa con greedy: NUM_BEAMS=1 o las
+    peticiones para las que la política adaptativa elige greedy
+    """
+    if NUM_BEAMS != 1 and not ADAPTIVE_DECODING:
+        return False
+    return getattr(model_session, "speculative", False) if use_onnx else draft_model is not None
+
+def shortlist_enabled() -> bool:
+    """En ONNX la shortlist necesita los decoders exportados con convert_to_onnx.py --shortlist"""
+    if vocab_shortlist is None:
+        return False
+    return getattr(model_session, "shortlist_sessions", None) is not None if use_onnx else True
+
+def warm_up():
+    """Traducciones de calentamiento: reserva memoria y compila kernels antes de recibir tráfico"""
+    if not WARMUP_TEXT or WARMUP_RUNS <= 0:
+        return
+    start = time.perf_counter()
+    for _ in range(WARMUP_RUNS):
+        translate_texts([WARMUP_TEXT], 64)
+    logger.info(f"✅ Calentamiento completado en {time.perf_counter() - start:.2f}s")
+    if use_onnx:
+        warm_up_buckets(model_session)
+
+def apply_thread_config(config: ThreadConfig):
+    """
+    Aplica threads y sesiones concurrentes. Con ONNX solo se recrean las
+    sesiones del par de arranque (los threads se fijan al crearlas), desde
+    los modelos que ya usa el generador
+    """
+    global INTRA_OP_THREADS, INTER_OP_THREADS
+    changed = (config.intra_op, config.inter_op) != (INTRA_OP_THREADS, INTER_OP_THREADS)
+    INTRA_OP_THREADS, INTER_OP_THREADS = config.intra_op, config.inter_op
+    inference_executor.resize(config.sessions)
+    if not use_onnx:
+        import torch
+        torch.set_num_threads(config.intra_op)
+    elif changed:
+        model_session.recreate_sessions(onnx_session_options())
+
+def tune_threads():
+    """
+    THREAD_TUNING=1: aplica la configuración de threads guardada para esta
+    máquina, modelo y objetivo, o la mide si no la hay. Si no, se usan
+    INTRA_OP_THREADS, INTER_OP_THREADS e INFERENCE_WORKERS
+    """
+    global thread_decision, encoder_cache
+    # Las frases de prueba se repiten: sin cache del encoder durante las medidas
+    saved_cache = encoder_cache
+    if THREAD_TUNING:
+        encoder_cache = None
+        if use_onnx:
+            model_session.encoder_cache = None
     try:
-        load_models(use_quantized=True, fallback_to_pytorch=True)
+        thread_decision = configure_threads(
+            THREAD_TUNING, ThreadConfig(INTRA_OP_THREADS, INTER_OP_THREADS, INFERENCE_WORKERS), model_id,
+            apply_thread_config, lambda text: batcher.submit_from_thread(text, 128, DEFAULT_PAIR, NUM_BEAMS, 1.0),
+            processes=int(os.getenv("WORKERS", "1")), inter_op=use_onnx, objective=THREAD_TUNING_OBJECTIVE,
+            path=THREAD_TUNING_PATH, seconds=THREAD_TUNING_SECONDS, log=logger.info
+        )
+    finally:
+        encoder_cache = saved_cache
+        if use_onnx:
+            model_session.encoder_cache = encoder_cache
+
+def load_and_warm_up():
+    """Carga (si hace falta) y calienta los modelos; al terminar el servidor está listo"""
+    global ready, load_error, startup_seconds
+    try:
+        # Con el pre-fork de start.py el modelo PyTorch ya viene cargado del maestro
+        if model_session is None:
+            load_models(
+                use_quantized=MODEL_BACKEND != "onnx-fp32",
+                fallback_to_pytorch=True,
+                prefer_onnx=MODEL_BACKEND != "pytorch"
+            )
+        tune_threads()
+        warm_up()
     except Exception as e:
         logger.error(f"Error cargando modelos: {e}")
-        raise
+        load_error = str(e)
+        return
+    ready = True
+    startup_seconds = time.perf_counter() - import_time
+    logger.info(f"✅ Servidor listo en {startup_seconds:.2f}s")
+
+def ensure_ready():
+    """503 mientras los modelos se cargan/calientan"""
+    if not ready:
+        raise HTTPException(status_code=503, detail="El modelo se está cargando",
+                            headers={"Retry-After": "5"})
+
+@app.on_event("startup")
+async def startup_event():
+    """Arranca el micro-batcher y carga los modelos en segundo plano"""
+    await batcher.start()
+    await job_runner.start()
+    # El servidor acepta conexiones enseguida (/health/live); /health/ready
+    # pasa a 200 cuando los modelos están cargados y calentados
+    asyncio.get_running_loop().run_in_executor(None, load_and_warm_up)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Detener el worker de micro-batching y el pool de inferencia"""
+    await batcher.stop()
+    await job_runner.stop()
+    inference_executor.shutdown()
 
 @app.get("/")
 async def root():
@@ -155,7 +714,7 @@ async def root():
     return {
         "status": "online",
         "message": "Translation API is running",
-        "model": "MarianMT en->es",
+        "model": f"MarianMT {DEFAULT_SOURCE}->{DEFAULT_TARGET}",
         "optimized_for": "mobile",
         "using_onnx": use_onnx
     }
@@ -165,54 +724,322 @@ async def health():
     """Health check"""
     return {
         "status": "healthy",
+        "ready": ready,
         "models_loaded": model_session is not None,
-        "using_onnx": use_onnx
+        "using_onnx": use_onnx,
+        "backend": MODEL_BACKEND if use_onnx else "pytorch",
+        "speculative": speculative_enabled(),
+        "shortlist": shortlist_enabled(),
+        "length_buckets": list(ONNX_LENGTH_BUCKETS) if use_onnx else None,
+        "languages": registry.stats(),
+        "threads": thread_decision,
+        "startup_seconds": startup_seconds
     }
 
+@app.get("/health/live")
+async def health_live():
+    """Liveness: el proceso responde (falla solo si la carga de modelos falló)"""
+    if load_error is not None:
+        return JSONResponse(status_code=503, content={"status": "error", "detail": load_error})
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: modelos cargados y calentados"""
+    if not ready:
+        return JSONResponse(status_code=503, content={"status": "loading", "detail": load_error})
+    return {"status": "ready", "startup_seconds": startup_seconds}
+
+@app.get("/languages")
+async def languages():
+    """Pares de idiomas disponibles y cargados en memoria"""
+    return registry.stats()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Aciertos/fallos y ocupación del cache de traducciones, del cache del encoder y de la memoria de traducción"""
+    stats = translation_cache.stats()
+    if encoder_cache is not None:
+        stats["encoder"] = encoder_cache.stats()
+    if translation_memory is not None:
+        stats["memory"] = translation_memory.stats()
+    return stats
+
+metrics.register_callback(
+    "translation_backend_info", "Backend activo (etiquetas)",
+    lambda: {(("backend", MODEL_BACKEND if use_onnx else "pytorch"), ("use_onnx", str(use_onnx).lower()), ("model", str(model_id))): 1}
+)
+metrics.register_callback(
+    "translation_draft_tokens", "Tokens propuestos por el draft (especulativa ONNX) por resultado",
+    lambda: {(("result", "proposed"),): getattr(model_session, "draft_proposed", 0),
+             (("result", "accepted"),): getattr(model_session, "draft_accepted", 0)}
+)
+metrics.register_callback(
+    "translation_shortlist_candidates", "Media de tokens candidatos por lote con la shortlist léxica",
+    lambda: vocab_shortlist.candidates_total / max(vocab_shortlist.batches, 1) if vocab_shortlist is not None else 0
+)
+register_metrics(sys.modules[__name__])
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Métricas en formato Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/translate", response_model=TranslationResponse)
 async def translate(request: TranslationRequest):
     """
     Endpoint de traducción
     
-    - **text**: Texto a traducir (inglés -> español)
+    - **text**: Texto a traducir
     - **max_length**: Longitud máxima de la traducción (default: 512)
+    - **source_language** / **target_language**: Par de idiomas (default: DEFAULT_PAIR)
+    - **quality**: "fast" (greedy), "balanced" (default) o "best"
+    - **latency_budget_ms**: Presupuesto de latencia; se reducen los beams si no cabe
+    
+    Con el servidor cargado se usan menos beams (greedy si está saturado); los
+    parámetros usados se devuelven en **decoding**.
     """
     if not request.text.strip():
         raise HTTPException(status_code=400, detail="El texto no puede estar vacío")
+    ensure_ready()
+    entry = await resolve_pair(registry, request.source_language, request.target_language)
+    # La pista de calidad se valida aunque responda la memoria
+    check_quality(request.quality)
+    match = memory_lookup(translation_memory, request.text, entry)
+    if match is not None and match.exact:
+        return TranslationResponse(
+            translated_text=match.target,
+            source_language=request.source_language,
+            target_language=request.target_language,
+            origin="memory",
+            memory=match.as_dict()
+        )
+    choice = choose_decoding(request.text, request.max_length, request.quality, request.latency_budget_ms)
     
     try:
-        translated = translate_text(request.text, request.max_length)
+        translated = cached_translation(request.text, entry, choice)
+        if translated is None:
+            count_decoding(choice)
+            params = (choice.max_length, entry.pair, choice.num_beams, choice.length_penalty)
+            translated = await asyncio.wait_for(
+                inflight.do((request.text,) + params, batcher.submit, request.text, *params),
+                REQUEST_TIMEOUT_S
+            )
+            translation_cache.put(request.text, translated, entry.model_id, choice.max_length, choice.num_beams)
         return TranslationResponse(
             translated_text=translated,
-            source_language="en",
-            target_language="es"
+            source_language=request.source_language,
+            target_language=request.target_language,
+            decoding=choice.as_dict(),
+            memory=match.as_dict() if match is not None else None
         )
+    except QueueFullError:
+        raise overloaded_error()
+    except asyncio.TimeoutError:
+        raise timeout_error()
     except Exception as e:
         logger.error(f"Error en traducción: {e}")
         raise HTTPException(status_code=500, detail=f"Error en traducción: {str(e)}")
 
+@app.post("/translate/document", response_model=DocumentTranslationResponse)
+async def translate_document_endpoint(request: TranslationRequest):
+    """
+    Traducción de documentos largos (artículos de ayuda, etc.)
+    
+    El texto se divide en frases/párrafos que se traducen como un lote
+    ordenado por longitud; **max_length** se aplica a cada frase, no al
+    documento, así que nada se trunca en silencio. Los beams se eligen para
+    todo el documento; length_penalty y max_length no se adaptan porque las
+    frases tienen longitudes distintas.
+    """
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="El texto no puede estar vacío")
+    ensure_ready()
+    entry = await resolve_pair(registry, request.source_language, request.target_language)
+    choice = choose_decoding(request.text, request.max_length, request.quality, request.latency_budget_ms)
+    choice = DecodingChoice(choice.num_beams, 1.0, request.max_length, choice.reason)
+    count_decoding(choice)
+    
+    try:
+        translated, segments = await inference_executor.run(
+            translate_document, request.text, choice.max_length, entry.pair, choice.num_beams,
+            timeout=REQUEST_TIMEOUT_S
+        )
+        return DocumentTranslationResponse(
+            translated_text=translated,
+            source_language=request.source_language,
+            target_language=request.target_language,
+            segments=segments,
+            decoding=choice.as_dict()
+        )
+    except QueueFullError:
+        raise overloaded_error()
+    except asyncio.TimeoutError:
+        raise timeout_error()
+    except Exception as e:
+        logger.error(f"Error en traducción de documento: {e}")
+        raise HTTPException(status_code=500, detail=f"Error en traducción: {str(e)}")
+
+def inference_saturated() -> bool:
+    """
+    El streaming decodifica token a token en el threadpool de Starlette, fuera
+    del InferenceExecutor; al menos se rechaza cuando la cola de inferencia
+    ya está llena para no añadir más carga
+    """
+    return inference_executor.pending >= inference_executor.max_workers + inference_executor.max_queue
+
+def _cached_or_stream(text: str, max_length: int, entry: PairModel):
+    """Si la traducción está en cache (con cualquier número de beams) se emite completa de una vez"""
+    cached = cached_translation(text, entry, decoding_policy.choose(text, max_length, quality="fast"))
+    if cached is not None:
+        return iter([cached])
+    return stream_translation(text, max_length, entry.pair)
+
+@app.post("/translate/stream")
+async def translate_stream(request: TranslationRequest):
+    """
+    Traducción en streaming (Server-Sent Events)
+    
+    Emite eventos `data: {"delta": "..."}` a medida que se decodifica y un
+    evento final `event: done` con el texto completo.
+    """
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="El texto no puede estar vacío")
+    ensure_ready()
+    if inference_saturated():
+        raise overloaded_error()
+    entry = await resolve_pair(registry, request.source_language, request.target_language)
+    
+    def events():
+        translated = ""
+        try:
+            for delta in _cached_or_stream(request.text, request.max_length, entry):
+                translated += delta
+                yield f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            logger.error(f"Error en traducción en streaming: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)}, ensure_ascii=False)}\n\n"
+            return
+        done = {"translated_text": translated, "source_language": request.source_language,
+                "target_language": request.target_language}
+        yield f"event: done\ndata: {json.dumps(done, ensure_ascii=False)}\n\n"
+    
+    # StreamingResponse itera el generador síncrono en el threadpool
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.websocket("/translate/ws")
+async def translate_ws(websocket: WebSocket):
+    """
+    Traducción en streaming por WebSocket
+    
+    El cliente envía `{"text": "...", "max_length": 512}` (opcionalmente con
+    `source_language` y `target_language`) y recibe mensajes
+    `{"delta": "..."}` seguidos de `{"done": true, "translated_text": "..."}`.
+    La conexión se puede reutilizar para varias traducciones.
+    """
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive_json()
+            try:
+                request = TranslationRequest(**message)
+            except Exception as e:
+                await websocket.send_json({"error": f"Petición inválida: {e}"})
+                continue
+            if not request.text.strip():
+                await websocket.send_json({"error": "El texto no puede estar vacío"})
+                continue
+            if not ready:
+                await websocket.send_json({"error": "El modelo se está cargando", "status": 503})
+                continue
+            if inference_saturated():
+                await websocket.send_json({"error": "Servidor saturado, reintenta en unos segundos", "status": 429})
+                continue
+            try:
+                entry = await resolve_pair(registry, request.source_language, request.target_language)
+            except HTTPException as e:
+                await websocket.send_json({"error": e.detail, "status": e.status_code})
+                continue
+            
+            translated = ""
+            try:
+                async for delta in iterate_in_threadpool(_cached_or_stream(request.text, request.max_length, entry)):
+                    translated += delta
+                    await websocket.send_json({"delta": delta})
+            except Exception as e:
+                logger.error(f"Error en traducción en streaming: {e}")
+                await websocket.send_json({"error": f"Error en traducción: {str(e)}"})
+                continue
+            await websocket.send_json({
+                "done": True,
+                "translated_text": translated,
+                "source_language": request.source_language,
+                "target_language": request.target_language
+            })
+    except WebSocketDisconnect:
+        pass
+
+def _translate_batch_items(texts: list[str], choices: list[DecodingChoice], entry: PairModel) -> list[dict]:
+    """
+    Los fallos del cache se agrupan por parámetros de decodificación y cada
+    grupo se traduce como lotes por longitud (una sesión por lote, no por
+    frase); los textos repetidos se traducen una vez. Lo que está en la
+    memoria de traducción (coincidencia exacta) no llega al modelo
+    """
+    items = [(text, choice) for text, choice in zip(texts, choices) if text.strip()]
+    matches = [memory_lookup(translation_memory, text, entry) for text, _ in items]
+    translations = [match.target if match is not None and match.exact else cached_translation(text, entry, choice)
+                    for (text, choice), match in zip(items, matches)]
+    
+    groups = {}
+    for i, (text, choice) in enumerate(items):
+        if translations[i] is None:
+            count_decoding(choice)
+            params = (choice.max_length, choice.num_beams, choice.length_penalty)
+            groups.setdefault(params, {}).setdefault(text, []).append(i)
+    for (max_length, num_beams, length_penalty), by_text in groups.items():
+        unique = list(by_text)
+        for text, translated in zip(unique, translate_texts_bucketed(unique, max_length, entry.pair, num_beams,
+                                                                     length_penalty)):
+            translation_cache.put(text, translated, entry.model_id, max_length, num_beams)
+            for i in by_text[text]:
+                translations[i] = translated
+    
+    return [{"original": text, "translated": translated,
+             "decoding": None if match is not None and match.exact else choice.as_dict(),
+             "origin": "memory" if match is not None and match.exact else "model",
+             "memory": match.as_dict() if match is not None else None}
+            for (text, choice), translated, match in zip(items, translations, matches)]
+
 @app.post("/translate/batch")
-async def translate_batch(texts: list[str], max_length: int = 512):
+async def translate_batch(texts: list[str], max_length: int = 512, source_language: str = DEFAULT_SOURCE,
+                          target_language: str = DEFAULT_TARGET, quality: Optional[str] = None):
     """
     Endpoint de traducción por lotes
     """
     if not texts:
         raise HTTPException(status_code=400, detail="La lista de textos no puede estar vacía")
+    ensure_ready()
+    entry = await resolve_pair(registry, source_language, target_language)
+    choices = [choose_decoding(text, max_length, quality) for text in texts]
     
     try:
-        results = []
-        for text in texts:
-            if text.strip():
-                translated = translate_text(text, max_length)
-                results.append({
-                    "original": text,
-                    "translated": translated
-                })
+        results = await inference_executor.run(_translate_batch_items, texts, choices, entry,
+                                               timeout=REQUEST_TIMEOUT_S)
         return {"translations": results, "count": len(results)}
+    except QueueFullError:
+        raise overloaded_error()
+    except asyncio.TimeoutError:
+        raise timeout_error()
     except Exception as e:
         logger.error(f"Error en traducción por lotes: {e}")
         raise HTTPException(status_code=500, detail=f"Error en traducción: {str(e)}")
 
+# Trabajos en segundo plano: POST /jobs, POST /jobs/upload, GET /jobs/{id}, GET /jobs/{id}/results
+# y DELETE /jobs/{id}
+app.include_router(jobs_router(job_store, job_runner, registry, decoding_policy, DEFAULT_PAIR,
+                               default_max_length=512))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
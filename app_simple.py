@@ -4,12 +4,32 @@ Optimizado para uso en móviles con mínima latencia
 """
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-import torch
-from transformers import MarianMTModel, MarianTokenizer
+from typing import Optional
 from pathlib import Path
+import asyncio
 import logging
 import os
+import sys
+import time
+from batching import MicroBatcher, InferenceExecutor, QueueFullError, SingleFlight, run_bucketed
+from concurrent.futures import ThreadPoolExecutor
+from translation_cache import TranslationCache
+import metrics
+from metrics import timed
+from segmentation import split_segments, join_segments
+from marian_tokenizer import load_tokenizer
+from model_loader import has_local_weights, load_marian_mmap, build_draft_model, parse_layers
+from model_registry import ModelRegistry, PairModel, parse_pairs
+from decoding_policy import DecodingChoice, DecodingPolicy
+from encoder_cache import EncoderCache
+from translation_memory import TranslationMemory
+from jobs import JobRunner, JobStore
+from serving import (check_quality, inference_load, interactive_idle, job_chunk_translator, jobs_router,
+                     memory_lookup, register_metrics, resolve_pair)
+from thread_tuning import ThreadConfig, configure_threads
+# torch y transformers se importan al cargar el modelo, no al importar la app
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
@@ -30,38 +50,174 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Modelos globales
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    """Cuenta peticiones y mide la latencia de cada endpoint"""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    endpoint = getattr(route, "path", request.url.path)
+    metrics.REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    return response
+
+def observe_stage(stage: str, seconds: float):
+    """Callback para el generador ONNX y el micro-batcher"""
+    metrics.STAGE_SECONDS.observe(seconds, stage=stage)
+
+# Modelos globales (par de arranque; el resto de pares viven en registry)
 model = None
 tokenizer = None
+model_id = None  # Identifica el modelo en las claves del cache
+draft_model = None  # Draft para la decodificación especulativa
+ready = False  # Modelo cargado y calentado: /health/ready
+load_error = None
+import_time = time.perf_counter()
+startup_seconds = None
+
+NUM_BEAMS = int(os.getenv("NUM_BEAMS", "2"))  # Reducido de 4 para mayor velocidad
+INTRA_OP_THREADS = int(os.getenv("INTRA_OP_THREADS", "2"))  # Threads por proceso (start.py lo ajusta por worker)
+# Auto-ajuste al arrancar: mide combinaciones de threads intra-op y sesiones concurrentes con
+# el modelo real y guarda la mejor para THREAD_TUNING_OBJECTIVE (latency, throughput o balanced)
+THREAD_TUNING = os.getenv("THREAD_TUNING", "0") == "1"
+THREAD_TUNING_OBJECTIVE = os.getenv("THREAD_TUNING_OBJECTIVE", "balanced")
+THREAD_TUNING_PATH = os.getenv("THREAD_TUNING_PATH", "thread_tuning.json")  # Decisiones para los siguientes arranques
+THREAD_TUNING_SECONDS = float(os.getenv("THREAD_TUNING_SECONDS", "2"))  # Medida por combinación
+thread_decision = None  # Configuración de threads en uso y su origen (/health)
+MODEL_DIR = os.getenv("MODEL_DIR", "")  # Directorio local del modelo: arranque sin descargar del Hub
+
+# Varios pares de idiomas: el de arranque (DEFAULT_PAIR, MODEL_DIR/HF_MODEL_ID) más los
+# de MODEL_PAIRS, que se cargan al primer uso y se descargan (LRU) por encima de MODEL_MEMORY_MB
+DEFAULT_PAIR = os.getenv("DEFAULT_PAIR", "en-es")
+DEFAULT_SOURCE, DEFAULT_TARGET = DEFAULT_PAIR.split("-", 1)
+MODEL_PAIRS = parse_pairs(os.getenv("MODEL_PAIRS", ""),
+                          os.getenv("HF_MODEL_TEMPLATE", "Helsinki-NLP/opus-mt-{source}-{target}"))
+MODEL_MEMORY_MB = float(os.getenv("MODEL_MEMORY_MB", "2048"))
+
+# Decodificación especulativa (solo greedy, NUM_BEAMS=1): un draft con menos
+# capas propone tokens y el modelo principal los verifica; misma salida que greedy
+SPECULATIVE = os.getenv("SPECULATIVE", "0") == "1"
+DRAFT_LAYERS = os.getenv("DRAFT_LAYERS", "0,5")
+
+# Decodificación adaptativa: beams, length_penalty y max_length por petición según la
+# longitud del texto, la pista del cliente (quality, latency_budget_ms) y la carga.
+# NUM_BEAMS es el valor sin carga; ADAPTIVE_DECODING=0 usa siempre NUM_BEAMS
+ADAPTIVE_DECODING = os.getenv("ADAPTIVE_DECODING", "1") == "1"
+MAX_BEAMS = int(os.getenv("MAX_BEAMS", "4"))  # quality="best"
+decoding_policy = DecodingPolicy(
+    NUM_BEAMS, MAX_BEAMS,
+    reduce_load=float(os.getenv("POLICY_REDUCE_LOAD", "0.4")),
+    greedy_load=float(os.getenv("POLICY_GREEDY_LOAD", "0.75")),
+    enabled=ADAPTIVE_DECODING
+)
+
+# Traducción de calentamiento antes de declararse listo (WARMUP_RUNS=0 la desactiva)
+WARMUP_TEXT = os.getenv("WARMUP_TEXT", "Hello, how are you today?")
+WARMUP_RUNS = int(os.getenv("WARMUP_RUNS", "1"))
+
+# Cache de salidas del encoder: re-traducciones con otros parámetros saltan el encoder (ENCODER_CACHE_MB=0 lo desactiva)
+ENCODER_CACHE_MB = float(os.getenv("ENCODER_CACHE_MB", "32"))
+encoder_cache = EncoderCache(int(ENCODER_CACHE_MB * 1024 * 1024)) if ENCODER_CACHE_MB > 0 else None
+
+# Cache de traducciones (LRU en memoria + SQLite opcional que sobrevive reinicios)
+translation_cache = TranslationCache(
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "10000")),
+    max_bytes=int(float(os.getenv("CACHE_MAX_MB", "64")) * 1024 * 1024),
+    db_path=os.getenv("CACHE_DB_PATH") or None
+)
+
+# Bucketing por longitud para /translate/batch
+BUCKET_MAX_TOKENS = int(os.getenv("BUCKET_MAX_TOKENS", "4096"))  # len(lote) * tokens del texto más largo
+BUCKET_MAX_SIZE = int(os.getenv("BUCKET_MAX_SIZE", "64"))
+BUCKET_WORKERS = int(os.getenv("BUCKET_WORKERS", "1"))  # >1 traduce buckets en paralelo
+bucket_executor = ThreadPoolExecutor(max_workers=BUCKET_WORKERS) if BUCKET_WORKERS > 1 else None
+
+# Inferencia fuera del event loop: pool acotado + cola con límite (429) + timeout por petición
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "64"))
+REQUEST_TIMEOUT_S = float(os.getenv("REQUEST_TIMEOUT_S", "30"))
+inference_executor = InferenceExecutor(max_workers=INFERENCE_WORKERS, max_queue=INFERENCE_QUEUE_SIZE)
+
+# Memoria de traducción (translation_memory.py build): las coincidencias exactas se devuelven sin
+# pasar por el modelo. Con TM_FUZZY_THRESHOLD < 1 las aproximadas se añaden como sugerencia junto a
+# la traducción del modelo (por defecto solo exactas)
+TM_PATH = os.getenv("TM_PATH", "")
+TM_FUZZY_THRESHOLD = float(os.getenv("TM_FUZZY_THRESHOLD", "1.0"))
+translation_memory = TranslationMemory(TM_PATH, TM_FUZZY_THRESHOLD) if TM_PATH else None
 
 class TranslationRequest(BaseModel):
     text: str
     max_length: int = 128  # Reducido para móviles
+    source_language: str = DEFAULT_SOURCE
+    target_language: str = DEFAULT_TARGET
+    quality: Optional[str] = None  # "fast", "balanced" o "best"
+    latency_budget_ms: Optional[float] = None
     
 class TranslationResponse(BaseModel):
     translated_text: str
-    source_language: str = "en"
-    target_language: str = "es"
+    source_language: str = DEFAULT_SOURCE
+    target_language: str = DEFAULT_TARGET
+    decoding: Optional[dict] = None  # Parámetros elegidos por la política de decodificación
+    origin: str = "model"  # "memory" (memoria de traducción) o "model"
+    memory: Optional[dict] = None  # Coincidencia de la memoria: match ("exact"/"fuzzy"), score, source y target
+
+class DocumentTranslationResponse(TranslationResponse):
+    segments: int
+
+def load_model_files(model_dir: str) -> tuple:
+    """
+    (modelo, tokenizer, model_id) desde un directorio local (tokenizer
+    precompilado y pesos mmap'd) o desde HuggingFace Hub
+    """
+    logger.info(f"Cargando modelo desde {model_dir}...")
+    
+    if has_local_weights(model_dir):
+        # Arranque rápido: nada de red ni de transformers para el tokenizer
+        pair_tokenizer = load_tokenizer(model_dir)
+        pair_model = load_marian_mmap(model_dir)
+        pair_model_id = str(Path(model_dir).resolve())
+    else:
+        # Cargar modelo y tokenizer desde HuggingFace Hub (con token si es privado)
+        from transformers import MarianMTModel, MarianTokenizer
+        hf_token = os.getenv("HF_TOKEN", None)
+        pair_tokenizer = MarianTokenizer.from_pretrained(model_dir, token=hf_token)
+        pair_model = MarianMTModel.from_pretrained(model_dir, token=hf_token)
+        pair_model_id = model_dir
+    
+    pair_model.eval()  # Modo evaluación
+    return pair_model, pair_tokenizer, pair_model_id
+
+def load_pair(pair: str, location: str) -> PairModel:
+    """Carga un par de MODEL_PAIRS (sin draft especulativo: es solo del par de arranque)"""
+    return PairModel(pair, *load_model_files(location), use_onnx=False)
+
+registry = ModelRegistry(load_pair, MODEL_PAIRS, max_bytes=int(MODEL_MEMORY_MB * 1024 * 1024))
 
 def load_models(model_dir: str = None):
-    """Carga el modelo y tokenizer optimizado desde HuggingFace Hub"""
-    global model, tokenizer
+    """
+    Carga el modelo y tokenizer optimizado. Con MODEL_DIR (pesos locales)
+    arranca desde disco: tokenizer precompilado y pesos mmap'd; si no,
+    desde HuggingFace Hub
+    """
+    global model, tokenizer, model_id, draft_model
+    import torch
     
     # Obtener configuración desde variables de entorno
     if model_dir is None:
-        model_dir = os.getenv("HF_MODEL_ID", "Helsinki-NLP/opus-mt-en-es")
+        model_dir = MODEL_DIR or os.getenv("HF_MODEL_ID", "Helsinki-NLP/opus-mt-en-es")
     
-    hf_token = os.getenv("HF_TOKEN", None)
+    model, tokenizer, model_id = load_model_files(model_dir)
     
-    logger.info(f"Cargando modelo desde {model_dir}...")
+    # Optimizaciones para móviles
+    torch.set_num_threads(INTRA_OP_THREADS)  # Limitar threads
     
-    # Cargar modelo y tokenizer desde HuggingFace Hub (con token si es privado)
-    tokenizer = MarianTokenizer.from_pretrained(model_dir, token=hf_token)
-    model = MarianMTModel.from_pretrained(model_dir, token=hf_token)
+    if SPECULATIVE:
+        # Comparte pesos con el modelo principal: no ocupa memoria extra
+        draft_model = build_draft_model(model, parse_layers(DRAFT_LAYERS))
+        if NUM_BEAMS != 1 and not ADAPTIVE_DECODING:
+            logger.warning("SPECULATIVE=1 solo tiene efecto con NUM_BEAMS=1 (greedy)")
     
-    # Optimizaciones para móviles
-    model.eval()  # Modo evaluación
-    torch.set_num_threads(2)  # Limitar threads
+    registry.register(DEFAULT_PAIR, PairModel(DEFAULT_PAIR, model, tokenizer, model_id, False, draft_model))
     
     # Opcional: Usar half precision para reducir memoria (solo en GPU)
     # if torch.cuda.is_available():
@@ -70,35 +226,282 @@ def load_models(model_dir: str = None):
     logger.info("✅ Modelo cargado exitosamente")
     logger.info(f"   Parámetros: ~{sum(p.numel() for p in model.parameters()) / 1e6:.1f}M")
 
-def translate_text(text: str, max_length: int = 128) -> str:
+def encode_pytorch(entry: PairModel, inputs):
+    """Salidas del encoder PyTorch, reutilizando las frases que ya estén en el cache del encoder"""
+    encoder = entry.model.get_encoder()
+    if encoder_cache is None:
+        return encoder(**inputs)
+    from transformers.modeling_outputs import BaseModelOutput
+    hidden_states = encoder_cache.encode(
+        inputs["input_ids"], inputs["attention_mask"],
+        lambda input_ids, attention_mask: encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state,
+        entry.model_id
+    )
+    return BaseModelOutput(last_hidden_state=hidden_states)
+
+def generate_from_ids(encoded: list[list[int]], max_length: int = 128, pair: str = DEFAULT_PAIR,
+                      num_beams: int = NUM_BEAMS, length_penalty: float = 1.0) -> list[str]:
     """
-    Traduce texto usando el modelo MarianMT
+    Traduce un lote ya tokenizado (listas de ids) en una sola llamada a generate
     """
-    # Tokenizar input
-    inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True, max_length=max_length)
+    metrics.BATCH_SIZE.observe(len(encoded))
+    entry = registry.get(pair)
+    model, tokenizer = entry.model, entry.tokenizer
+    
+    # Padding solo hasta el texto más largo de este lote
+    inputs = tokenizer.pad({"input_ids": encoded}, return_tensors="pt")
     
     # Generar traducción con optimizaciones
+    import torch
     with torch.no_grad():
+        # Encoder por separado para poder medir cada etapa
+        with timed("encoder"):
+            encoder_outputs = encode_pytorch(entry, inputs)
+        
+        # Generación asistida: HF solo la admite con lotes de una frase. El draft
+        # comparte encoder con el modelo principal, así que reutiliza sus salidas
+        assisted = {}
+        if entry.draft_model is not None and num_beams == 1 and len(encoded) == 1:
+            assisted = {"assistant_model": entry.draft_model, "assistant_encoder_outputs": encoder_outputs}
+        
+        start = time.perf_counter()
         translated = model.generate(
-            **inputs,
+            encoder_outputs=encoder_outputs,
+            attention_mask=inputs["attention_mask"],
             max_length=max_length,
-            num_beams=2,  # Reducido de 4 para mayor velocidad
+            num_beams=num_beams,
+            length_penalty=length_penalty,
             early_stopping=True,
-            do_sample=False  # Greedy decoding para consistencia
+            do_sample=False,  # Greedy decoding para consistencia
+            **assisted
         )
+        decoder_seconds = time.perf_counter() - start
+        observe_stage("decoder", decoder_seconds)
+        observe_stage("decoder_step", decoder_seconds / max(translated.shape[1] - 1, 1))
+        # Tiempo por paso con estos beams para el presupuesto de latencia de la política
+        decoding_policy.record_step(num_beams, decoder_seconds / max(translated.shape[1] - 1, 1))
+    
+    metrics.INPUT_TOKENS.inc(int(inputs["attention_mask"].sum()))
+    metrics.OUTPUT_TOKENS.inc(int((translated != tokenizer.pad_token_id).sum()))
     
     # Decodificar
-    translated_text = tokenizer.decode(translated[0], skip_special_tokens=True)
-    return translated_text
+    with timed("detokenize"):
+        return tokenizer.batch_decode(translated, skip_special_tokens=True)
 
-@app.on_event("startup")
-async def startup_event():
-    """Cargar modelo al iniciar el servidor"""
+def translate_texts(texts: list[str], max_length: int = 128, pair: str = DEFAULT_PAIR, num_beams: int = NUM_BEAMS,
+                    length_penalty: float = 1.0) -> list[str]:
+    """
+    Traduce un lote de textos en una sola llamada a generate
+    """
+    with timed("tokenize"):
+        encoded = registry.get(pair).tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]
+    return generate_from_ids(encoded, max_length, pair, num_beams, length_penalty)
+
+def translate_texts_bucketed(texts: list[str], max_length: int = 128, pair: str = DEFAULT_PAIR,
+                             num_beams: int = NUM_BEAMS, length_penalty: float = 1.0) -> list[str]:
+    """
+    Traduce una lista de textos de longitudes mezcladas agrupándolos por
+    longitud (menos padding) y devuelve los resultados en el orden original
+    """
+    with timed("tokenize"):
+        encoded = registry.get(pair).tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]
+    return run_bucketed(
+        [len(ids) for ids in encoded],
+        lambda indices: generate_from_ids([encoded[i] for i in indices], max_length, pair, num_beams,
+                                          length_penalty),
+        max_tokens_per_batch=BUCKET_MAX_TOKENS,
+        max_batch_size=BUCKET_MAX_SIZE,
+        executor=bucket_executor
+    )
+
+def translate_text(text: str, max_length: int = 128, pair: str = DEFAULT_PAIR, num_beams: int = NUM_BEAMS,
+                   length_penalty: float = 1.0) -> str:
+    """
+    Traduce texto usando el modelo MarianMT
+    """
+    return translate_texts([text], max_length, pair, num_beams, length_penalty)[0]
+
+def translate_many(texts: list[str], max_length: int = 128, pair: str = DEFAULT_PAIR,
+                   num_beams: int = NUM_BEAMS, length_penalty: float = 1.0) -> list[str]:
+    """
+    Traduce una lista de textos consultando el cache por texto: solo los
+    fallos llegan al modelo (una vez por texto distinto), agrupados por
+    buckets de longitud
+    """
+    pair_model_id = registry.get(pair).model_id
+    translations = [translation_cache.get(t, pair_model_id, max_length, num_beams) for t in texts]
+    misses = [i for i, translated_text in enumerate(translations) if translated_text is None]
+    
+    if misses:
+        miss_texts = list(dict.fromkeys(texts[i] for i in misses))
+        by_text = dict(zip(miss_texts, translate_texts_bucketed(miss_texts, max_length, pair, num_beams,
+                                                                length_penalty)))
+        for text, translated_text in by_text.items():
+            translation_cache.put(text, translated_text, pair_model_id, max_length, num_beams)
+        for i in misses:
+            translations[i] = by_text[texts[i]]
+    
+    return translations
+
+def translate_document(text: str, max_length: int = 128, pair: str = DEFAULT_PAIR,
+                       num_beams: int = NUM_BEAMS, length_penalty: float = 1.0) -> tuple[str, int]:
+    """
+    Traduce un documento largo frase a frase (sin truncarlo) y lo reconstruye
+    con los espacios y saltos de línea originales. Devuelve (texto, nº de segmentos)
+    """
+    segments, separators = split_segments(text)
+    if not segments:
+        return text, 0
+    translations = translate_many(segments, max_length, pair, num_beams, length_penalty)
+    return join_segments(translations, separators), len(segments)
+
+# Micro-batching: agrupa peticiones concurrentes de /translate en un solo lote
+batcher = MicroBatcher(
+    translate_texts,
+    max_batch_size=int(os.getenv("BATCH_MAX_SIZE", "16")),
+    max_wait_ms=float(os.getenv("BATCH_MAX_WAIT_MS", "5")),
+    observer=observe_stage,
+    executor=inference_executor,
+    max_queue=int(os.getenv("BATCH_MAX_QUEUE", "256"))
+)
+
+# Peticiones idénticas en vuelo (mismo texto, par y parámetros) comparten una sola traducción
+inflight = SingleFlight()
+
+def overloaded_error() -> HTTPException:
+    """429 con Retry-After para que el cliente reintente más tarde"""
+    return HTTPException(status_code=429, detail="Servidor saturado, reintenta en unos segundos",
+                         headers={"Retry-After": "1"})
+
+def timeout_error() -> HTTPException:
+    return HTTPException(status_code=504, detail="La traducción superó el tiempo máximo")
+
+def current_load() -> float:
+    """
+    Ocupación de la inferencia (0 = libre, 1 = colas llenas) para la política
+    de decodificación, con el lote de un trabajo en segundo plano en curso
+    """
+    return inference_load(inference_executor, batcher, int(job_runner.busy))
+
+def choose_decoding(text: str, max_length: int, quality: Optional[str] = None,
+                    latency_budget_ms: Optional[float] = None) -> DecodingChoice:
+    """Parámetros de generación para la petición con la carga actual (400 si la pista no es válida)"""
+    check_quality(quality)
+    return decoding_policy.choose(text, max_length, current_load(), quality, latency_budget_ms)
+
+def count_decoding(choice: DecodingChoice):
+    """Cuenta la elección en translation_decoding_choices_total (solo lo que llega al modelo)"""
+    metrics.DECODING_CHOICES.inc(num_beams=choice.num_beams, reason=choice.reason)
+
+def cached_translation(text: str, entry: PairModel, choice: DecodingChoice) -> Optional[str]:
+    """
+    Busca en el cache con los beams elegidos o con más: bajo carga se
+    aprovechan las traducciones de mejor calidad hechas sin carga
+    """
+    for num_beams in sorted({choice.num_beams, NUM_BEAMS, MAX_BEAMS}, reverse=True):
+        if num_beams >= choice.num_beams:
+            translated = translation_cache.get(text, entry.model_id, choice.max_length, num_beams)
+            if translated is not None:
+                return translated
+    return None
+
+# Trabajos en segundo plano (/jobs): listas o ficheros grandes que se traducen por bloques,
+# guardados en disco (un reinicio los retoma) y con prioridad para el tráfico interactivo
+job_store = JobStore(
+    os.getenv("JOBS_DIR", "./jobs"),
+    max_texts=int(os.getenv("JOB_MAX_TEXTS", "100000")),
+    retention_s=float(os.getenv("JOB_RETENTION_H", "24")) * 3600
+)
+job_runner = JobRunner(
+    job_store, job_chunk_translator(registry, translation_memory, translate_many),
+    lambda: interactive_idle(ready, inference_executor, batcher),
+    chunk_size=int(os.getenv("JOB_CHUNK_SIZE", "32")), batch_size=int(os.getenv("JOB_BATCH_SIZE", "8"))
+)
+
+def preload_models():
+    """
+    Precarga para el modo pre-fork de start.py: el maestro carga el modelo
+    antes del fork y los workers comparten sus pesos (copy-on-write)
+    """
+    load_models()
+
+def warm_up():
+    """Traducciones de calentamiento: reserva memoria y compila kernels antes de recibir tráfico"""
+    if not WARMUP_TEXT or WARMUP_RUNS <= 0:
+        return
+    start = time.perf_counter()
+    for _ in range(WARMUP_RUNS):
+        translate_texts([WARMUP_TEXT], 64)
+    logger.info(f"✅ Calentamiento completado en {time.perf_counter() - start:.2f}s")
+
+def apply_thread_config(config: ThreadConfig):
+    """Aplica threads intra-op y sesiones concurrentes (threads de inferencia)"""
+    global INTRA_OP_THREADS
+    import torch
+    INTRA_OP_THREADS = config.intra_op
+    torch.set_num_threads(config.intra_op)
+    inference_executor.resize(config.sessions)
+
+def tune_threads():
+    """
+    THREAD_TUNING=1: aplica la configuración de threads guardada para esta
+    máquina, modelo y objetivo, o la mide si no la hay. Si no, se usan
+    INTRA_OP_THREADS e INFERENCE_WORKERS
+    """
+    global thread_decision, encoder_cache
+    # Las frases de prueba se repiten: sin cache del encoder durante las medidas.
+    # torch solo permite fijar los threads inter-op una vez: se miden solo intra-op y sesiones
+    saved_cache = encoder_cache
+    if THREAD_TUNING:
+        encoder_cache = None
+    try:
+        thread_decision = configure_threads(
+            THREAD_TUNING, ThreadConfig(INTRA_OP_THREADS, 1, INFERENCE_WORKERS), model_id,
+            apply_thread_config, lambda text: batcher.submit_from_thread(text, 128, DEFAULT_PAIR, NUM_BEAMS, 1.0),
+            processes=int(os.getenv("WORKERS", "1")), inter_op=False, objective=THREAD_TUNING_OBJECTIVE,
+            path=THREAD_TUNING_PATH, seconds=THREAD_TUNING_SECONDS, log=logger.info
+        )
+    finally:
+        encoder_cache = saved_cache
+
+def load_and_warm_up():
+    """Carga (si hace falta) y calienta el modelo; al terminar el servidor está listo"""
+    global ready, load_error, startup_seconds
     try:
-        load_models()
+        # Con el pre-fork de start.py el modelo ya viene cargado del maestro
+        if model is None:
+            load_models()
+        tune_threads()
+        warm_up()
     except Exception as e:
         logger.error(f"Error cargando modelo: {e}")
-        raise
+        load_error = str(e)
+        return
+    ready = True
+    startup_seconds = time.perf_counter() - import_time
+    logger.info(f"✅ Servidor listo en {startup_seconds:.2f}s")
+
+def ensure_ready():
+    """503 mientras el modelo se carga/calienta"""
+    if not ready:
+        raise HTTPException(status_code=503, detail="El modelo se está cargando",
+                            headers={"Retry-After": "5"})
+
+@app.on_event("startup")
+async def startup_event():
+    """Arranca el micro-batcher y carga el modelo en segundo plano"""
+    await batcher.start()
+    await job_runner.start()
+    # El servidor acepta conexiones enseguida (/health/live); /health/ready
+    # pasa a 200 cuando el modelo está cargado y calentado
+    asyncio.get_running_loop().run_in_executor(None, load_and_warm_up)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Detener el worker de micro-batching y el pool de inferencia"""
+    await batcher.stop()
+    await job_runner.stop()
+    inference_executor.shutdown()
 
 @app.get("/")
 async def root():
@@ -106,7 +509,7 @@ async def root():
     return {
         "status": "online",
         "message": "Translation API is running",
-        "model": "MarianMT en->es",
+        "model": f"MarianMT {DEFAULT_SOURCE}->{DEFAULT_TARGET}",
         "optimized_for": "mobile"
     }
 
@@ -115,39 +518,195 @@ async def health():
     """Health check"""
     return {
         "status": "healthy",
-        "models_loaded": model is not None
+        "ready": ready,
+        "models_loaded": model is not None,
+        "speculative": draft_model is not None and (NUM_BEAMS == 1 or ADAPTIVE_DECODING),
+        "languages": registry.stats(),
+        "threads": thread_decision,
+        "startup_seconds": startup_seconds
     }
 
+@app.get("/health/live")
+async def health_live():
+    """Liveness: el proceso responde (falla solo si la carga del modelo falló)"""
+    if load_error is not None:
+        return JSONResponse(status_code=503, content={"status": "error", "detail": load_error})
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: modelo cargado y calentado"""
+    if not ready:
+        return JSONResponse(status_code=503, content={"status": "loading", "detail": load_error})
+    return {"status": "ready", "startup_seconds": startup_seconds}
+
+@app.get("/languages")
+async def languages():
+    """Pares de idiomas disponibles y cargados en memoria"""
+    return registry.stats()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Aciertos/fallos y ocupación del cache de traducciones, del cache del encoder y de la memoria de traducción"""
+    stats = translation_cache.stats()
+    if encoder_cache is not None:
+        stats["encoder"] = encoder_cache.stats()
+    if translation_memory is not None:
+        stats["memory"] = translation_memory.stats()
+    return stats
+
+metrics.register_callback(
+    "translation_backend_info", "Backend activo (etiquetas)",
+    lambda: {(("backend", "pytorch"), ("use_onnx", "false"), ("model", str(model_id))): 1}
+)
+register_metrics(sys.modules[__name__])
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Métricas en formato Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/translate", response_model=TranslationResponse)
 async def translate(request: TranslationRequest):
     """
     Endpoint de traducción
     
-    - **text**: Texto a traducir (inglés -> español)
+    - **text**: Texto a traducir
     - **max_length**: Longitud máxima de la traducción (default: 128)
+    - **source_language** / **target_language**: Par de idiomas (default: DEFAULT_PAIR)
+    - **quality**: "fast" (greedy), "balanced" (default) o "best"
+    - **latency_budget_ms**: Presupuesto de latencia; se reducen los beams si no cabe
+    
+    Con el servidor cargado se usan menos beams (greedy si está saturado); los
+    parámetros usados se devuelven en **decoding**.
     """
     if not request.text.strip():
         raise HTTPException(status_code=400, detail="El texto no puede estar vacío")
+    ensure_ready()
+    entry = await resolve_pair(registry, request.source_language, request.target_language)
+    # La pista de calidad se valida aunque responda la memoria
+    check_quality(request.quality)
+    match = memory_lookup(translation_memory, request.text, entry)
+    if match is not None and match.exact:
+        return TranslationResponse(
+            translated_text=match.target,
+            source_language=request.source_language,
+            target_language=request.target_language,
+            origin="memory",
+            memory=match.as_dict()
+        )
+    choice = choose_decoding(request.text, request.max_length, request.quality, request.latency_budget_ms)
     
     try:
-        translated = translate_text(request.text, request.max_length)
+        translated = cached_translation(request.text, entry, choice)
+        if translated is None:
+            count_decoding(choice)
+            params = (choice.max_length, entry.pair, choice.num_beams, choice.length_penalty)
+            translated = await asyncio.wait_for(
+                inflight.do((request.text,) + params, batcher.submit, request.text, *params),
+                REQUEST_TIMEOUT_S
+            )
+            translation_cache.put(request.text, translated, entry.model_id, choice.max_length, choice.num_beams)
         return TranslationResponse(
             translated_text=translated,
-            source_language="en",
-            target_language="es"
+            source_language=request.source_language,
+            target_language=request.target_language,
+            decoding=choice.as_dict(),
+            memory=match.as_dict() if match is not None else None
         )
+    except QueueFullError:
+        raise overloaded_error()
+    except asyncio.TimeoutError:
+        raise timeout_error()
     except Exception as e:
         logger.error(f"Error en traducción: {e}")
         raise HTTPException(status_code=500, detail=f"Error en traducción: {str(e)}")
 
+@app.post("/translate/document", response_model=DocumentTranslationResponse)
+async def translate_document_endpoint(request: TranslationRequest):
+    """
+    Traducción de documentos largos (artículos de ayuda, etc.)
+    
+    El texto se divide en frases/párrafos que se traducen como un lote
+    ordenado por longitud; **max_length** se aplica a cada frase, no al
+    documento, así que nada se trunca en silencio. Los beams se eligen para
+    todo el documento; length_penalty y max_length no se adaptan porque las
+    frases tienen longitudes distintas.
+    """
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="El texto no puede estar vacío")
+    ensure_ready()
+    entry = await resolve_pair(registry, request.source_language, request.target_language)
+    choice = choose_decoding(request.text, request.max_length, request.quality, request.latency_budget_ms)
+    choice = DecodingChoice(choice.num_beams, 1.0, request.max_length, choice.reason)
+    count_decoding(choice)
+    
+    try:
+        translated, segments = await inference_executor.run(
+            translate_document, request.text, choice.max_length, entry.pair, choice.num_beams,
+            timeout=REQUEST_TIMEOUT_S
+        )
+        return DocumentTranslationResponse(
+            translated_text=translated,
+            source_language=request.source_language,
+            target_language=request.target_language,
+            segments=segments,
+            decoding=choice.as_dict()
+        )
+    except QueueFullError:
+        raise overloaded_error()
+    except asyncio.TimeoutError:
+        raise timeout_error()
+    except Exception as e:
+        logger.error(f"Error en traducción de documento: {e}")
+        raise HTTPException(status_code=500, detail=f"Error en traducción: {str(e)}")
+
+def _translate_batch_items(texts: list[str], choices: list[DecodingChoice], entry: PairModel) -> list[dict]:
+    """
+    Los fallos del cache se agrupan por parámetros de decodificación y cada
+    grupo se traduce como lotes por longitud; los textos repetidos se
+    traducen una vez. Lo que está en la memoria de traducción (coincidencia
+    exacta) no llega al modelo. Se ejecuta en el pool de inferencia: las
+    búsquedas en la memoria no bloquean el event loop
+    """
+    matches = [memory_lookup(translation_memory, text, entry) for text in texts]
+    translations = [match.target if match is not None and match.exact else cached_translation(text, entry, choice)
+                    for text, choice, match in zip(texts, choices, matches)]
+    
+    groups = {}
+    for i, (text, choice) in enumerate(zip(texts, choices)):
+        if translations[i] is None:
+            count_decoding(choice)
+            params = (choice.max_length, choice.num_beams, choice.length_penalty)
+            groups.setdefault(params, {}).setdefault(text, []).append(i)
+    for (max_length, num_beams, length_penalty), by_text in groups.items():
+        unique = list(by_text)
+        for text, translated in zip(unique, translate_texts_bucketed(unique, max_length, entry.pair, num_beams,
+                                                                     length_penalty)):
+            translation_cache.put(text, translated, entry.model_id, max_length, num_beams)
+            for i in by_text[text]:
+                translations[i] = translated
+    
+    return [{"original": text, "translated": translated,
+             "decoding": None if match is not None and match.exact else choice.as_dict(),
+             "origin": "memory" if match is not None and match.exact else "model",
+             "memory": match.as_dict() if match is not None else None}
+            for text, choice, translated, match in zip(texts, choices, translations, matches)]
+
 @app.post("/translate/batch")
-async def translate_batch(texts: list[str], max_length: int = 128):
+async def translate_batch(texts: list[str], max_length: int = 128, source_language: str = DEFAULT_SOURCE,
+                          target_language: str = DEFAULT_TARGET, quality: Optional[str] = None):
     """
     Endpoint de traducción por lotes
-    Optimizado para procesar múltiples textos de una vez
+    Optimizado para procesar múltiples textos de una vez; los parámetros de
+    decodificación se eligen por texto según quality y la carga (se devuelven
+    en **decoding** de cada traducción)
     """
     if not texts:
         raise HTTPException(status_code=400, detail="La lista de textos no puede estar vacía")
+    ensure_ready()
+    entry = await resolve_pair(registry, source_language, target_language)
+    choices = [choose_decoding(text, max_length, quality) for text in texts if text.strip()]
     
     try:
         # Filtrar textos vacíos
@@ -156,33 +715,24 @@ async def translate_batch(texts: list[str], max_length: int = 128):
         if not valid_texts:
             raise HTTPException(status_code=400, detail="Todos los textos están vacíos")
         
-        # Traducir por lotes para mayor eficiencia
-        inputs = tokenizer(valid_texts, return_tensors="pt", padding=True, truncation=True, max_length=max_length)
-        
-        with torch.no_grad():
-            translated = model.generate(
-                **inputs,
-                max_length=max_length,
-                num_beams=2,
-                early_stopping=True,
-                do_sample=False
-            )
-        
-        # Decodificar todos los resultados
-        results = []
-        for i, text in enumerate(valid_texts):
-            translated_text = tokenizer.decode(translated[i], skip_special_tokens=True)
-            results.append({
-                "original": text,
-                "translated": translated_text
-            })
+        results = await inference_executor.run(_translate_batch_items, valid_texts, choices, entry,
+                                               timeout=REQUEST_TIMEOUT_S)
         
         return {"translations": results, "count": len(results)}
     
+    except QueueFullError:
+        raise overloaded_error()
+    except asyncio.TimeoutError:
+        raise timeout_error()
     except Exception as e:
         logger.error(f"Error en traducción por lotes: {e}")
         raise HTTPException(status_code=500, detail=f"Error en traducción: {str(e)}")
 
+# Trabajos en segundo plano: POST /jobs, POST /jobs/upload, GET /jobs/{id}, GET /jobs/{id}/results
+# y DELETE /jobs/{id}
+app.include_router(jobs_router(job_store, job_runner, registry, decoding_policy, DEFAULT_PAIR,
+                               default_max_length=128))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,293 @@
+"""
+Micro-batching dinámico para /translate
+Agrupa peticiones concurrentes durante una ventana corta y las traduce en un solo lote
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """No caben más peticiones en cola (los servidores responden 429)"""
+
+
+class InferenceExecutor:
+    """
+    Pool de threads acotado para ejecutar la inferencia fuera del event loop.
+
+    torch y onnxruntime liberan el GIL, así que con threads basta. Como mucho
+    max_workers tareas se ejecutan a la vez y max_queue esperan; por encima de
+    eso run() lanza QueueFullError. Si la petición agota su timeout (o el
+    cliente se desconecta) el trabajo que aún no había empezado se cancela.
+    """
+
+    def __init__(self, max_workers: int = 1, max_queue: int = 64):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Tareas en ejecución + en cola"""
+        return self._pending
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn: Callable, *args, timeout: float = None):
+        """Ejecuta fn(*args) en el pool y espera el resultado (como mucho timeout segundos)"""
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                raise QueueFullError(f"{self._pending} tareas de inferencia pendientes")
+            self._pending += 1
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        # wrap_future propaga la cancelación: si aún está en cola, no llega a ejecutarse
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+    def resize(self, max_workers: int):
+        """
+        Cambia el número de threads (el auto-ajuste lo hace antes de recibir
+        tráfico); el MicroBatcher que usa este pool ajusta con él sus lotes en vuelo
+        """
+        if max_workers == self.max_workers:
+            return
+        previous = self._pool
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self.max_workers = max_workers
+        # Lo ya enviado al pool anterior termina allí
+        previous.shutdown(wait=False)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class MicroBatcher:
+    """
+    Cola de peticiones delante de una función de traducción por lotes.
+
+    Cada llamada a submit(texto, *params) encola el texto y espera su futuro.
+    Un worker recoge peticiones hasta max_batch_size o hasta que pasan
+    max_wait_ms desde la primera, ejecuta translate_batch_fn(textos, *params)
+    en el InferenceExecutor (sin bloquear el event loop) por cada grupo de
+    peticiones con los mismos params (max_length, par de idiomas...) y
+    resuelve cada futuro.
+    Con más de max_queue peticiones esperando, submit() lanza QueueFullError.
+
+    observer(etapa, segundos), si se indica, recibe el tiempo de espera en
+    cola de cada petición ("queue_wait").
+
+    Hay como mucho executor.max_workers lotes en vuelo; el límite se lee en
+    cada lote, así que sigue a executor.resize() (auto-ajuste de threads).
+    """
+
+    def __init__(self, translate_batch_fn: Callable[..., List[str]],
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0, observer: Callable = None,
+                 executor: InferenceExecutor = None, max_queue: int = 256):
+        self.translate_batch_fn = translate_batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.observer = observer
+        self.queue: asyncio.Queue = None
+        self.executor = executor or InferenceExecutor(max_workers=1)
+        self._worker = None
+        self._loop = None
+        self._running = 0  # Lotes en vuelo
+        self._slot_released = None
+        self._tasks = set()
+
+    async def start(self):
+        """Arranca el worker en el event loop actual"""
+        self._loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self._slot_released = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Detiene el worker"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, text: str, *params) -> str:
+        """Encola un texto y espera su traducción; params se pasan a translate_batch_fn"""
+        if self.queue.qsize() >= self.max_queue:
+            raise QueueFullError(f"{self.queue.qsize()} peticiones en cola")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, params, future, time.perf_counter()))
+        return await future
+
+    def submit_from_thread(self, text: str, *params) -> str:
+        """submit() desde un thread fuera del event loop (bloquea hasta tener la traducción)"""
+        if self._loop is None:
+            raise RuntimeError("El micro-batcher no está arrancado")
+        return asyncio.run_coroutine_threadsafe(self.submit(text, *params), self._loop).result()
+
+    async def _acquire_slot(self):
+        """Espera a que haya menos lotes en vuelo que threads de inferencia"""
+        while self._running >= self.executor.max_workers:
+            self._slot_released.clear()
+            await self._slot_released.wait()
+        self._running += 1
+
+    def _release_slot(self):
+        self._running -= 1
+        self._slot_released.set()
+
+    async def _collect(self):
+        """Espera la primera petición y agrega las que lleguen dentro de la ventana"""
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._acquire_slot()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._release_slot()
+                raise
+
+            # Solo se pueden agrupar peticiones con los mismos parámetros de generación;
+            # las que ya expiraron (timeout del cliente) no se traducen
+            groups = {}
+            now = time.perf_counter()
+            for text, params, future, enqueued_at in batch:
+                if future.done():
+                    continue
+                groups.setdefault(params, []).append((text, future))
+                if self.observer is not None:
+                    self.observer("queue_wait", now - enqueued_at)
+
+            task = asyncio.create_task(self._execute(groups))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, groups: dict):
+        try:
+            for params, items in groups.items():
+                texts = [text for text, _ in items]
+                try:
+                    results = await self.executor.run(self.translate_batch_fn, texts, *params)
+                except Exception as e:
+                    logger.error(f"Error en lote de {len(texts)} textos: {e}")
+                    for _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), result in zip(items, results):
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self._release_slot()
+
+
+class SingleFlight:
+    """
+    Coalescencia de peticiones idénticas en vuelo.
+
+    do(clave, fn, *args) ejecuta la corrutina fn(*args) una sola vez por
+    clave: las llamadas que llegan mientras la primera sigue en curso esperan
+    el mismo resultado (o la misma excepción). Si todos los que esperan se
+    cancelan (timeout, desconexión), también se cancela el trabajo.
+    A diferencia del cache, cubre la ventana en la que aún no hay resultado
+    (p. ej. miles de clientes pidiendo los mismos textos tras una release).
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.coalesced = 0
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key, fn: Callable, *args):
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = self._inflight[key] = {"task": asyncio.ensure_future(fn(*args)), "waiters": 0}
+            flight["task"].add_done_callback(lambda task: self._forget(key, flight, task))
+        else:
+            self.coalesced += 1
+        task = flight["task"]
+        flight["waiters"] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if flight["waiters"] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            flight["waiters"] -= 1
+
+    def _forget(self, key, flight: dict, task: asyncio.Future):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Marca la excepción como recogida aunque ya no quede nadie esperando
+            task.exception()
+
+
+def bucket_by_length(lengths: List[int], max_tokens_per_batch: int = 4096, max_batch_size: int = 64) -> List[List[int]]:
+    """
+    Agrupa índices por longitud para minimizar el padding.
+
+    Ordena los textos por número de tokens y va llenando lotes mientras
+    len(lote) * longitud_máxima_del_lote no supere max_tokens_per_batch.
+    Devuelve listas de índices sobre la lista original.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    buckets, current = [], []
+    for i in order:
+        # Al ir en orden ascendente, el texto actual es el más largo del lote
+        padded_tokens = (len(current) + 1) * max(lengths[i], 1)
+        if current and (padded_tokens > max_tokens_per_batch or len(current) >= max_batch_size):
+            buckets.append(current)
+            current = []
+        current.append(i)
+    if current:
+        buckets.append(current)
+    return buckets
+
+
+def run_bucketed(lengths: List[int], translate_bucket_fn: Callable[[List[int]], list],
+                 max_tokens_per_batch: int = 4096, max_batch_size: int = 64, executor=None) -> list:
+    """
+    Ejecuta translate_bucket_fn(índices) por cada bucket y devuelve los
+    resultados en el orden original. Si se pasa un executor los buckets
+    se procesan en paralelo.
+    """
+    buckets = bucket_by_length(lengths, max_tokens_per_batch, max_batch_size)
+    mapper = executor.map if executor is not None else map
+    results = [None] * len(lengths)
+    for indices, bucket_results in zip(buckets, mapper(translate_bucket_fn, buckets)):
+        for i, result in zip(indices, bucket_results):
+            results[i] = result
+    return results
@@ -0,0 +1,361 @@
+"""
+Benchmark de carga y latencia para la API de traducción
+Sustituye a test_api.py: lanza peticiones concurrentes contra la app (en proceso
+vía ASGI o contra un servidor en marcha) y guarda los resultados en JSON
+
+Ejemplos:
+    # En proceso, comparando backends y número de beams
+    python benchmark.py --app app:app --backends pytorch,onnx-fp32,onnx-int8 --beams 1,4
+
+    # Contra un servidor en marcha
+    python benchmark.py --url http://localhost:8000 --concurrency 1,8,32
+
+    # Fallar si empeora más de un 10% respecto a una versión anterior
+    python benchmark.py --app app:app --output nuevo.json --baseline anterior.json
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+# Frases de ejemplo por longitud (similares a los textos de UI y ayuda de las apps)
+SAMPLE_SENTENCES = {
+    "short": [
+        "Settings", "Cancel", "Save changes", "Log out", "Try again",
+        "Good morning", "Thank you very much", "How are you?", "Delete account", "Next",
+    ],
+    "medium": [
+        "Hello, how are you today?",
+        "Your password must contain at least eight characters.",
+        "We could not connect to the server, please try again later.",
+        "Tap the button below to verify your email address.",
+        "Your order has been shipped and will arrive on Friday.",
+        "Do you want to enable notifications for new messages?",
+    ],
+    "long": [
+        "Machine learning is a subset of artificial intelligence that focuses on the development of "
+        "algorithms and statistical models that enable computers to improve their performance on a "
+        "specific task through experience.",
+        "If you continue to experience problems after updating the application, please contact our "
+        "support team and include a description of the steps you followed, the version of the app and "
+        "the model of your device so that we can help you as quickly as possible.",
+        "By creating an account you agree to our terms of service and privacy policy, which explain how "
+        "we collect, use and protect your personal information when you use our products and services.",
+    ],
+}
+
+DEFAULT_MIX = "short:0.6,medium:0.3,long:0.1"
+
+
+def parse_mix(mix: str) -> dict:
+    """'short:0.6,medium:0.3,long:0.1' -> {'short': 0.6, ...}"""
+    weights = {}
+    for item in mix.split(","):
+        name, weight = item.split(":")
+        if name not in SAMPLE_SENTENCES:
+            raise ValueError(f"Longitud desconocida '{name}' (usar {', '.join(SAMPLE_SENTENCES)})")
+        weights[name] = float(weight)
+    return weights
+
+
+def make_workload(num_requests: int, mix: str, seed: int = 0) -> list[str]:
+    """Genera una lista reproducible de frases según la distribución de longitudes"""
+    rng = random.Random(seed)
+    weights = parse_mix(mix)
+    names = list(weights)
+    return [
+        rng.choice(SAMPLE_SENTENCES[rng.choices(names, weights=[weights[n] for n in names])[0]])
+        for _ in range(num_requests)
+    ]
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Percentil con interpolación lineal"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def peak_rss_mb(pid: int = None) -> float:
+    """Pico de memoria residente: del proceso actual o de otro PID (Linux)"""
+    if pid is None:
+        # ru_maxrss está en KB en Linux y en bytes en macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if platform.system() == "Darwin" else peak / 1024
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def load_tokenizer(tokenizer_dir: str):
+    """Tokenizer opcional para contar tokens; sin él se cuentan palabras"""
+    try:
+        from transformers import MarianTokenizer
+        return MarianTokenizer.from_pretrained(tokenizer_dir)
+    except Exception as e:
+        print(f"⚠️  Sin tokenizer ({e}); tokens/s se aproxima con palabras")
+        return None
+
+
+def count_tokens(tokenizer, text: str, target: bool = False) -> int:
+    if tokenizer is None:
+        return len(text.split())
+    if target:
+        return len(tokenizer(text_target=text)["input_ids"])
+    return len(tokenizer(text)["input_ids"])
+
+
+async def run_load(client: httpx.AsyncClient, texts: list[str], concurrency: int, endpoint: str,
+                   max_length: int, tokenizer, timeout: float) -> dict:
+    """Lanza las peticiones con un máximo de `concurrency` en vuelo"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+    source_tokens = output_tokens = 0
+
+    async def one(text):
+        nonlocal errors, source_tokens, output_tokens
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(endpoint, json={"text": text, "max_length": max_length}, timeout=timeout)
+                response.raise_for_status()
+                translated = response.json()["translated_text"]
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+            source_tokens += count_tokens(tokenizer, text)
+            output_tokens += count_tokens(tokenizer, translated, target=True)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(text) for text in texts))
+    elapsed = time.perf_counter() - start
+
+    completed = len(latencies)
+    return {
+        "concurrency": concurrency,
+        "requests": len(texts),
+        "completed": completed,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "latency_ms": {
+            "mean": 1000 * sum(latencies) / completed if completed else 0.0,
+            "p50": 1000 * percentile(latencies, 50),
+            "p95": 1000 * percentile(latencies, 95),
+            "p99": 1000 * percentile(latencies, 99),
+            "max": 1000 * max(latencies, default=0.0),
+        },
+        "sentences_per_s": completed / elapsed if elapsed else 0.0,
+        "source_tokens_per_s": source_tokens / elapsed if elapsed else 0.0,
+        "output_tokens_per_s": output_tokens / elapsed if elapsed else 0.0,
+    }
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 300.0) -> float:
+    """Espera a que /health/ready responda 200 (la app carga el modelo en segundo plano)"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            response = await client.get("/health/ready")
+            if response.status_code in (200, 404):  # 404: servidor sin readiness
+                return time.perf_counter() - start
+            if response.json().get("detail"):
+                raise RuntimeError(f"El servidor no pudo cargar el modelo: {response.json()['detail']}")
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"El servidor no estuvo listo en {timeout:.0f}s")
+
+
+async def benchmark(args) -> dict:
+    """Ejecuta todas las concurrencias contra un único backend/configuración"""
+    tokenizer = load_tokenizer(args.tokenizer_dir)
+    texts = make_workload(args.requests, args.mix, args.seed)
+    warmup = make_workload(args.warmup, args.mix, args.seed + 1)
+
+    ready_s = None
+
+    async def run_all(client):
+        nonlocal ready_s
+        ready_s = await wait_ready(client)
+        for text in warmup:
+            await client.post(args.endpoint, json={"text": text, "max_length": args.max_length}, timeout=args.timeout)
+        runs = []
+        for concurrency in args.concurrency:
+            print(f"🔍 Concurrencia {concurrency}: {len(texts)} peticiones...")
+            result = await run_load(client, texts, concurrency, args.endpoint, args.max_length, tokenizer, args.timeout)
+            print(f"   p50={result['latency_ms']['p50']:.1f}ms p95={result['latency_ms']['p95']:.1f}ms "
+                  f"p99={result['latency_ms']['p99']:.1f}ms {result['sentences_per_s']:.1f} frases/s "
+                  f"{result['output_tokens_per_s']:.1f} tokens/s errores={result['errors']}")
+            runs.append(result)
+        return runs
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url) as client:
+            runs = await run_all(client)
+        rss = peak_rss_mb(args.pid) if args.pid else None
+        target = args.url
+    else:
+        module_name, attr = args.app.split(":")
+        app = getattr(importlib.import_module(module_name), attr)
+        # lifespan_context ejecuta los eventos startup/shutdown (carga del modelo)
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                runs = await run_all(client)
+        rss = peak_rss_mb()
+        target = args.app
+
+    return {
+        "target": target,
+        "endpoint": args.endpoint,
+        "backend": os.getenv("MODEL_BACKEND"),
+        "num_beams": os.getenv("NUM_BEAMS"),
+        "mix": args.mix,
+        "max_length": args.max_length,
+        "peak_rss_mb": rss,
+        "ready_s": ready_s,
+        "runs": runs,
+    }
+
+
+def run_matrix(args) -> list[dict]:
+    """Un subproceso por backend x beams: cada uno carga su modelo desde cero"""
+    results = []
+    for backend in args.backends or [None]:
+        for beams in args.beams or [None]:
+            env = dict(os.environ)
+            label = []
+            if backend:
+                env["MODEL_BACKEND"] = backend
+                label.append(backend)
+            if beams:
+                env["NUM_BEAMS"] = str(beams)
+                label.append(f"beams={beams}")
+            print(f"\n{'=' * 60}\n🚀 {' '.join(label) or 'configuración por defecto'}\n{'=' * 60}")
+
+            output = Path(args.output).with_suffix(f".{len(results)}.tmp.json")
+            cmd = [sys.executable, __file__, "--single", "--output", str(output)] + args.passthrough
+            if subprocess.run(cmd, env=env).returncode != 0:
+                print("❌ La configuración falló")
+                results.append({"backend": backend, "num_beams": beams, "error": True})
+                continue
+            results.extend(json.loads(output.read_text())["results"])
+            output.unlink()
+    return results
+
+
+def compare(results: list[dict], baseline_path: str, tolerance: float) -> list[str]:
+    """Compara p95 y frases/s con un JSON anterior; devuelve las regresiones"""
+    baseline = json.loads(Path(baseline_path).read_text())["results"]
+    key = lambda r: (r.get("backend"), r.get("num_beams"))
+    previous = {key(r): r for r in baseline if "runs" in r}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or "runs" not in result:
+            continue
+        old_runs = {run["concurrency"]: run for run in old["runs"]}
+        for run in result["runs"]:
+            old_run = old_runs.get(run["concurrency"])
+            if old_run is None:
+                continue
+            name = f"{result.get('backend')} beams={result.get('num_beams')} c={run['concurrency']}"
+            if run["latency_ms"]["p95"] > old_run["latency_ms"]["p95"] * (1 + tolerance):
+                regressions.append(f"{name}: p95 {old_run['latency_ms']['p95']:.1f} -> {run['latency_ms']['p95']:.1f} ms")
+            if run["sentences_per_s"] < old_run["sentences_per_s"] * (1 - tolerance):
+                regressions.append(f"{name}: {old_run['sentences_per_s']:.1f} -> {run['sentences_per_s']:.1f} frases/s")
+    return regressions
+
+
+def _strip_options(argv: list[str], names: set) -> list[str]:
+    """Quita de argv las opciones indicadas (formas '--x v' y '--x=v')"""
+    result, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+            continue
+        name = arg.split("=", 1)[0]
+        if name in names:
+            skip = "=" not in arg
+            continue
+        result.append(arg)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de latencia y throughput de la API de traducción")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--app", type=str, default="app:app", help="App ASGI en proceso (modulo:atributo)")
+    target.add_argument("--url", type=str, help="URL de un servidor en marcha (en lugar de --app)")
+    parser.add_argument("--pid", type=int, help="PID del servidor para medir su pico de RSS (con --url)")
+    parser.add_argument("--endpoint", type=str, default="/translate", help="Endpoint a medir")
+    parser.add_argument("--concurrency", type=str, default="1,4,16", help="Niveles de concurrencia")
+    parser.add_argument("--requests", type=int, default=200, help="Peticiones por nivel de concurrencia")
+    parser.add_argument("--warmup", type=int, default=5, help="Peticiones de calentamiento")
+    parser.add_argument("--mix", type=str, default=DEFAULT_MIX, help="Distribución de longitudes")
+    parser.add_argument("--max_length", type=int, default=128, help="max_length de cada petición")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Timeout por petición (s)")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla del generador de frases")
+    parser.add_argument("--tokenizer_dir", type=str, default=".", help="Directorio del tokenizer")
+    parser.add_argument("--backends", type=str, default="", help="pytorch,onnx-fp32,onnx-int8 (solo con --app)")
+    parser.add_argument("--beams", type=str, default="", help="Valores de NUM_BEAMS a comparar (solo con --app)")
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="Fichero JSON de salida")
+    parser.add_argument("--baseline", type=str, help="JSON anterior con el que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Empeoramiento máximo permitido")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+    args.backends = [b for b in args.backends.split(",") if b]
+    args.beams = [int(b) for b in args.beams.split(",") if b]
+
+    if (args.backends or args.beams) and not args.single:
+        if args.url:
+            parser.error("--backends/--beams solo se pueden usar en proceso (--app)")
+        # Cada subproceso recibe los mismos argumentos salvo los de la matriz
+        args.passthrough = _strip_options(sys.argv[1:], {"--backends", "--beams", "--output", "--baseline"})
+        results = run_matrix(args)
+    else:
+        results = [asyncio.run(benchmark(args))]
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"\n✅ Resultados guardados en {args.output}")
+
+    if args.baseline and not args.single:
+        regressions = compare(results, args.baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ Regresiones respecto a {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"✅ Sin regresiones respecto a {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
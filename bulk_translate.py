@@ -0,0 +1,230 @@
+"""
+Traducción masiva offline de catálogos (JSONL o TSV) sin pasar por HTTP
+Reparte bloques de líneas entre procesos worker, cada uno con su copia del
+modelo y sus propios núcleos, y escribe los resultados en el orden de entrada
+a medida que llegan. Con memoria acotada (solo hay unos pocos bloques en
+vuelo) y un checkpoint que permite reanudar una ejecución interrumpida.
+
+Uso:
+    python bulk_translate.py catalogo.jsonl catalogo.es.jsonl --workers 4
+    python bulk_translate.py textos.tsv textos.es.tsv --text_column 1 --app app_simple
+
+JSONL: cada línea es un objeto con el texto en --text_field; la salida es el
+mismo objeto con la traducción en --output_field. TSV: la traducción se añade
+como última columna. Las líneas vacías se ignoran.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import importlib
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import sys
+import time
+
+# Estado de cada proceso worker (lo rellena _init_worker)
+_worker = {}
+
+
+def available_cpus() -> list:
+    """Núcleos que este proceso puede usar (respeta taskset/cpuset)"""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def worker_cores(index: int, workers: int, threads: int, cpus: list) -> list:
+    """Núcleos del worker index: bloques consecutivos de threads núcleos"""
+    start = (index * threads) % len(cpus)
+    return [cpus[(start + i) % len(cpus)] for i in range(min(threads, len(cpus)))]
+
+
+def _init_worker(indices, workers: int, threads: int, cpus: list, options: dict):
+    """Fija los núcleos y los threads del worker y carga el modelo (una vez por proceso)"""
+    index = indices.get()
+    cores = worker_cores(index, workers, threads, cpus)
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    # Antes de importar torch/onnxruntime para que lo respeten
+    os.environ["INTRA_OP_THREADS"] = str(len(cores))
+    os.environ["OMP_NUM_THREADS"] = str(len(cores))
+    os.environ.setdefault("WARMUP_RUNS", "1")
+    # Los núcleos ya están repartidos: sin auto-ajuste de threads
+    os.environ["THREAD_TUNING"] = "0"
+
+    module = importlib.import_module(options["app"])
+    module.load_and_warm_up()
+    if not module.ready:
+        raise RuntimeError(f"No se pudo cargar el modelo: {module.load_error}")
+    _worker.update(options, module=module, num_beams=options["num_beams"] or module.NUM_BEAMS,
+                   pair=options["pair"] or module.DEFAULT_PAIR)
+
+
+def _parse(line: str, options: dict) -> tuple:
+    """Línea de entrada -> (registro, texto)"""
+    if options["format"] == "jsonl":
+        record = json.loads(line)
+        return record, str(record.get(options["text_field"]) or "")
+    columns = line.split("\t")
+    column = options["text_column"]
+    return columns, columns[column] if column < len(columns) else ""
+
+
+def _format(record, translation: str, options: dict) -> str:
+    if options["format"] == "jsonl":
+        record[options["output_field"]] = translation
+        return json.dumps(record, ensure_ascii=False)
+    # En TSV la traducción no puede llevar tabuladores ni saltos de línea
+    return "\t".join(record + [" ".join(translation.split())])
+
+
+def translate_chunk(lines: list) -> tuple:
+    """
+    Traduce un bloque de líneas en el worker. translate_many de la app
+    consulta el cache, traduce cada texto distinto una vez y agrupa por
+    longitud. Devuelve (líneas de salida, caracteres traducidos)
+    """
+    module = _worker["module"]
+    parsed = [_parse(line, _worker) for line in lines]
+    texts = [text for _, text in parsed if text.strip()]
+    translations = iter(module.translate_many(texts, _worker["max_length"], _worker["pair"],
+                                              _worker["num_beams"]) if texts else [])
+    output = [_format(record, next(translations) if text.strip() else "", _worker) for record, text in parsed]
+    return output, sum(len(text) for text in texts)
+
+
+def read_chunks(path: str, chunk_size: int, skip: int):
+    """Bloques de chunk_size líneas no vacías, saltando las skip primeras (reanudación)"""
+    chunk = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                continue
+            if skip:
+                skip -= 1
+                continue
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+class Checkpoint:
+    """
+    Registros escritos y tamaño de la salida en ese momento. Al reanudar, la
+    salida se trunca a ese tamaño (descarta una escritura a medias) y se
+    saltan esos registros de la entrada
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    def load(self) -> dict:
+        if self.path.exists():
+            return json.loads(self.path.read_text())
+        return {"records": 0, "bytes": 0}
+
+    def save(self, records: int, size: int):
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps({"records": records, "bytes": size}))
+        os.replace(tmp, self.path)
+
+
+def run(args) -> int:
+    cpus = available_cpus()
+    threads = args.threads_per_worker or max(1, len(cpus) // args.workers)
+    checkpoint = Checkpoint(args.checkpoint or f"{args.output}.ckpt")
+    state = checkpoint.load() if args.resume else {"records": 0, "bytes": 0}
+    if args.resume and state["records"]:
+        print(f"Reanudando tras {state['records']} registros", file=sys.stderr)
+
+    options = {
+        "app": args.app, "format": args.format, "text_field": args.text_field, "output_field": args.output_field,
+        "text_column": args.text_column, "max_length": args.max_length, "num_beams": args.num_beams,
+        "pair": args.pair,
+    }
+    # Índice de cada worker para repartir los núcleos
+    context = multiprocessing.get_context()
+    indices = context.Queue()
+    for i in range(args.workers):
+        indices.put(i)
+
+    records, chars = state["records"], 0
+    start = last_report = time.perf_counter()
+    max_inflight = args.workers * 2
+
+    mode = "r+" if args.resume and Path(args.output).exists() else "w"
+    with open(args.output, mode, encoding="utf-8") as out, ProcessPoolExecutor(
+            max_workers=args.workers, mp_context=context, initializer=_init_worker,
+            initargs=(indices, args.workers, threads, cpus, options)) as pool:
+        if mode == "r+":
+            out.truncate(state["bytes"])
+            out.seek(state["bytes"])
+
+        # Ventana de bloques en vuelo: se envían en orden y se escriben en orden
+        pending = []
+        chunks = read_chunks(args.input, args.chunk_size, state["records"])
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_inflight:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    pending.append(pool.submit(translate_chunk, chunk))
+            if not pending:
+                break
+            lines, chunk_chars = pending.pop(0).result()
+            out.write("".join(line + "\n" for line in lines))
+            out.flush()
+            records += len(lines)
+            chars += chunk_chars
+            checkpoint.save(records, out.tell())
+
+            now = time.perf_counter()
+            if now - last_report >= args.report_every:
+                elapsed = now - start
+                done = records - state["records"]
+                print(f"{records} registros | {done / elapsed:.1f} registros/s | {chars / elapsed:.0f} caracteres/s",
+                      file=sys.stderr)
+                last_report = now
+
+    elapsed = time.perf_counter() - start
+    done = records - state["records"]
+    print(f"✅ {done} registros traducidos en {elapsed:.1f}s ({done / max(elapsed, 1e-9):.1f} registros/s) "
+          f"-> {args.output}", file=sys.stderr)
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Traducción masiva offline de ficheros JSONL/TSV")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--format", choices=["jsonl", "tsv"], default=None,
+                        help="Por defecto según la extensión de la entrada")
+    parser.add_argument("--text_field", default="text", help="JSONL: campo con el texto")
+    parser.add_argument("--output_field", default="translation", help="JSONL: campo para la traducción")
+    parser.add_argument("--text_column", type=int, default=0, help="TSV: columna con el texto")
+    parser.add_argument("--app", default="app", choices=["app", "app_simple"], help="Servidor cuyos modelos se usan")
+    parser.add_argument("--pair", default=None, help="Par de idiomas (default: DEFAULT_PAIR)")
+    parser.add_argument("--max_length", type=int, default=512)
+    parser.add_argument("--num_beams", type=int, default=None, help="Default: NUM_BEAMS")
+    parser.add_argument("--workers", type=int, default=1, help="Procesos, cada uno con su copia del modelo")
+    parser.add_argument("--threads_per_worker", type=int, default=None, help="Default: núcleos / workers")
+    parser.add_argument("--chunk_size", type=int, default=256, help="Líneas por bloque enviado a un worker")
+    parser.add_argument("--checkpoint", default=None, help="Default: <salida>.ckpt")
+    parser.add_argument("--resume", action="store_true", help="Continuar desde el checkpoint")
+    parser.add_argument("--report_every", type=float, default=10.0, help="Segundos entre informes de throughput")
+    args = parser.parse_args()
+    if args.format is None:
+        args.format = "tsv" if args.input.endswith((".tsv", ".txt")) else "jsonl"
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
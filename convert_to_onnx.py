@@ -5,10 +5,225 @@ import torch
 from transformers import MarianMTModel, MarianTokenizer
 from pathlib import Path
 import onnx
+import onnxruntime as ort
 from onnxruntime.quantization import quantize_dynamic, QuantType
+from onnxruntime.transformers.optimizer import optimize_model
 import argparse
+import json
+from model_loader import build_draft_model, parse_layers
+from evaluation import evaluate, summary
 
-def convert_to_onnx(model_path, output_path, quantize=True):
+# Perfiles de cuantización dinámica. exclude_vocab deja en fp32 los nodos que
+# tocan la matriz de 65k filas (embeddings y lm_head), los más sensibles
+QUANT_PROFILES = {
+    "uint8": {"weight_type": QuantType.QUInt8, "per_channel": False, "exclude_vocab": False},
+    "int8": {"weight_type": QuantType.QInt8, "per_channel": False, "exclude_vocab": False},
+    "int8-per-channel": {"weight_type": QuantType.QInt8, "per_channel": True, "exclude_vocab": False},
+    "int8-no-vocab": {"weight_type": QuantType.QInt8, "per_channel": True, "exclude_vocab": True},
+    # Solo las proyecciones (MatMul/Attention); los Gather de embeddings quedan en fp32
+    "int8-matmul": {"weight_type": QuantType.QInt8, "per_channel": True, "exclude_vocab": False,
+                    "op_types": ["MatMul", "Attention"]},
+}
+
+class DecoderWrapper(torch.nn.Module):
+    """
+    Decoder + lm_head para el primer paso: devuelve logits y el cache KV aplanado.
+    Con shortlist=True recibe además vocab_ids y solo proyecta sobre esas filas
+    """
+    
+    def __init__(self, model, shortlist=False):
+        super().__init__()
+        self.decoder = model.get_decoder()
+        self.lm_head = model.lm_head
+        self.shortlist = shortlist
+        self.register_buffer("final_logits_bias", model.final_logits_bias)
+    
+    def project(self, hidden_states, vocab_ids=None):
+        """Logits sobre todo el vocabulario o solo sobre vocab_ids (batch, seq, len(vocab_ids))"""
+        if vocab_ids is None:
+            return self.lm_head(hidden_states) + self.final_logits_bias
+        return torch.nn.functional.linear(hidden_states, self.lm_head.weight[vocab_ids],
+                                          self.final_logits_bias[0, vocab_ids])
+    
+    def forward(self, input_ids, encoder_hidden_states, encoder_attention_mask, vocab_ids=None):
+        outputs = self.decoder(
+            input_ids=input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            use_cache=True,
+            return_dict=True
+        )
+        logits = self.project(outputs.last_hidden_state, vocab_ids)
+        # Por capa: self-attention (key, value) y cross-attention (key, value)
+        present = [tensor for layer in outputs.past_key_values for tensor in layer]
+        return (logits, *present)
+
+class DecoderWithPastWrapper(DecoderWrapper):
+    """Decoder para los pasos siguientes: solo procesa el último token"""
+    
+    def forward(self, input_ids, encoder_attention_mask, *past_key_values):
+        vocab_ids = None
+        if self.shortlist:
+            *past_key_values, vocab_ids = past_key_values
+        past = tuple(tuple(past_key_values[i:i + 4]) for i in range(0, len(past_key_values), 4))
+        # El decoder solo usa encoder_hidden_states para saber que hay cross-attention;
+        # con cache los valores vienen de past, así que basta un tensor con la forma correcta
+        cross_key = past[0][2]
+        encoder_hidden_states = cross_key.transpose(1, 2).flatten(2)
+        outputs = self.decoder(
+            input_ids=input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            past_key_values=past,
+            use_cache=True,
+            return_dict=True
+        )
+        logits = self.project(outputs.last_hidden_state, vocab_ids)
+        # El cache de cross-attention no cambia: solo devolver el de self-attention
+        present = [tensor for layer in outputs.past_key_values for tensor in layer[:2]]
+        return (logits, *present)
+
+def save_ort_format(onnx_path: Path) -> Path:
+    """
+    Guarda una copia en formato ORT (.ort). start.py la precarga antes del
+    fork para que todos los workers compartan las mismas páginas de pesos
+    """
+    ort_path = onnx_path.with_suffix(".ort")
+    sess_options = ort.SessionOptions()
+    # EXTENDED en lugar de ALL: las optimizaciones de layout dependen del hardware
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    sess_options.optimized_model_filepath = str(ort_path)
+    sess_options.add_session_config_entry("session.save_model_format", "ORT")
+    ort.InferenceSession(str(onnx_path), sess_options)
+    return ort_path
+
+def fuse_graph(onnx_path: Path, config) -> dict:
+    """
+    Fusiones de onnxruntime.transformers (Attention, LayerNormalization, Gelu,
+    SkipLayerNorm...) guardadas en el propio .onnx. Devuelve los operadores fusionados
+    """
+    optimized = optimize_model(
+        str(onnx_path),
+        model_type="bart",
+        num_heads=config.decoder_attention_heads,
+        hidden_size=config.d_model,
+        opt_level=0  # Solo fusiones independientes del hardware; el resto lo hace la sesión
+    )
+    optimized.save_model_to_file(str(onnx_path))
+    return {op: count for op, count in optimized.get_fused_operator_statistics().items() if count}
+
+def vocab_nodes(onnx_path: Path, vocab_size: int) -> list:
+    """Nodos cuyo peso es la matriz del vocabulario (embeddings y lm_head)"""
+    model = onnx.load(str(onnx_path), load_external_data=False)
+    vocab_weights = {init.name for init in model.graph.initializer if vocab_size in init.dims}
+    return [node.name for node in model.graph.node
+            if node.op_type in ("Gather", "MatMul", "Gemm") and vocab_weights.intersection(node.input)]
+
+def quantize_graph(onnx_path: Path, profile: dict, vocab_size: int) -> Path:
+    """Cuantiza onnx_path con un perfil de QUANT_PROFILES en {stem}_quantized.onnx"""
+    quant_path = onnx_path.parent / f"{onnx_path.stem}_quantized.onnx"
+    quantize_dynamic(
+        str(onnx_path),
+        str(quant_path),
+        weight_type=profile["weight_type"],
+        per_channel=profile["per_channel"],
+        op_types_to_quantize=profile.get("op_types"),
+        nodes_to_exclude=vocab_nodes(onnx_path, vocab_size) if profile["exclude_vocab"] else None
+    )
+    return quant_path
+
+def export_decoders(model, output_dir: Path, prefix: str, encoder_hidden_states, attention_mask, shortlist=False):
+    """
+    Exporta {prefix}decoder_model.onnx (primer paso) y
+    {prefix}decoder_with_past_model.onnx (pasos siguientes, con cache KV).
+    Con shortlist=True ambos reciben la entrada vocab_ids (ids candidatos) y
+    los logits tienen len(vocab_ids) columnas
+    """
+    num_layers = model.config.decoder_layers
+    with torch.no_grad():
+        decoder_input_ids = torch.full((attention_mask.shape[0], 1), model.config.decoder_start_token_id)
+        decoder_outputs = DecoderWrapper(model)(decoder_input_ids, encoder_hidden_states, attention_mask)
+    
+    # Entrada extra de los decoders con shortlist: cualquier subconjunto sirve para trazar
+    extra_inputs, extra_names, extra_axes = (), [], {}
+    if shortlist:
+        extra_inputs = (torch.arange(0, model.config.vocab_size, 64),)
+        extra_names = ["vocab_ids"]
+        extra_axes = {"vocab_ids": {0: "shortlist"}}
+    
+    present_names = []
+    for i in range(num_layers):
+        present_names += [f"present.{i}.decoder.key", f"present.{i}.decoder.value",
+                          f"present.{i}.encoder.key", f"present.{i}.encoder.value"]
+    
+    decoder_path = output_dir / f"{prefix}decoder_model.onnx"
+    print(f"Exportando decoder a {decoder_path}...")
+    
+    decoder_axes = {
+        "input_ids": {0: "batch", 1: "decoder_sequence"},
+        "encoder_hidden_states": {0: "batch", 1: "encoder_sequence"},
+        "encoder_attention_mask": {0: "batch", 1: "encoder_sequence"},
+        "logits": {0: "batch", 1: "decoder_sequence"},
+        **extra_axes,
+    }
+    if shortlist:
+        decoder_axes["logits"][2] = "shortlist"
+    for name in present_names:
+        seq_axis = "decoder_sequence" if ".decoder." in name else "encoder_sequence"
+        decoder_axes[name] = {0: "batch", 2: seq_axis}
+    
+    with torch.no_grad():
+        torch.onnx.export(
+            DecoderWrapper(model, shortlist),
+            (decoder_input_ids, encoder_hidden_states, attention_mask, *extra_inputs),
+            str(decoder_path),
+            input_names=["input_ids", "encoder_hidden_states", "encoder_attention_mask"] + extra_names,
+            output_names=["logits"] + present_names,
+            dynamic_axes=decoder_axes,
+            opset_version=14,
+            do_constant_folding=True
+        )
+    
+    decoder_with_past_path = output_dir / f"{prefix}decoder_with_past_model.onnx"
+    print(f"Exportando decoder con cache KV a {decoder_with_past_path}...")
+    
+    past_names = [name.replace("present.", "past_key_values.") for name in present_names]
+    self_present_names = [name for name in present_names if ".decoder." in name]
+    
+    # Varios tokens nuevos por llamada: la decodificación especulativa verifica
+    # todas las propuestas del draft en una sola pasada
+    with_past_axes = {
+        "input_ids": {0: "batch", 1: "decoder_sequence"},
+        "encoder_attention_mask": {0: "batch", 1: "encoder_sequence"},
+        "logits": {0: "batch", 1: "decoder_sequence"},
+        **extra_axes,
+    }
+    if shortlist:
+        with_past_axes["logits"][2] = "shortlist"
+    for name in past_names:
+        seq_axis = "past_decoder_sequence" if ".decoder." in name else "encoder_sequence"
+        with_past_axes[name] = {0: "batch", 2: seq_axis}
+    for name in self_present_names:
+        with_past_axes[name] = {0: "batch", 2: "past_decoder_sequence + decoder_sequence"}
+    
+    # Se traza con 2 tokens para que la máscara causal entre tokens nuevos quede en el grafo
+    next_input_ids = decoder_outputs[0][:, -1:].argmax(-1).repeat(1, 2)
+    with torch.no_grad():
+        torch.onnx.export(
+            DecoderWithPastWrapper(model, shortlist),
+            (next_input_ids, attention_mask, *decoder_outputs[1:], *extra_inputs),
+            str(decoder_with_past_path),
+            input_names=["input_ids", "encoder_attention_mask"] + past_names + extra_names,
+            output_names=["logits"] + self_present_names,
+            dynamic_axes=with_past_axes,
+            opset_version=14,
+            do_constant_folding=True
+        )
+    
+    return [decoder_path, decoder_with_past_path]
+
+def convert_to_onnx(model_path, output_path, quantize=True, draft_layers=None, shortlist=False, optimize=True,
+                    quant_profile="uint8", evaluate_quality=True, max_bleu_drop=2.0, max_chrf_drop=1.5):
     """
     Convierte el modelo a ONNX y lo optimiza para móviles
     
@@ -16,6 +231,15 @@ def convert_to_onnx(model_path, output_path, quantize=True):
         model_path: Ruta al modelo
         output_path: Ruta para guardar el modelo ONNX
         quantize: Si se debe cuantizar el modelo (recomendado para móviles)
+        draft_layers: Capas del decoder que conserva el draft de la
+            decodificación especulativa (None: no exportar draft)
+        shortlist: Exportar también los decoders con la proyección de salida
+            restringida a una shortlist léxica (shortlist.py)
+        optimize: Aplicar las fusiones de onnxruntime.transformers
+        quant_profile: Perfil de QUANT_PROFILES
+        evaluate_quality: Comparar int8 con fp32 (BLEU/chrF en eval_samples.tsv,
+            latencia y tamaño) y descartar la cuantización si empeora más de
+            max_bleu_drop puntos de BLEU o max_chrf_drop de chrF
     """
     print(f"Cargando modelo desde {model_path}...")
     model = MarianMTModel.from_pretrained(model_path)
@@ -57,68 +281,104 @@ def convert_to_onnx(model_path, output_path, quantize=True):
             do_constant_folding=True
         )
     
-    # Exportar modelo completo (encoder + decoder juntos es más simple)
-    full_model_path = output_dir / "model.onnx"
-    print(f"Exportando modelo completo a {full_model_path}...")
-    
-    # Crear inputs de ejemplo
+    # Exportar decoder (primer paso) y decoder con cache KV (pasos siguientes)
     with torch.no_grad():
-        torch.onnx.export(
-            model,
-            (inputs["input_ids"], inputs["attention_mask"]),
-            str(full_model_path),
-            input_names=["input_ids", "attention_mask"],
-            output_names=["output"],
-            dynamic_axes={
-                "input_ids": {0: "batch", 1: "sequence"},
-                "attention_mask": {0: "batch", 1: "sequence"},
-                "output": {0: "batch", 1: "sequence"}
-            },
-            opset_version=14,
-            do_constant_folding=True
-        )
+        encoder_hidden_states = model.get_encoder()(**encoder_inputs).last_hidden_state
+    decoder_path, decoder_with_past_path = export_decoders(
+        model, output_dir, "", encoder_hidden_states, inputs["attention_mask"]
+    )
+    exported = [encoder_path, decoder_path, decoder_with_past_path]
+    
+    # Draft para la decodificación especulativa: el mismo decoder con menos capas
+    if draft_layers:
+        print(f"\nExportando draft (capas del decoder {draft_layers})...")
+        draft = build_draft_model(model, draft_layers)
+        exported += export_decoders(draft, output_dir, "draft_", encoder_hidden_states, inputs["attention_mask"])
+    
+    if shortlist:
+        print("\nExportando decoders con shortlist (proyección de salida restringida)...")
+        exported += export_decoders(model, output_dir, "shortlist_", encoder_hidden_states, inputs["attention_mask"],
+                                    shortlist=True)
     
     print("\n✓ Modelo ONNX exportado exitosamente")
     
+    if optimize:
+        print("\nAplicando fusiones de grafo (onnxruntime.transformers)...")
+        for onnx_path in exported:
+            fused = fuse_graph(onnx_path, model.config)
+            print(f"✓ {onnx_path.name}: {fused or 'sin fusiones'}")
+    
+    # Copias en formato ORT para compartir pesos entre workers (start.py)
+    for onnx_path in exported:
+        print(f"✓ Formato ORT: {save_ort_format(onnx_path)}")
+    
     # Cuantizar modelo para reducir tamaño (INT8)
     if quantize:
-        print("\nCuantizando modelo para optimización móvil...")
-        
-        # Cuantizar encoder
-        encoder_quant_path = output_dir / "encoder_model_quantized.onnx"
-        quantize_dynamic(
-            str(encoder_path),
-            str(encoder_quant_path),
-            weight_type=QuantType.QUInt8
-        )
-        print(f"✓ Encoder cuantizado: {encoder_quant_path}")
+        print(f"\nCuantizando modelo para optimización móvil (perfil {quant_profile})...")
+        profile = QUANT_PROFILES[quant_profile]
         
-        # Cuantizar modelo completo
-        full_model_quant_path = output_dir / "model_quantized.onnx"
-        quantize_dynamic(
-            str(full_model_path),
-            str(full_model_quant_path),
-            weight_type=QuantType.QUInt8
-        )
-        print(f"✓ Modelo completo cuantizado: {full_model_quant_path}")
-        
-        # Mostrar tamaños
         print("\n📊 Tamaños de archivos:")
-        print(f"Encoder original: {encoder_path.stat().st_size / 1024 / 1024:.2f} MB")
-        print(f"Encoder cuantizado: {encoder_quant_path.stat().st_size / 1024 / 1024:.2f} MB")
-        print(f"Modelo completo original: {full_model_path.stat().st_size / 1024 / 1024:.2f} MB")
-        print(f"Modelo completo cuantizado: {full_model_quant_path.stat().st_size / 1024 / 1024:.2f} MB")
-
+        quantized = []
+        for onnx_path in exported:
+            quant_path = quantize_graph(onnx_path, profile, model.config.vocab_size)
+            quantized.append(quant_path)
+            print(f"✓ {onnx_path.stem} cuantizado: {quant_path}")
+            print(f"  Original: {onnx_path.stat().st_size / 1024 / 1024:.2f} MB")
+            print(f"  Cuantizado: {quant_path.stat().st_size / 1024 / 1024:.2f} MB")
+            print(f"  Formato ORT: {save_ort_format(quant_path)}")
+        
+        if evaluate_quality:
+            check_quantization(output_dir, tokenizer, quant_profile, quantized, max_bleu_drop, max_chrf_drop)
     
     print(f"\n✅ Conversión completada! Archivos en: {output_dir}")
     return output_dir
 
+def check_quantization(output_dir: Path, tokenizer, quant_profile: str, quantized: list,
+                       max_bleu_drop: float, max_chrf_drop: float):
+    """
+    Evalúa fp32 e int8 sobre eval_samples.tsv y guarda quantization_report.json.
+    Si la cuantización pierde demasiada calidad, borra sus ficheros y aborta
+    """
+    print("\n🔎 Evaluando calidad (BLEU/chrF frente a las referencias de eval_samples.tsv)...")
+    fp32 = evaluate(str(output_dir), tokenizer, use_quantized=False)
+    int8 = evaluate(str(output_dir), tokenizer, use_quantized=True, fp32_translations=fp32["translations"])
+    print(summary("fp32", fp32))
+    print(summary(quant_profile, int8))
+    
+    bleu_drop, chrf_drop = fp32["bleu"] - int8["bleu"], fp32["chrf"] - int8["chrf"]
+    passed = bleu_drop <= max_bleu_drop and chrf_drop <= max_chrf_drop
+    report = {"profile": quant_profile, "passed": passed, "fp32": fp32, "quantized": int8,
+              "max_bleu_drop": max_bleu_drop, "max_chrf_drop": max_chrf_drop}
+    (output_dir / "quantization_report.json").write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    
+    if not passed:
+        for quant_path in quantized:
+            quant_path.unlink(missing_ok=True)
+            quant_path.with_suffix(".ort").unlink(missing_ok=True)
+        raise SystemExit(f"❌ El perfil {quant_profile} pierde {bleu_drop:.2f} BLEU / {chrf_drop:.2f} chrF "
+                         f"(máximo {max_bleu_drop} / {max_chrf_drop}): modelos cuantizados descartados")
+    print(f"✓ Perfil {quant_profile} aceptado (-{bleu_drop:.2f} BLEU, -{chrf_drop:.2f} chrF)")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convertir modelo MarianMT a ONNX")
     parser.add_argument("--model_path", type=str, default=".", help="Ruta al modelo")
     parser.add_argument("--output_path", type=str, default="./onnx_models", help="Ruta de salida")
     parser.add_argument("--no-quantize", action="store_true", help="No cuantizar modelos")
+    parser.add_argument("--draft_layers", type=str, default="0,5",
+                        help="Capas del decoder del draft para decodificación especulativa ('' para no exportarlo)")
+    parser.add_argument("--shortlist", action="store_true",
+                        help="Exportar también los decoders con proyección restringida (shortlist.py)")
+    parser.add_argument("--no-optimize", action="store_true", help="No aplicar las fusiones de grafo")
+    parser.add_argument("--quant_profile", choices=sorted(QUANT_PROFILES), default="uint8",
+                        help="Perfil de cuantización")
+    parser.add_argument("--no-eval", action="store_true", help="No evaluar la calidad de la cuantización")
+    parser.add_argument("--max_bleu_drop", type=float, default=2.0, help="Pérdida máxima de BLEU frente a fp32")
+    parser.add_argument("--max_chrf_drop", type=float, default=1.5, help="Pérdida máxima de chrF frente a fp32")
     
     args = parser.parse_args()
     
-    convert_to_onnx(args.model_path, args.output_path, quantize=not args.no_quantize)
+    convert_to_onnx(args.model_path, args.output_path, quantize=not args.no_quantize,
+                    draft_layers=parse_layers(args.draft_layers), shortlist=args.shortlist,
+                    optimize=not args.no_optimize, quant_profile=args.quant_profile,
+                    evaluate_quality=not args.no_eval, max_bleu_drop=args.max_bleu_drop,
+                    max_chrf_drop=args.max_chrf_drop)
@@ -0,0 +1,112 @@
+"""
+Política de decodificación adaptativa
+Elige por petición el número de beams, la penalización de longitud y el
+máximo de tokens a partir de la longitud del texto, la pista de calidad o el
+presupuesto de latencia del cliente y la carga actual: con el servidor
+saturado se pasa a greedy para contener el p99
+"""
+import threading
+
+QUALITY_HINTS = ("fast", "balanced", "best")
+# Escalones al reducir beams: pocos valores distintos para que el micro-batcher pueda agrupar
+BEAM_WIDTHS = (1, 2, 4)
+# max_length se redondea a estos valores por el mismo motivo
+LENGTH_BUCKETS = (16, 32, 64, 128, 256, 512)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Tokens aproximados del texto sin tokenizarlo: un token cada 3 bytes UTF-8.
+    Sobreestima el inglés (~4 caracteres por pieza) y se acerca a un token por
+    carácter en CJK, así que el max_length elegido no trunca la entrada
+    """
+    return len(text.encode("utf-8")) // 3 + 2
+
+
+class DecodingChoice:
+    """Parámetros elegidos para una petición y el motivo (se devuelven en la respuesta)"""
+
+    def __init__(self, num_beams: int, length_penalty: float, max_length: int, reason: str):
+        self.num_beams = num_beams
+        self.length_penalty = length_penalty
+        self.max_length = max_length
+        self.reason = reason
+
+    def as_dict(self) -> dict:
+        return {"num_beams": self.num_beams, "length_penalty": self.length_penalty,
+                "max_length": self.max_length, "reason": self.reason}
+
+
+class DecodingPolicy:
+    """
+    - quality: "fast" -> greedy, "balanced" (o sin pista) -> default_beams,
+      "best" -> max_beams.
+    - Carga (pendientes / capacidad): desde reduce_load como mucho 2 beams,
+      desde greedy_load greedy.
+    - latency_budget_ms: baja de beams mientras la estimación (tokens de
+      salida esperados x tiempo medio por paso con esos beams) no quepa.
+    - max_length: length_ratio x tokens de entrada + 8, redondeado a
+      LENGTH_BUCKETS y sin pasar del max_length de la petición.
+    - length_penalty: crece con la longitud de la entrada (1.0 a 1.5) para
+      que beam search no prefiera traducciones cortas de frases largas.
+    """
+
+    def __init__(self, default_beams: int, max_beams: int = 4, reduce_load: float = 0.4, greedy_load: float = 0.75,
+                 length_ratio: float = 2.0, enabled: bool = True):
+        self.default_beams = default_beams
+        self.max_beams = max(max_beams, default_beams)
+        self.reduce_load = reduce_load
+        self.greedy_load = greedy_load
+        self.length_ratio = length_ratio
+        self.enabled = enabled
+        # Media móvil de segundos por paso del decoder, por número de beams
+        self._step_seconds = {}
+        self._lock = threading.Lock()
+
+    def record_step(self, num_beams: int, seconds: float):
+        """Tiempo medio de un paso del decoder con num_beams (lo reporta la traducción)"""
+        with self._lock:
+            previous = self._step_seconds.get(num_beams)
+            self._step_seconds[num_beams] = seconds if previous is None else 0.9 * previous + 0.1 * seconds
+
+    def step_seconds(self, num_beams: int):
+        return self._step_seconds.get(num_beams)
+
+    def _max_length(self, input_tokens: int, max_length: int) -> int:
+        wanted = int(self.length_ratio * input_tokens) + 8
+        bucket = next((b for b in LENGTH_BUCKETS if b >= wanted), LENGTH_BUCKETS[-1])
+        return min(bucket, max_length)
+
+    def choose(self, text: str, max_length: int, load: float = 0.0, quality: str = None,
+               latency_budget_ms: float = None) -> DecodingChoice:
+        """Parámetros para traducir text con la carga actual (0 = libre, 1 = cola llena)"""
+        if not self.enabled:
+            return DecodingChoice(self.default_beams, 1.0, max_length, "fixed")
+
+        input_tokens = estimate_tokens(text)
+        max_length = self._max_length(input_tokens, max_length)
+
+        if quality == "fast":
+            num_beams, reason = 1, "quality_hint"
+        elif quality == "best":
+            num_beams, reason = self.max_beams, "quality_hint"
+        else:
+            num_beams, reason = self.default_beams, "default"
+
+        if load >= self.greedy_load and num_beams > 1:
+            num_beams, reason = 1, "load"
+        elif load >= self.reduce_load and num_beams > 2:
+            num_beams, reason = 2, "load"
+
+        if latency_budget_ms is not None:
+            # Pasos esperados: aproximadamente tantos tokens de salida como de entrada
+            expected_steps = min(max_length, input_tokens)
+            while num_beams > 1:
+                step = self.step_seconds(num_beams)
+                if step is None or expected_steps * step * 1000 <= latency_budget_ms:
+                    break
+                num_beams = max(b for b in BEAM_WIDTHS if b < num_beams)
+                reason = "latency_budget"
+
+        length_penalty = 1.0 if num_beams == 1 else round(1.0 + min(input_tokens / 128, 0.5), 1)
+        return DecodingChoice(num_beams, length_penalty, max_length, reason)
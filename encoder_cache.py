@@ -0,0 +1,127 @@
+"""
+Cache de salidas del encoder
+Las re-traducciones de un mismo texto (otro max_length, otros beams, streaming
+tras /translate...) reutilizan los estados ocultos del encoder y pasan
+directamente a decodificar. Funciona con arrays de NumPy (ONNX) y tensores de
+torch (PyTorch) sin importar torch
+"""
+from collections import OrderedDict
+import hashlib
+import threading
+
+import numpy as np
+
+
+def _nbytes(value) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return value.numel() * value.element_size()
+
+
+def _copy(value):
+    """Copia de una fila: un slice mantendría vivo el lote entero"""
+    return value.copy() if isinstance(value, np.ndarray) else value.clone()
+
+
+def _zeros(like, shape):
+    if isinstance(like, np.ndarray):
+        return np.zeros(shape, dtype=like.dtype)
+    return like.new_zeros(shape)
+
+
+class EncoderCache:
+    """
+    Cache LRU de estados ocultos del encoder por frase, limitado por memoria.
+
+    La clave es un hash de los ids de la frase sin padding (más un espacio de
+    nombres por modelo). El encoder es bidireccional: cada token depende de la
+    frase entera, así que solo se reutilizan frases idénticas, no prefijos.
+    Como el padding está enmascarado, la salida de una frase no depende del
+    lote en el que se calculó: en un lote mixto solo las frases nuevas pasan
+    por el encoder.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(ids: np.ndarray, namespace: str = "") -> str:
+        digest = hashlib.blake2b(np.ascontiguousarray(ids, dtype=np.int64).tobytes(), digest_size=16)
+        digest.update(namespace.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _get(self, key: str):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key: str, value):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= _nbytes(previous)
+        self._entries[key] = value
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= _nbytes(evicted)
+
+    def encode(self, input_ids, attention_mask, encode_fn, namespace: str = ""):
+        """
+        Estados ocultos (batch, seq, hidden) del lote, como encode_fn(input_ids, attention_mask).
+        input_ids/attention_mask con padding a la derecha (arrays o tensores);
+        encode_fn solo se llama con las frases que no están en el cache
+        """
+        ids = np.asarray(input_ids)
+        lengths = np.asarray(attention_mask).sum(axis=1).astype(int)
+        keys = [self.make_key(ids[i, :n], namespace) for i, n in enumerate(lengths)]
+
+        with self._lock:
+            rows = [self._get(key) for key in keys]
+        misses = [i for i, row in enumerate(rows) if row is None]
+        hits = len(keys) - len(misses)
+
+        if len(misses) == len(keys):
+            # Nada en cache: el lote tal cual, sin reensamblar
+            hidden_states = encode_fn(input_ids, attention_mask)
+            with self._lock:
+                self.misses += len(keys)
+                for i, key in enumerate(keys):
+                    self._put(key, _copy(hidden_states[i, :lengths[i]]))
+            return hidden_states
+
+        if misses:
+            width = int(lengths[misses].max())
+            computed = encode_fn(input_ids[misses, :width], attention_mask[misses, :width])
+            for j, i in enumerate(misses):
+                rows[i] = _copy(computed[j, :lengths[i]])
+        with self._lock:
+            self.hits += hits
+            self.misses += len(misses)
+            for i in misses:
+                self._put(keys[i], rows[i])
+
+        hidden_states = _zeros(rows[0], (len(rows), ids.shape[1], rows[0].shape[-1]))
+        for i, row in enumerate(rows):
+            hidden_states[i, :row.shape[0]] = row
+        return hidden_states
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,172 @@
+"""
+Evaluación de calidad de los modelos ONNX: BLEU y chrF sobre eval_samples.tsv
+(frases en inglés con su traducción de referencia), además de latencia y tamaño.
+convert_to_onnx.py la usa para comparar cada perfil de cuantización con fp32.
+
+Uso:
+    python evaluation.py --onnx_dir ./onnx_models
+"""
+import argparse
+from collections import Counter
+import html
+import json
+import math
+from pathlib import Path
+import re
+import time
+
+SAMPLES_PATH = Path(__file__).parent / "eval_samples.tsv"
+
+# Tokenización "13a" de sacrebleu (la habitual para BLEU)
+_13A_RULES = [
+    (re.compile(r"([\{-\~\[-\` -\&\(-\+\:-\@\/])"), r" \1 "),
+    (re.compile(r"([^0-9])([\.,])"), r"\1 \2 "),
+    (re.compile(r"([\.,])([^0-9])"), r" \1 \2"),
+    (re.compile(r"([0-9])(-)"), r"\1 \2 "),
+]
+
+
+def load_samples(path: str = None) -> tuple:
+    """Líneas "fuente<TAB>referencia" -> (fuentes, referencias)"""
+    sources, references = [], []
+    with open(path or SAMPLES_PATH, encoding="utf-8") as f:
+        for line in f:
+            source, _, reference = line.rstrip("\n").partition("\t")
+            if source:
+                sources.append(source)
+                references.append(reference)
+    return sources, references
+
+
+def _tokenize_13a(text: str) -> list:
+    text = html.unescape(text)
+    text = f" {text} "
+    for pattern, replacement in _13A_RULES:
+        text = pattern.sub(replacement, text)
+    return text.split()
+
+
+def _ngrams(tokens, n: int) -> Counter:
+    return Counter(tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+
+
+def corpus_bleu(hypotheses: list, references: list, max_order: int = 4) -> float:
+    """BLEU de corpus (0-100) con una referencia por frase, como sacrebleu sin suavizado"""
+    matches = [0] * max_order
+    totals = [0] * max_order
+    hyp_len = ref_len = 0
+    for hypothesis, reference in zip(hypotheses, references):
+        hyp, ref = _tokenize_13a(hypothesis), _tokenize_13a(reference)
+        hyp_len += len(hyp)
+        ref_len += len(ref)
+        for n in range(1, max_order + 1):
+            hyp_ngrams, ref_ngrams = _ngrams(hyp, n), _ngrams(ref, n)
+            matches[n - 1] += sum(min(count, ref_ngrams[gram]) for gram, count in hyp_ngrams.items())
+            totals[n - 1] += max(len(hyp) - n + 1, 0)
+    if hyp_len == 0 or min(matches) == 0:
+        return 0.0
+    log_precision = sum(math.log(m / t) for m, t in zip(matches, totals)) / max_order
+    brevity = 1.0 if hyp_len > ref_len else math.exp(1 - ref_len / hyp_len)
+    return 100 * brevity * math.exp(log_precision)
+
+
+def corpus_chrf(hypotheses: list, references: list, char_order: int = 6, beta: float = 2.0) -> float:
+    """chrF de corpus (0-100): n-gramas de caracteres sin espacios, como sacrebleu"""
+    matches = [0] * char_order
+    hyp_totals = [0] * char_order
+    ref_totals = [0] * char_order
+    for hypothesis, reference in zip(hypotheses, references):
+        hyp, ref = hypothesis.replace(" ", ""), reference.replace(" ", "")
+        for n in range(1, char_order + 1):
+            hyp_ngrams, ref_ngrams = _ngrams(hyp, n), _ngrams(ref, n)
+            matches[n - 1] += sum((hyp_ngrams & ref_ngrams).values())
+            hyp_totals[n - 1] += sum(hyp_ngrams.values())
+            ref_totals[n - 1] += sum(ref_ngrams.values())
+
+    # F-beta por orden, promediado sobre los órdenes con n-gramas en ambos lados
+    factor = beta ** 2
+    scores = []
+    for match, hyp_total, ref_total in zip(matches, hyp_totals, ref_totals):
+        if hyp_total and ref_total:
+            precision, recall = match / hyp_total, match / ref_total
+            denominator = factor * precision + recall
+            scores.append((1 + factor) * precision * recall / denominator if denominator else 0.0)
+    return 100 * sum(scores) / len(scores) if scores else 0.0
+
+
+def model_size_mb(model_dir: str, use_quantized: bool) -> float:
+    """Tamaño de encoder + decoders (.onnx) de una variante"""
+    from onnx_decoder import MODEL_NAMES
+    suffix = "_quantized" if use_quantized else ""
+    return sum((Path(model_dir) / f"{name}{suffix}.onnx").stat().st_size for name in MODEL_NAMES) / 1024 / 1024
+
+
+def translate_onnx(model_dir: str, tokenizer, texts: list, use_quantized: bool, num_beams: int = 1,
+                   batch_size: int = 8, max_length: int = 256) -> tuple:
+    """Traduce texts con los modelos ONNX del directorio; devuelve (traducciones, segundos)"""
+    from onnx_decoder import OnnxMarianGenerator
+    generator = OnnxMarianGenerator.from_pretrained(model_dir, use_quantized=use_quantized)
+    translations = []
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        inputs = tokenizer(texts[i:i + batch_size], return_tensors="np", padding=True, truncation=True,
+                           max_length=max_length)
+        output_ids = generator.generate(inputs["input_ids"], inputs["attention_mask"], max_length=max_length,
+                                        num_beams=num_beams)
+        translations += tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+    return translations, time.perf_counter() - start
+
+
+def evaluate(model_dir: str, tokenizer, use_quantized: bool, samples_path: str = None, num_beams: int = 1,
+             fp32_translations: list = None) -> dict:
+    """
+    BLEU/chrF frente a las referencias, latencia y tamaño de una variante.
+    Con fp32_translations también mide el acuerdo con la salida fp32
+    """
+    sources, references = load_samples(samples_path)
+    translations, seconds = translate_onnx(model_dir, tokenizer, sources, use_quantized, num_beams)
+    result = {
+        "bleu": corpus_bleu(translations, references),
+        "chrf": corpus_chrf(translations, references),
+        "seconds": seconds,
+        "ms_per_sentence": 1000 * seconds / max(len(sources), 1),
+        "size_mb": model_size_mb(model_dir, use_quantized),
+        "translations": translations,
+    }
+    if fp32_translations is not None:
+        result["bleu_vs_fp32"] = corpus_bleu(translations, fp32_translations)
+        result["chrf_vs_fp32"] = corpus_chrf(translations, fp32_translations)
+    return result
+
+
+def summary(name: str, result: dict) -> str:
+    line = (f"{name}: BLEU {result['bleu']:.2f} | chrF {result['chrf']:.2f} | "
+            f"{result['ms_per_sentence']:.1f} ms/frase | {result['size_mb']:.1f} MB")
+    if "bleu_vs_fp32" in result:
+        line += f" | vs fp32: BLEU {result['bleu_vs_fp32']:.2f}, chrF {result['chrf_vs_fp32']:.2f}"
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BLEU/chrF, latencia y tamaño de los modelos ONNX (fp32 vs int8)")
+    parser.add_argument("--onnx_dir", default="./onnx_models")
+    parser.add_argument("--model_dir", default=".", help="Directorio del tokenizer")
+    parser.add_argument("--samples", default=None, help=f"TSV fuente<TAB>referencia (default: {SAMPLES_PATH.name})")
+    parser.add_argument("--num_beams", type=int, default=1)
+    parser.add_argument("--output", default=None, help="Guardar los resultados en JSON")
+    args = parser.parse_args()
+
+    from marian_tokenizer import load_tokenizer
+    tokenizer = load_tokenizer(args.model_dir)
+    results = {"fp32": evaluate(args.onnx_dir, tokenizer, False, args.samples, args.num_beams)}
+    print(summary("fp32", results["fp32"]))
+    if (Path(args.onnx_dir) / "encoder_model_quantized.onnx").exists():
+        results["quantized"] = evaluate(args.onnx_dir, tokenizer, True, args.samples, args.num_beams,
+                                        fp32_translations=results["fp32"]["translations"])
+        print(summary("quantized", results["quantized"]))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
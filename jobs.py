@@ -0,0 +1,353 @@
+"""
+Trabajos de traducción en segundo plano
+Para listas o ficheros demasiado grandes para una sola petición HTTP: el
+cliente crea el trabajo, recibe un id y consulta el progreso o descarga los
+resultados mientras un worker los traduce por bloques. Todo vive en disco
+(JOBS_DIR/<id>/), así que un reinicio retoma los trabajos donde se quedaron:
+
+- input.jsonl: un texto por línea (JSON, admite saltos de línea).
+- output.jsonl: {"index", "original", "translated", ...} por texto, en orden.
+- meta.json: estado, progreso y posición en ambos ficheros tras el último
+  bloque completo (al reanudar, la salida se trunca a esa posición).
+
+La traducción interactiva tiene prioridad: cada lote de un bloque solo
+empieza cuando idle_fn() indica que no hay inferencia interactiva pendiente.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import shutil
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class JobNotFoundError(Exception):
+    """El trabajo no existe (o ya se borró)"""
+
+
+class JobTooLargeError(Exception):
+    """El trabajo supera el máximo de textos"""
+
+
+def _write_json(path: Path, data: dict):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False))
+    os.replace(tmp, path)
+
+
+def public_view(meta: dict) -> dict:
+    """Estado de un trabajo para la API (sin posiciones internas de los ficheros)"""
+    view = {key: value for key, value in meta.items() if key not in ("input_offset", "output_bytes")}
+    view["progress"] = round(meta["done"] / meta["total"], 4) if meta["total"] else 1.0
+    return view
+
+
+def parse_upload_line(line: bytes, fmt: str = "txt", text_field: str = "text"):
+    """Texto de una línea subida (txt: la línea; jsonl: el campo text_field), o None si está vacía"""
+    line = line.decode("utf-8").rstrip("\r")
+    if not line.strip():
+        return None
+    if fmt == "jsonl":
+        return str(json.loads(line).get(text_field) or "")
+    return line
+
+
+class JobWriter:
+    """Escribe la entrada de un trabajo texto a texto (subidas grandes sin tenerlas en memoria)"""
+
+    def __init__(self, store: "JobStore", params: dict):
+        self.store = store
+        self.params = params
+        self.job_id = uuid.uuid4().hex
+        self.path = store.root / self.job_id
+        self.path.mkdir(parents=True)
+        self._input = open(self.path / "input.jsonl", "w", encoding="utf-8")
+        self.total = 0
+
+    def add(self, text: str):
+        if self.total >= self.store.max_texts:
+            raise JobTooLargeError(f"Un trabajo admite como mucho {self.store.max_texts} textos")
+        self._input.write(json.dumps(text, ensure_ascii=False) + "\n")
+        self.total += 1
+
+    def finish(self) -> dict:
+        """Cierra la entrada y deja el trabajo en cola; meta.json se escribe el último"""
+        self._input.close()
+        (self.path / "output.jsonl").touch()
+        now = time.time()
+        meta = {
+            "job_id": self.job_id, "status": "queued", "total": self.total, "done": 0,
+            "params": self.params, "created_at": now, "updated_at": now, "error": None,
+            "input_offset": 0, "output_bytes": 0,
+        }
+        _write_json(self.path / "meta.json", meta)
+        return meta
+
+    def abort(self):
+        self._input.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class JobStore:
+    """Trabajos en disco bajo root; varios procesos (start.py con WORKERS>1) pueden compartirlo"""
+
+    def __init__(self, root: str, max_texts: int = 100000, retention_s: float = 24 * 3600):
+        self.root = Path(root)
+        self.max_texts = max_texts
+        self.retention_s = retention_s
+
+    def _path(self, job_id: str) -> Path:
+        if not _JOB_ID.fullmatch(job_id) or not (self.root / job_id / "meta.json").exists():
+            raise JobNotFoundError(job_id)
+        return self.root / job_id
+
+    def writer(self, params: dict) -> JobWriter:
+        return JobWriter(self, params)
+
+    def create(self, texts, params: dict) -> dict:
+        writer = self.writer(params)
+        try:
+            for text in texts:
+                writer.add(text)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.finish()
+
+    def get(self, job_id: str) -> dict:
+        try:
+            return json.loads((self._path(job_id) / "meta.json").read_text())
+        except (OSError, ValueError):
+            raise JobNotFoundError(job_id)
+
+    def save(self, meta: dict):
+        """Actualiza meta.json; JobNotFoundError si el trabajo se borró mientras tanto"""
+        path = self.root / meta["job_id"]
+        if not path.exists():
+            raise JobNotFoundError(meta["job_id"])
+        meta["updated_at"] = time.time()
+        _write_json(path / "meta.json", meta)
+
+    def results(self, job_id: str, start: int = 0, block_size: int = 64 * 1024):
+        """
+        Resultados ya completos (bytes de output.jsonl hasta el último bloque
+        guardado), desde el texto start
+        """
+        path = self._path(job_id)
+        end = self.get(job_id)["output_bytes"]
+        with open(path / "output.jsonl", "rb") as f:
+            for _ in range(start):
+                if f.tell() >= end or not f.readline():
+                    return
+            while f.tell() < end:
+                block = f.read(min(block_size, end - f.tell()))
+                if not block:
+                    return
+                yield block
+
+    def delete(self, job_id: str):
+        """Borra el trabajo; si se está traduciendo, el worker lo abandona tras el bloque en curso"""
+        shutil.rmtree(self._path(job_id), ignore_errors=True)
+
+    def pending(self) -> list:
+        """Ids de los trabajos por terminar, los más antiguos primero"""
+        jobs = []
+        for meta_path in self.root.glob("*/meta.json"):
+            try:
+                meta = json.loads(meta_path.read_text())
+            except (OSError, ValueError):
+                continue
+            if meta["status"] in ("queued", "running"):
+                jobs.append((meta["created_at"], meta["job_id"]))
+        return [job_id for _, job_id in sorted(jobs)]
+
+    def cleanup(self) -> int:
+        """Borra los trabajos terminados hace más de retention_s"""
+        removed = 0
+        limit = time.time() - self.retention_s
+        for meta_path in self.root.glob("*/meta.json"):
+            try:
+                meta = json.loads(meta_path.read_text())
+            except (OSError, ValueError):
+                continue
+            if meta["status"] in ("done", "failed") and meta["updated_at"] < limit:
+                shutil.rmtree(meta_path.parent, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def claim(self, job_id: str):
+        """Lock exclusivo del trabajo (fichero abierto) o None si otro proceso lo está traduciendo"""
+        try:
+            import fcntl
+        except ImportError:
+            return open(os.devnull)
+        try:
+            lock_file = open(self._path(job_id) / "lock", "w")
+        except (OSError, JobNotFoundError):
+            return None
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+
+class JobRunner:
+    """
+    Worker asyncio que traduce los trabajos en cola de uno en uno.
+    translate_fn(textos, params) -> [dict con "translated" y más campos] se
+    ejecuta en un thread propio, fuera del pool de inferencia interactivo
+    (en su cola FIFO las peticiones esperarían detrás del trabajo). Los
+    resultados se guardan por bloques de chunk_size textos, traducidos en
+    lotes de batch_size; antes de cada lote espera a que idle_fn() sea True
+    (sin peticiones interactivas pendientes), así que una petición que llega
+    a mitad de bloque solo espera al lote en curso. busy indica que hay un
+    lote traduciéndose (cuenta como carga para la política de decodificación).
+    La lectura y escritura de los ficheros también va a ese thread, nunca al
+    event loop
+    """
+
+    def __init__(self, store: JobStore, translate_fn, idle_fn, chunk_size: int = 32, batch_size: int = 8,
+                 poll_interval: float = 0.05, scan_interval: float = 2.0):
+        self.store = store
+        self.translate_fn = translate_fn
+        self.idle_fn = idle_fn
+        self.chunk_size = chunk_size
+        self.batch_size = max(1, min(batch_size, chunk_size))
+        self.poll_interval = poll_interval
+        self.scan_interval = scan_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs")
+        self._wake = None
+        self._task = None
+        self.translated = 0  # Textos traducidos por este proceso
+        self.busy = False
+
+    async def start(self):
+        self.store.root.mkdir(parents=True, exist_ok=True)
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _io(self, fn, *args):
+        """Ejecuta fn(*args) (disco) en el thread del worker"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def wake(self):
+        """Hay un trabajo nuevo (los de otros procesos se ven en el siguiente escaneo)"""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._io(self.store.cleanup)
+                for job_id in await self._io(self.store.pending):
+                    lock = await self._io(self.store.claim, job_id)
+                    if lock is not None:
+                        with lock:
+                            await self._process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en el worker de trabajos: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.scan_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    @staticmethod
+    def _open(path: Path, meta: dict):
+        """Entrada y salida del trabajo, tras el último bloque guardado (descarta una escritura a medias)"""
+        source = open(path / "input.jsonl", "rb")
+        try:
+            output = open(path / "output.jsonl", "r+b")
+        except BaseException:
+            source.close()
+            raise
+        source.seek(meta["input_offset"])
+        output.truncate(meta["output_bytes"])
+        output.seek(meta["output_bytes"])
+        return source, output
+
+    async def _translate(self, texts: list, params: dict) -> list:
+        """Traduce un bloque en lotes de batch_size, cada uno cuando no hay tráfico interactivo"""
+        results = []
+        for start in range(0, len(texts), self.batch_size):
+            while not self.idle_fn():
+                await asyncio.sleep(self.poll_interval)
+            self.busy = True
+            try:
+                results += await self._io(self.translate_fn, texts[start:start + self.batch_size], params)
+            finally:
+                self.busy = False
+        return results
+
+    def _read_chunk(self, source) -> list:
+        lines = [line for line in (source.readline() for _ in range(self.chunk_size)) if line]
+        return [json.loads(line) for line in lines]
+
+    def _write_chunk(self, source, output, meta: dict, texts: list, results: list):
+        """Añade los resultados del bloque y guarda la nueva posición en meta.json"""
+        output.write("".join(
+            json.dumps(dict(result, index=meta["done"] + i, original=text), ensure_ascii=False) + "\n"
+            for i, (text, result) in enumerate(zip(texts, results))
+        ).encode("utf-8"))
+        output.flush()
+        meta.update(done=meta["done"] + len(texts), input_offset=source.tell(), output_bytes=output.tell())
+        self.store.save(meta)
+
+    async def _process(self, job_id: str):
+        try:
+            meta = await self._io(self.store.get, job_id)
+        except JobNotFoundError:
+            return
+        if meta["status"] not in ("queued", "running"):
+            return
+        path = self.store.root / job_id
+        try:
+            meta["status"] = "running"
+            await self._io(self.store.save, meta)
+            source, output = await self._io(self._open, path, meta)
+            try:
+                while True:
+                    texts = await self._io(self._read_chunk, source)
+                    if not texts:
+                        break
+                    results = await self._translate(texts, meta["params"])
+                    await self._io(self._write_chunk, source, output, meta, texts, results)
+                    self.translated += len(texts)
+            finally:
+                source.close()
+                output.close()
+            meta["status"] = "done"
+            await self._io(self.store.save, meta)
+            logger.info(f"✅ Trabajo {job_id}: {meta['total']} textos traducidos")
+        except Exception as e:
+            # CancelledError (apagado) no entra aquí: el trabajo sigue "running" y se reanuda al arrancar
+            if not await self._io(path.exists):
+                logger.info(f"Trabajo {job_id} borrado durante la traducción")
+                return
+            logger.error(f"Error en el trabajo {job_id}: {e}")
+            meta.update(status="failed", error=str(e))
+            try:
+                await self._io(self.store.save, meta)
+            except JobNotFoundError:
+                pass
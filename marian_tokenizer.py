@@ -0,0 +1,326 @@
+"""
+Tokenizer MarianMT sin transformers: sentencepiece + vocab.json
+Se puede precompilar en un único artefacto (tokenizer.bin) que arranca mucho
+más rápido que MarianTokenizer.from_pretrained (no importa transformers ni
+parsea vocab.json)
+
+Los lotes se codifican con una sola llamada a sentencepiece y una tabla
+NumPy (id de source.spm -> id del vocabulario) directamente sobre arrays
+int64 preasignados; la decodificación por lotes usa la tabla inversa hacia
+target.spm. Los casos raros (tokens especiales literales, códigos de idioma,
+piezas desconocidas) pasan por el camino pieza a pieza, que reproduce
+MarianTokenizer exactamente.
+
+Uso:
+    python marian_tokenizer.py [--model_dir .] [--output tokenizer.bin]
+"""
+import argparse
+import json
+import logging
+from pathlib import Path
+import pickle
+import re
+from typing import List
+
+import numpy as np
+import sentencepiece as spm
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_NAME = "tokenizer.bin"
+ARTIFACT_FORMAT = 2
+SPIECE_UNDERLINE = "▁"
+
+
+class MarianSpmTokenizer:
+    """
+    Reimplementa la parte de MarianTokenizer que usan los servidores:
+    __call__ (truncation/padding), pad, decode y batch_decode.
+
+    Codifica con source.spm, decodifica con target.spm y traduce piezas a ids
+    con el vocabulario compartido, igual que MarianTokenizer (incluido el
+    caso de los tokens especiales escritos literalmente en el texto).
+    """
+
+    def __init__(self, source_model: bytes, target_model: bytes, vocab: List[str], model_max_length: int = 512,
+                 eos_token: str = "</s>", unk_token: str = "<unk>", pad_token: str = "<pad>", tables: tuple = None,
+                 num_threads: int = 1):
+        self.source_model = source_model
+        self.target_model = target_model
+        self.spm_source = spm.SentencePieceProcessor(model_proto=source_model)
+        self.spm_target = spm.SentencePieceProcessor(model_proto=target_model)
+
+        self.vocab = vocab
+        self.encoder = {piece: i for i, piece in enumerate(vocab)}
+        self.model_max_length = model_max_length
+
+        self.eos_token, self.unk_token, self.pad_token = eos_token, unk_token, pad_token
+        self.eos_token_id = self.encoder[eos_token]
+        self.unk_token_id = self.encoder[unk_token]
+        self.pad_token_id = self.encoder[pad_token]
+        self.all_special_tokens = [eos_token, unk_token, pad_token]
+        self.all_special_ids = {self.eos_token_id, self.unk_token_id, self.pad_token_id}
+
+        self._special_re = re.compile("(" + "|".join(re.escape(t) for t in self.all_special_tokens) + ")")
+        self._language_code_re = re.compile(">>.+<<")
+
+        # Threads de sentencepiece por lote (1: no competir con los threads de inferencia)
+        self.num_threads = num_threads
+        self.source_to_vocab, self.vocab_to_target = tables if tables is not None else self._build_tables()
+        # Para batch_decode(skip_special_tokens=True): los especiales se traducen a
+        # un id de control de target.spm, que sentencepiece decodifica como "",
+        # así no hay que filtrarlos fila a fila
+        control_id = self.spm_target.eos_id()
+        self._skip_table = None
+        if control_id >= 0 and self.spm_target.is_control(control_id):
+            self._skip_table = self.vocab_to_target.copy()
+            self._skip_table[sorted(self.all_special_ids)] = control_id
+
+    def _build_tables(self) -> tuple:
+        """
+        source_to_vocab[id_spm] = id del vocabulario; la posición extra final
+        es el </s> que se añade a cada secuencia. vocab_to_target[id] = id en
+        target.spm, o -1 si la pieza no se decodifica igual por id
+        """
+        source_to_vocab = np.array(
+            [self.encoder.get(self.spm_source.id_to_piece(i), self.unk_token_id)
+             for i in range(self.spm_source.get_piece_size())] + [self.eos_token_id],
+            dtype=np.int64
+        )
+        vocab_to_target = np.full(len(self.vocab), -1, dtype=np.int64)
+        for i, piece in enumerate(self.vocab):
+            target_id = self.spm_target.piece_to_id(piece)
+            if (self.spm_target.id_to_piece(target_id) == piece and not self.spm_target.is_unknown(target_id)
+                    and not self.spm_target.is_control(target_id)):
+                vocab_to_target[i] = target_id
+        return source_to_vocab, vocab_to_target
+
+    @classmethod
+    def from_files(cls, model_dir: str):
+        """Construye el tokenizer desde source.spm, target.spm, vocab.json y tokenizer_config.json"""
+        model_path = Path(model_dir)
+        with open(model_path / "vocab.json", encoding="utf-8") as f:
+            encoder = json.load(f)
+        vocab = [None] * (max(encoder.values()) + 1)
+        for piece, i in encoder.items():
+            vocab[i] = piece
+
+        kwargs = {}
+        config_path = model_path / "tokenizer_config.json"
+        if config_path.exists():
+            config = json.loads(config_path.read_text(encoding="utf-8"))
+            for key in ("model_max_length", "eos_token", "unk_token", "pad_token"):
+                if isinstance(config.get(key), (int, str)):
+                    kwargs[key] = config[key]
+
+        return cls((model_path / "source.spm").read_bytes(), (model_path / "target.spm").read_bytes(), vocab, **kwargs)
+
+    @classmethod
+    def from_artifact(cls, path: str):
+        """Carga un artefacto generado por save_artifact (solo artefactos propios: usa pickle)"""
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        if state.get("format") != ARTIFACT_FORMAT:
+            raise ValueError(f"Formato de artefacto no soportado: {state.get('format')}")
+        return cls(state["source_model"], state["target_model"], state["vocab"], state["model_max_length"],
+                   *state["special_tokens"], tables=state["tables"])
+
+    def save_artifact(self, path: str):
+        """Guarda modelos sentencepiece + vocabulario en un solo fichero"""
+        state = {
+            "format": ARTIFACT_FORMAT,
+            "source_model": self.source_model,
+            "target_model": self.target_model,
+            "vocab": self.vocab,
+            "model_max_length": self.model_max_length,
+            "special_tokens": (self.eos_token, self.unk_token, self.pad_token),
+            "tables": (self.source_to_vocab, self.vocab_to_target),
+        }
+        with open(path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def tokenize(self, text: str) -> List[str]:
+        """Piezas sentencepiece del texto; los tokens especiales literales se respetan"""
+        pieces = []
+        for chunk in self._special_re.split(text):
+            if not chunk:
+                continue
+            if chunk in self.all_special_tokens:
+                pieces.append(chunk)
+                continue
+            # Código de idioma (>>es<<) como en MarianTokenizer de transformers 4.38 (requirements.txt)
+            match = self._language_code_re.match(chunk)
+            code = [match.group(0)] if match else []
+            pieces.extend(code + self.spm_source.encode(self._language_code_re.sub("", chunk), out_type=str))
+        return pieces
+
+    def encode(self, text: str, truncation: bool = False, max_length: int = None) -> List[int]:
+        """Ids del texto terminados en </s>"""
+        ids = [self.encoder.get(piece, self.unk_token_id) for piece in self.tokenize(text)]
+        if truncation:
+            ids = ids[:(max_length or self.model_max_length) - 1]
+        return ids + [self.eos_token_id]
+
+    def _needs_slow_path(self, text: str) -> bool:
+        """Textos que sentencepiece por ids no tokeniza igual que MarianTokenizer"""
+        return ">>" in text or any(token in text for token in self.all_special_tokens)
+
+    def _encode_flat(self, texts: List[str], truncation: bool, max_length: int):
+        """Ids de todo el lote concatenados (con </s>) y la longitud de cada texto"""
+        limit = (max_length or self.model_max_length) - 1 if truncation else None
+        eos_index = len(self.source_to_vocab) - 1
+        unk_id = self.spm_source.unk_id()
+
+        rows = self.spm_source.encode(list(texts), num_threads=self.num_threads)
+        pieces, lengths = [], np.empty(len(texts), dtype=np.int64)
+        for row, (text, ids) in enumerate(zip(texts, rows)):
+            if unk_id in ids or self._needs_slow_path(text):
+                # Se guardan ya como ids del vocabulario (negativos para distinguirlos)
+                ids = [-1 - i for i in self.encode(text, truncation, max_length)]
+            else:
+                ids = ids[:limit] + [eos_index]
+            pieces.append(ids)
+            lengths[row] = len(ids)
+
+        flat = np.fromiter((i for ids in pieces for i in ids), dtype=np.int64, count=int(lengths.sum()))
+        slow = flat < 0
+        flat = np.where(slow, -1 - flat, self.source_to_vocab[np.where(slow, 0, flat)])
+        return flat, lengths
+
+    def encode_batch(self, texts: List[str], truncation: bool = True, max_length: int = None,
+                     out_ids: np.ndarray = None, out_mask: np.ndarray = None) -> tuple:
+        """
+        Codifica un lote en (input_ids, attention_mask) int64 con padding por
+        la derecha. Si se pasan out_ids/out_mask suficientemente grandes se
+        escribe en ellos (sin reservar memoria) y se devuelven vistas.
+        """
+        flat, lengths = self._encode_flat(texts, truncation, max_length)
+        width = int(lengths.max()) if len(lengths) else 0
+        shape = (len(texts), width)
+        input_ids = out_ids[:shape[0], :shape[1]] if out_ids is not None else np.empty(shape, dtype=np.int64)
+        attention_mask = out_mask[:shape[0], :shape[1]] if out_mask is not None else np.empty(shape, dtype=np.int64)
+
+        mask = np.arange(width) < lengths[:, None]
+        input_ids.fill(self.pad_token_id)
+        input_ids[mask] = flat
+        attention_mask[...] = mask
+        return input_ids, attention_mask
+
+    def __call__(self, texts, return_tensors: str = None, padding: bool = False, truncation: bool = False,
+                 max_length: int = None) -> dict:
+        """Mismo contrato que MarianTokenizer.__call__ para los argumentos que usan los servidores"""
+        single = isinstance(texts, str)
+        batch = [texts] if single else texts
+        if padding or return_tensors is not None:
+            input_ids, attention_mask = self.encode_batch(batch, truncation, max_length)
+            return self._as_tensors({"input_ids": input_ids, "attention_mask": attention_mask}, return_tensors)
+
+        flat, lengths = self._encode_flat(batch, truncation, max_length)
+        input_ids = [ids.tolist() for ids in np.split(flat, np.cumsum(lengths)[:-1])] if len(batch) else []
+        if single:
+            return {"input_ids": input_ids[0], "attention_mask": [1] * len(input_ids[0])}
+        return {"input_ids": input_ids, "attention_mask": [[1] * len(ids) for ids in input_ids]}
+
+    def pad(self, encoded_inputs: dict, return_tensors: str = None) -> dict:
+        """Padding por la derecha hasta la secuencia más larga (con máscara de atención)"""
+        sequences = encoded_inputs["input_ids"]
+        lengths = np.array([len(ids) for ids in sequences], dtype=np.int64)
+        width = int(lengths.max()) if len(lengths) else 0
+        mask = np.arange(width) < lengths[:, None]
+        input_ids = np.full((len(sequences), width), self.pad_token_id, dtype=np.int64)
+        input_ids[mask] = np.fromiter((i for ids in sequences for i in ids), dtype=np.int64, count=int(lengths.sum()))
+        return self._as_tensors({"input_ids": input_ids, "attention_mask": mask.astype(np.int64)}, return_tensors)
+
+    @staticmethod
+    def _as_tensors(batch: dict, return_tensors: str) -> dict:
+        if return_tensors == "np":
+            return batch
+        if return_tensors == "pt":
+            import torch
+            return {name: torch.from_numpy(value) for name, value in batch.items()}
+        return {name: value.tolist() for name, value in batch.items()}
+
+    def convert_ids_to_tokens(self, ids, skip_special_tokens: bool = False) -> List[str]:
+        return [self.vocab[i] if 0 <= i < len(self.vocab) else self.unk_token
+                for i in (int(i) for i in ids)
+                if not (skip_special_tokens and i in self.all_special_ids)]
+
+    def convert_tokens_to_string(self, tokens: List[str]) -> str:
+        """Une las piezas con target.spm; los tokens especiales no pasan por sentencepiece"""
+        current_sub_tokens = []
+        out_string = ""
+        for token in tokens:
+            if token in self.all_special_tokens:
+                out_string += self.spm_target.decode_pieces(current_sub_tokens) + token + " "
+                current_sub_tokens = []
+            else:
+                current_sub_tokens.append(token)
+        out_string += self.spm_target.decode_pieces(current_sub_tokens)
+        return out_string.replace(SPIECE_UNDERLINE, " ").strip()
+
+    def decode(self, token_ids, skip_special_tokens: bool = False, **kwargs) -> str:
+        return self.convert_tokens_to_string(self.convert_ids_to_tokens(token_ids, skip_special_tokens))
+
+    def batch_decode(self, sequences, skip_special_tokens: bool = False, **kwargs) -> List[str]:
+        """
+        Decodifica un lote (array 2D, tensor o listas) con una sola llamada a
+        target.spm. Solo las filas con piezas que no se decodifican por id
+        (o con tokens especiales que hay que conservar) van pieza a pieza.
+        """
+        if not skip_special_tokens or self._skip_table is None:
+            return [self.decode(ids, skip_special_tokens) for ids in sequences]
+        if len(sequences) == 0:
+            return []
+        try:
+            array = np.asarray(sequences, dtype=np.int64).reshape(len(sequences), -1)
+        except ValueError:
+            # Listas de distinta longitud: el padding se omite igual que los demás especiales
+            array = self.pad({"input_ids": list(sequences)}, return_tensors="np")["input_ids"]
+
+        in_range = (array >= 0) & (array < len(self.vocab))
+        target = self._skip_table[np.where(in_range, array, 0)]
+        slow = ~(in_range & (target >= 0)).all(axis=1)
+        target_rows = target.tolist()
+
+        results = [None] * len(array)
+        fast = np.flatnonzero(~slow)
+        if len(fast):
+            texts = self.spm_target.decode([target_rows[i] for i in fast], num_threads=self.num_threads)
+            for i, text in zip(fast, texts):
+                results[i] = text.replace(SPIECE_UNDERLINE, " ").strip()
+        for i in np.flatnonzero(slow):
+            results[i] = self.decode(array[i], skip_special_tokens=True)
+        return results
+
+
+def load_tokenizer(model_dir: str, artifact_path: str = None) -> MarianSpmTokenizer:
+    """
+    Tokenizer del directorio del modelo: usa el artefacto precompilado si
+    existe y no es más antiguo que los ficheros fuente; si no, los lee
+    directamente
+    """
+    model_path = Path(model_dir)
+    artifact = Path(artifact_path) if artifact_path else model_path / ARTIFACT_NAME
+    sources = [model_path / name for name in ("source.spm", "target.spm", "vocab.json")]
+    if artifact.exists() and all(artifact.stat().st_mtime >= s.stat().st_mtime for s in sources if s.exists()):
+        try:
+            return MarianSpmTokenizer.from_artifact(str(artifact))
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Artefacto {artifact} no válido ({e}); regenéralo con marian_tokenizer.py")
+    return MarianSpmTokenizer.from_files(model_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompila el tokenizer MarianMT en un único artefacto")
+    parser.add_argument("--model_dir", default=".", help="Directorio con source.spm, target.spm y vocab.json")
+    parser.add_argument("--output", default=None, help=f"Ruta del artefacto (default: <model_dir>/{ARTIFACT_NAME})")
+    args = parser.parse_args()
+
+    output = args.output or str(Path(args.model_dir) / ARTIFACT_NAME)
+    tokenizer = MarianSpmTokenizer.from_files(args.model_dir)
+    tokenizer.save_artifact(output)
+    print(f"✅ Tokenizer precompilado en {output} ({Path(output).stat().st_size / 1024 / 1024:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
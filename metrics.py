@@ -0,0 +1,161 @@
+"""
+Métricas estilo Prometheus sin dependencias externas
+Contadores, gauges e histogramas con etiquetas, y render en formato texto para /metrics
+"""
+from contextlib import contextmanager
+import os
+import threading
+import time
+from typing import Callable, Dict, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value) -> list:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_value(self, key, state) -> list:
+        lines = []
+        for bound, count in zip(self.buckets, state["counts"]):
+            labels = _format_labels(self.label_names, key, 'le="%s"' % bound)
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.label_names, key, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{labels} {state['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {state['sum']}")
+        lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {state['count']}")
+        return lines
+
+
+REGISTRY = []
+# Gauges calculados al vuelo en cada scrape: nombre -> (ayuda, función)
+_CALLBACKS: Dict[str, Tuple[str, Callable]] = {}
+
+
+def register_callback(name: str, documentation: str, fn: Callable):
+    """
+    Gauge cuyo valor se calcula al renderizar. fn() devuelve un número o un
+    dict {(("etiqueta", "valor"), ...): número}
+    """
+    _CALLBACKS[name] = (documentation, fn)
+
+
+def process_rss_bytes() -> int:
+    """Memoria residente del proceso (Linux: /proc/self/statm)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def render() -> str:
+    """Todas las métricas en formato de texto de Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for name, (documentation, fn) in _CALLBACKS.items():
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} gauge")
+        value = fn()
+        if isinstance(value, dict):
+            for labels, v in value.items():
+                label_text = ",".join(f'{k}="{val}"' for k, val in labels)
+                lines.append(f"{name}{{{label_text}}} {v}")
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# Métricas compartidas por ambos servidores
+REQUESTS = Counter("translation_requests_total", "Peticiones HTTP por endpoint y código", ("endpoint", "status"))
+REQUEST_SECONDS = Histogram("translation_request_duration_seconds", "Latencia HTTP por endpoint", ("endpoint",))
+STAGE_SECONDS = Histogram(
+    "translation_stage_seconds",
+    "Tiempo por etapa: queue_wait, tokenize, encoder, decoder, decoder_step, detokenize",
+    ("stage",)
+)
+BATCH_SIZE = Histogram("translation_batch_size", "Frases por lote enviado al modelo", buckets=SIZE_BUCKETS)
+INPUT_TOKENS = Counter("translation_input_tokens_total", "Tokens de entrada procesados")
+OUTPUT_TOKENS = Counter("translation_output_tokens_total", "Tokens generados")
+DECODING_CHOICES = Counter("translation_decoding_choices_total", "Beams elegidos por la política de decodificación",
+                           ("num_beams", "reason"))
+TRANSLATION_MEMORY_LOOKUPS = Counter("translation_memory_lookups_total",
+                                     "Consultas a la memoria de traducción por resultado", ("result",))
+register_callback("process_resident_memory_bytes", "Memoria residente del proceso", process_rss_bytes)
+
+
+@contextmanager
+def timed(stage: str):
+    """Mide la duración del bloque como una etapa de STAGE_SECONDS"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
@@ -0,0 +1,94 @@
+"""
+Carga rápida de MarianMT desde un model.safetensors local
+Los pesos quedan mapeados en memoria (mmap) en lugar de copiarse, y el
+modelo se construye en el dispositivo "meta" para no inicializar pesos que
+se van a sobrescribir. También construye el modelo draft (decoder con menos
+capas) de la decodificación especulativa
+"""
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def has_local_weights(model_dir: str) -> bool:
+    """True si model_dir contiene un model.safetensors real (no un puntero de git-lfs)"""
+    weights = Path(model_dir) / "model.safetensors"
+    return weights.is_file() and weights.stat().st_size > 1024 * 1024
+
+
+def load_marian_mmap(model_dir: str):
+    """
+    Carga MarianMTModel con los pesos mmap'd desde model_dir/model.safetensors.
+
+    Si algún parámetro no viene en el checkpoint (y no se puede recalcular)
+    se recurre a MarianMTModel.from_pretrained normal.
+    """
+    import torch
+    from safetensors.torch import load_file
+    from transformers import GenerationConfig, MarianConfig, MarianMTModel
+    from transformers.models.marian.modeling_marian import MarianSinusoidalPositionalEmbedding
+
+    model_path = Path(model_dir)
+    config = MarianConfig.from_pretrained(str(model_path))
+    with torch.device("meta"):
+        model = MarianMTModel(config)
+
+    # load_file devuelve tensores respaldados por el fichero; assign=True los usa sin copiarlos
+    state_dict = load_file(str(model_path / "model.safetensors"))
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+
+    # Las posiciones sinusoidales no siempre se guardan: se recalculan
+    for module in model.modules():
+        if isinstance(module, MarianSinusoidalPositionalEmbedding) and module.weight.is_meta:
+            module.weight = module._init_weight(torch.nn.Parameter(torch.empty(module.weight.shape)))
+
+    missing = [name for name, tensor in list(model.named_parameters()) + list(model.named_buffers()) if tensor.is_meta]
+    if missing:
+        logger.warning(f"Pesos ausentes en el checkpoint ({missing[:3]}...); carga normal con from_pretrained")
+        return MarianMTModel.from_pretrained(str(model_path))
+
+    if (model_path / "generation_config.json").exists():
+        model.generation_config = GenerationConfig.from_pretrained(str(model_path))
+    model.eval()
+    return model
+
+
+def parse_layers(spec: str) -> list:
+    """"0,5" -> [0, 5]"""
+    return [int(layer) for layer in spec.split(",") if layer.strip()]
+
+
+def build_draft_model(model, keep_layers: list):
+    """
+    Modelo draft para decodificación especulativa: el mismo MarianMTModel con
+    solo las capas del decoder indicadas. Comparte todos los módulos con el
+    modelo principal (encoder, embeddings, capas, lm_head), así que no ocupa
+    memoria extra.
+    """
+    import copy
+    import torch
+    from transformers import MarianMTModel
+
+    config = copy.deepcopy(model.config)
+    config.decoder_layers = len(keep_layers)
+    with torch.device("meta"):
+        draft = MarianMTModel(config)
+
+    main_decoder = model.get_decoder()
+    for name, module in main_decoder.named_children():
+        if name != "layers":
+            setattr(draft.model.decoder, name, module)
+    draft.model.decoder.layers = torch.nn.ModuleList([main_decoder.layers[i] for i in keep_layers])
+    draft.model.shared = model.model.shared
+    draft.model.encoder = model.get_encoder()
+    draft.lm_head = model.lm_head
+    draft.register_buffer("final_logits_bias", model.final_logits_bias, persistent=False)
+    draft.generation_config = copy.deepcopy(model.generation_config)
+    draft.eval()
+
+    missing = [name for name, tensor in list(draft.named_parameters()) + list(draft.named_buffers()) if tensor.is_meta]
+    if missing:
+        raise RuntimeError(f"El draft tiene módulos sin pesos: {missing[:3]}")
+    return draft
@@ -0,0 +1,161 @@
+"""
+Registro de modelos por par de idiomas ("en-es", "en-fr"...)
+Cada par se carga la primera vez que se pide y los menos usados se descargan
+cuando la memoria de los modelos supera el presupuesto
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+import gc
+import logging
+import threading
+import time
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownPairError(Exception):
+    """Par de idiomas no configurado (los servidores responden 400)"""
+
+
+def parse_pairs(spec: str, template: str) -> Dict[str, str]:
+    """
+    "en-fr,de-en=/models/de-en" -> {"en-fr": <template>, "de-en": "/models/de-en"}
+    Los pares sin "=" usan template (p. ej. "Helsinki-NLP/opus-mt-{source}-{target}")
+    """
+    pairs = {}
+    for item in spec.split(","):
+        pair, _, location = item.strip().partition("=")
+        if not pair:
+            continue
+        source, _, target = pair.partition("-")
+        pairs[pair] = location.strip() or template.format(source=source, target=target)
+    return pairs
+
+
+def model_size_bytes(model) -> int:
+    """Bytes de los pesos: parámetros de torch o ficheros de las sesiones ONNX"""
+    if hasattr(model, "parameters"):
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+    return getattr(model, "size_bytes", 0)
+
+
+class PairModel:
+    """Lo necesario para traducir un par: modelo, tokenizer, backend y clave del cache"""
+
+    def __init__(self, pair: str, model, tokenizer, model_id: str, use_onnx: bool, draft_model=None,
+                 size_bytes: int = None):
+        self.pair = pair
+        self.model = model
+        self.tokenizer = tokenizer
+        self.model_id = model_id
+        self.use_onnx = use_onnx
+        self.draft_model = draft_model
+        self.size_bytes = model_size_bytes(model) if size_bytes is None else size_bytes
+        self.last_used = time.monotonic()
+
+
+class ModelRegistry:
+    """
+    Modelos cargados por par, con desalojo LRU bajo un presupuesto de memoria.
+
+    loader(pair, location) devuelve un PairModel. Las peticiones simultáneas
+    de un par que aún no está cargado esperan a una única carga. Los pares
+    fijados (el del arranque) nunca se desalojan. Desalojar solo quita la
+    referencia del registro: las traducciones en curso terminan con su modelo.
+    """
+
+    def __init__(self, loader: Callable[[str, str], PairModel], locations: Dict[str, str],
+                 max_bytes: int = 2 * 1024 ** 3):
+        self.loader = loader
+        self.locations = dict(locations)
+        self.max_bytes = max_bytes
+        self._models: "OrderedDict[str, PairModel]" = OrderedDict()
+        self._pinned = set()
+        self._loading: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def pairs(self) -> list:
+        """Pares configurados"""
+        return sorted(self.locations)
+
+    def register(self, pair: str, entry: PairModel, pinned: bool = True):
+        """Añade un modelo ya cargado (el del arranque)"""
+        with self._lock:
+            self.locations.setdefault(pair, entry.model_id)
+            self._models[pair] = entry
+            if pinned:
+                self._pinned.add(pair)
+
+    def get(self, pair: str) -> PairModel:
+        """Modelo del par; lo carga si hace falta (una sola carga por par)"""
+        with self._lock:
+            entry = self._models.get(pair)
+            if entry is not None:
+                self._models.move_to_end(pair)
+                entry.last_used = time.monotonic()
+                return entry
+            if pair not in self.locations:
+                raise UnknownPairError(f"Par de idiomas no disponible: {pair} (disponibles: {', '.join(self.pairs)})")
+            future = self._loading.get(pair)
+            owner = future is None
+            if owner:
+                future = self._loading[pair] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            start = time.perf_counter()
+            entry = self.loader(pair, self.locations[pair])
+            logger.info(f"✅ Modelo {pair} cargado en {time.perf_counter() - start:.2f}s "
+                        f"({entry.size_bytes / 1024 / 1024:.0f} MB)")
+        except BaseException as e:
+            with self._lock:
+                del self._loading[pair]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._models[pair] = entry
+            self.loads += 1
+            del self._loading[pair]
+            evicted = self._evict(keep=pair)
+        future.set_result(entry)
+        if evicted:
+            gc.collect()
+        return entry
+
+    def _evict(self, keep: str) -> list:
+        """Desaloja los pares menos usados hasta caber en max_bytes (con el lock tomado)"""
+        evicted = []
+        for pair in list(self._models):
+            if self.used_bytes <= self.max_bytes:
+                break
+            if pair == keep or pair in self._pinned:
+                continue
+            del self._models[pair]
+            self.evictions += 1
+            evicted.append(pair)
+            logger.info(f"Modelo {pair} descargado (memoria de modelos por encima de "
+                        f"{self.max_bytes / 1024 / 1024:.0f} MB)")
+        return evicted
+
+    @property
+    def used_bytes(self) -> int:
+        return sum(entry.size_bytes for entry in self._models.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "available": self.pairs,
+                "loaded": list(self._models),
+                "loading": list(self._loading),
+                "used_mb": round(self.used_bytes / 1024 / 1024, 1),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
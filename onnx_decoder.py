@@ -0,0 +1,751 @@
+"""
+Decodificación autorregresiva para los modelos ONNX exportados por convert_to_onnx.py
+Ejecuta el encoder una sola vez y reutiliza el cache KV del decoder en cada paso
+"""
+import itertools
+import logging
+from pathlib import Path
+import threading
+import time
+import numpy as np
+import onnxruntime as ort
+
+logger = logging.getLogger(__name__)
+
+
+def log_softmax(logits: np.ndarray, out: np.ndarray = None, work: np.ndarray = None) -> np.ndarray:
+    """
+    log_softmax numéricamente estable sobre el último eje. Con out (puede ser
+    el propio logits) y work se calcula sin reservar arrays del tamaño de logits
+    """
+    shifted = np.subtract(logits, logits.max(axis=-1, keepdims=True), out=out)
+    exp = np.exp(shifted, out=work)
+    shifted -= np.log(exp.sum(axis=-1, keepdims=True))
+    return shifted
+
+
+MODEL_NAMES = ("encoder_model", "decoder_model", "decoder_with_past_model")
+# Decoder con menos capas que exporta convert_to_onnx.py para la decodificación especulativa
+DRAFT_MODEL_NAMES = ("draft_decoder_model", "draft_decoder_with_past_model")
+# Decoders con la proyección de salida restringida a la entrada vocab_ids (shortlist.py)
+SHORTLIST_MODEL_NAMES = ("shortlist_decoder_model", "shortlist_decoder_with_past_model")
+
+# Bytes de modelos .ort precargados. start.py los lee en el proceso maestro
+# antes del fork: los workers crean sus sesiones usando esos bytes directamente
+# como pesos, así que las páginas de memoria se comparten (copy-on-write)
+_preloaded_bytes = {}
+
+# Espacio de nombres de cada generador en el cache del encoder (id() se reutiliza tras descargar un modelo)
+_generator_ids = itertools.count()
+
+_arena_registered = False
+
+
+def register_arena(max_bytes: int) -> bool:
+    """
+    Registra un arena de CPU compartido por todas las sesiones creadas con
+    use_env_allocators (ver arena_session_options), limitado a max_bytes y
+    que crece solo lo pedido en lugar de al doble, para que la memoria no
+    crezca ni se fragmente con los días. Una vez por proceso
+    """
+    global _arena_registered
+    if _arena_registered:
+        return False
+    memory_info = ort.OrtMemoryInfo("Cpu", ort.OrtAllocatorType.ORT_ARENA_ALLOCATOR, 0, ort.OrtMemType.DEFAULT)
+    # (max_mem, arena_extend_strategy=kSameAsRequested, initial_chunk_size_bytes, max_dead_bytes_per_chunk)
+    ort.create_and_register_allocator(memory_info, ort.OrtArenaCfg(max_bytes, 1, -1, -1))
+    _arena_registered = True
+    return True
+
+
+def arena_session_options(sess_options):
+    """Hace que la sesión use el arena de register_arena en lugar de uno propio"""
+    sess_options.add_session_config_entry("session.use_env_allocators", "1")
+    return sess_options
+
+
+def preload_model_bytes(model_dir: str, use_quantized: bool = True) -> int:
+    """Lee en memoria los modelos en formato ORT; devuelve cuántos encontró"""
+    suffix = "_quantized" if use_quantized else ""
+    found = 0
+    for name in MODEL_NAMES + DRAFT_MODEL_NAMES + SHORTLIST_MODEL_NAMES:
+        ort_path = Path(model_dir) / f"{name}{suffix}.ort"
+        if ort_path.exists():
+            _preloaded_bytes[str(ort_path)] = ort_path.read_bytes()
+            found += 1
+    return found
+
+
+def _create_session(source, sess_options=None):
+    """Sesión desde un fichero (ruta) o desde bytes .ort precargados"""
+    if isinstance(source, bytes):
+        # Usar los pesos directamente desde los bytes compartidos, sin copiarlos
+        options = sess_options or ort.SessionOptions()
+        options.add_session_config_entry("session.use_ort_model_bytes_directly", "1")
+        options.add_session_config_entry("session.use_ort_model_bytes_for_initializers", "1")
+        return ort.InferenceSession(source, options)
+    return ort.InferenceSession(source, sess_options)
+
+
+class DecodeBuffers:
+    """
+    Buffers reutilizables de un thread para la decodificación con IO binding.
+    Cada nombre tiene un array plano que solo crece (al doble) cuando no cabe
+    la forma pedida, así que tras los primeros pasos ningún paso reserva
+    memoria; se conservan entre peticiones hasta retain_bytes
+    """
+
+    def __init__(self):
+        self._flat = {}
+        self._bindings = {}
+
+    def view(self, name: str, shape: tuple, dtype) -> np.ndarray:
+        """Vista contigua con la forma pedida sobre el buffer name"""
+        size = int(np.prod(shape))
+        flat = self._flat.get(name)
+        if flat is None or flat.dtype != dtype or flat.size < size:
+            grown = 2 * flat.size if flat is not None and flat.dtype == dtype else 0
+            flat = self._flat[name] = np.empty(max(size, grown), dtype=dtype)
+        return flat[:size].reshape(shape)
+
+    def binding(self, session):
+        """IO binding reutilizable de la sesión"""
+        binding = self._bindings.get(id(session))
+        if binding is None:
+            binding = self._bindings[id(session)] = session.io_binding()
+        return binding
+
+    @property
+    def nbytes(self) -> int:
+        return sum(flat.nbytes for flat in self._flat.values())
+
+    def trim(self, retain_bytes: int):
+        """Libera los buffers si ocupan más de retain_bytes (p. ej. tras un lote muy grande)"""
+        if self.nbytes > retain_bytes:
+            self._flat.clear()
+
+
+class _Steps:
+    """
+    Pasos del decoder de _greedy y _beam_search con session.run: cada paso
+    devuelve arrays nuevos con los logits y el cache
+    """
+
+    def __init__(self, generator, vocab=None):
+        self.generator = generator
+        self.vocab = vocab
+        self.attention_mask = None
+        self.past = None
+
+    def first(self, batch_size: int, encoder_hidden_states, attention_mask) -> np.ndarray:
+        tokens = np.full((batch_size, 1), self.generator.decoder_start_token_id, dtype=np.int64)
+        self.attention_mask = attention_mask
+        logits, self.past = self.generator._first_step(tokens, encoder_hidden_states, attention_mask,
+                                                       vocab=self.vocab)
+        return logits
+
+    def next(self, tokens: np.ndarray) -> np.ndarray:
+        """tokens: (batch,) con el último token de cada fila"""
+        logits, self.past = self.generator._next_step(tokens[:, None].astype(np.int64), self.attention_mask,
+                                                      self.past, vocab=self.vocab)
+        return logits
+
+    def select(self, rows: np.ndarray, same_source: bool = False):
+        """
+        Deja en el cache solo las filas rows, en ese orden. Con same_source
+        (reordenación de beams) cada fila sigue siendo de la misma frase: la
+        máscara y el cache de cross-attention no cambian
+        """
+        if not same_source:
+            self.attention_mask = self._take("encoder_attention_mask", self.attention_mask, rows)
+        for name, value in self.past.items():
+            if not same_source or ".decoder." in name:
+                self.past[name] = self._take(name, value, rows)
+
+    def _take(self, name: str, value: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        return value[rows]
+
+
+class _BoundSteps(_Steps):
+    """
+    Pasos con IO binding sobre DecodeBuffers: el cache de self-attention
+    alterna entre dos buffers por tensor (la salida de un paso es la entrada
+    del siguiente), los logits y los tokens de entrada usan siempre el mismo
+    buffer y nada se copia entre NumPy y onnxruntime
+    """
+
+    def __init__(self, generator, buffers: DecodeBuffers, vocab=None):
+        super().__init__(generator, vocab)
+        self.buffers = buffers
+        self.session = generator.shortlist_sessions[1] if vocab is not None else generator.decoder_with_past_session
+        self.present_names = [o.name for o in self.session.get_outputs()][1:]
+        self.binding = buffers.binding(self.session)
+        # Buffer (0 o 1) que tiene el valor actual de cada tensor; sin entrada: array del primer paso
+        self.slot = {}
+        self.logits_width = self.logits_dtype = None
+
+    def first(self, batch_size: int, encoder_hidden_states, attention_mask) -> np.ndarray:
+        logits = super().first(batch_size, encoder_hidden_states, attention_mask)
+        self.logits_width, self.logits_dtype = logits.shape[-1], logits.dtype
+        return logits
+
+    def _buffer(self, name: str, shape: tuple, dtype) -> tuple:
+        """Vista sobre el buffer que no tiene el valor actual de name"""
+        slot = 1 - self.slot.get(name, 1)
+        return self.buffers.view(f"{name}/{slot}", shape, dtype), slot
+
+    def next(self, tokens: np.ndarray) -> np.ndarray:
+        batch_size = len(tokens)
+        input_ids = self.buffers.view("input_ids", (batch_size, 1), np.int64)
+        input_ids[:, 0] = tokens
+        logits = self.buffers.view("logits", (batch_size, 1, self.logits_width), self.logits_dtype)
+
+        binding = self.binding
+        binding.clear_binding_inputs()
+        binding.clear_binding_outputs()
+        binding.bind_cpu_input("input_ids", input_ids)
+        binding.bind_cpu_input("encoder_attention_mask", self.attention_mask)
+        for name, value in self.past.items():
+            binding.bind_cpu_input(name, value)
+        if self.vocab is not None:
+            binding.bind_cpu_input("vocab_ids", self.vocab)
+        binding.bind_output("logits", "cpu", 0, logits.dtype.type, logits.shape, logits.ctypes.data)
+
+        presents = []
+        for present_name in self.present_names:
+            name = present_name.replace("present.", "past_key_values.")
+            past = self.past[name]
+            shape = (past.shape[0], past.shape[1], past.shape[2] + 1, past.shape[3])
+            view, slot = self._buffer(name, shape, past.dtype)
+            binding.bind_output(present_name, "cpu", 0, view.dtype.type, view.shape, view.ctypes.data)
+            presents.append((name, view, slot))
+
+        start = time.perf_counter()
+        self.session.run_with_iobinding(binding)
+        self.generator._observe("decoder_step", start)
+        for name, view, slot in presents:
+            self.past[name] = view
+            self.slot[name] = slot
+        return logits
+
+    def _take(self, name: str, value: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        out, slot = self._buffer(name, (len(rows),) + value.shape[1:], value.dtype)
+        np.take(value, rows, axis=0, out=out)
+        self.slot[name] = slot
+        return out
+
+
+class OnnxMarianGenerator:
+    """
+    Generador greedy/beam search sobre tres grafos ONNX:
+
+    - encoder_model.onnx: input_ids, attention_mask -> last_hidden_state
+    - decoder_model.onnx: primer paso, devuelve logits y el cache KV completo
+    - decoder_with_past_model.onnx: pasos siguientes, reutiliza el cache KV
+
+    Con draft_sessions (draft_decoder_model + draft_decoder_with_past_model)
+    la decodificación greedy de una sola frase es especulativa: el draft
+    propone num_draft_tokens tokens y el decoder principal los verifica en
+    una sola pasada.
+
+    Con shortlist (shortlist.Shortlist + shortlist_decoder_model y
+    shortlist_decoder_with_past_model) los logits de cada paso solo cubren
+    los candidatos del lote; el resto del vocabulario no se proyecta.
+
+    Con encoder_cache (encoder_cache.EncoderCache) las frases ya codificadas
+    no vuelven a pasar por el encoder.
+
+    Con io_binding (default) greedy y beam search decodifican sobre buffers
+    reutilizables (DecodeBuffers, uno por thread) en lugar de reservar
+    arrays nuevos en cada paso.
+
+    Con length_buckets (p. ej. (16, 32, 64, 128, 256)) las entradas se
+    rellenan hasta el menor bucket en el que caben: el encoder y el cache de
+    cross-attention solo ven esas longitudes, que warm_up_buckets ejecuta al
+    arrancar. El padding está enmascarado y no cambia la traducción.
+    """
+
+    def __init__(self, encoder_session, decoder_session, decoder_with_past_session,
+                 decoder_start_token_id: int = 65000, eos_token_id: int = 0, pad_token_id: int = 65000,
+                 draft_sessions: tuple = None, num_draft_tokens: int = 4, shortlist=None,
+                 shortlist_sessions: tuple = None, io_binding: bool = True, buffer_retain_bytes: int = 64 * 1024 ** 2,
+                 length_buckets: tuple = None):
+        self.encoder_session = encoder_session
+        self.decoder_session = decoder_session
+        self.decoder_with_past_session = decoder_with_past_session
+        self.decoder_start_token_id = decoder_start_token_id
+        self.eos_token_id = eos_token_id
+        self.pad_token_id = pad_token_id
+
+        # Nombres de las entradas de cache, en el orden en que las espera el grafo con past
+        self.past_names = [i.name for i in decoder_with_past_session.get_inputs()
+                           if i.name.startswith("past_key_values.")]
+        self.num_layers = len(self.past_names) // 4
+
+        # Callback opcional observer(etapa, segundos) para métricas por etapa
+        self.observer = None
+        self.size_bytes = 0
+        self.encoder_cache = None
+        self.cache_namespace = f"onnx-{next(_generator_ids)}"
+
+        self.draft_sessions = draft_sessions
+        self.num_draft_tokens = num_draft_tokens
+        # Tokens propuestos por el draft y aceptados por el decoder principal
+        self.draft_proposed = 0
+        self.draft_accepted = 0
+
+        self.shortlist = shortlist
+        self.shortlist_sessions = shortlist_sessions if shortlist is not None else None
+
+        self.io_binding = io_binding
+        self.buffer_retain_bytes = buffer_retain_bytes
+        self._local = threading.local()
+
+        self.length_buckets = tuple(sorted(length_buckets)) if length_buckets else ()
+
+    def _observe(self, stage: str, start: float):
+        if self.observer is not None:
+            self.observer(stage, time.perf_counter() - start)
+
+    @property
+    def speculative(self) -> bool:
+        return self.draft_sessions is not None
+
+    @classmethod
+    def from_pretrained(cls, model_dir: str, sess_options=None, use_quantized: bool = True,
+                        speculative: bool = False, shortlist=None, **kwargs):
+        """
+        Carga los tres grafos desde model_dir (variantes cuantizadas si se piden);
+        con speculative=True también los del draft y con shortlist los decoders
+        de proyección restringida
+        """
+        model_path = Path(model_dir)
+        suffix = "_quantized" if use_quantized else ""
+
+        def exists(name):
+            return (model_path / f"{name}{suffix}.onnx").exists() or (model_path / f"{name}{suffix}.ort").exists()
+
+        # Bytes de los modelos cargados (presupuesto de memoria de model_registry)
+        size_bytes = 0
+        # Origen de cada sesión (bytes precargados o fichero) para recreate_sessions
+        sources = {}
+
+        def session(name):
+            nonlocal size_bytes
+            source = _preloaded_bytes.get(str(model_path / f"{name}{suffix}.ort"))
+            if source is not None:
+                size_bytes += len(source)
+            else:
+                # El formato .ort ya viene optimizado: arranca más rápido que el .onnx
+                path = model_path / f"{name}{suffix}.ort"
+                if not path.exists():
+                    path = model_path / f"{name}{suffix}.onnx"
+                size_bytes += path.stat().st_size
+                source = str(path)
+            sources[name] = source
+            return _create_session(source, sess_options)
+
+        sessions = [session(name) for name in MODEL_NAMES]
+        if speculative:
+            # La verificación necesita un decoder con cache que acepte varios tokens a la vez
+            multi_token = not isinstance(sessions[2].get_inputs()[0].shape[1], int)
+            if multi_token and all(exists(name) for name in DRAFT_MODEL_NAMES):
+                kwargs["draft_sessions"] = tuple(session(name) for name in DRAFT_MODEL_NAMES)
+            else:
+                logger.warning("Decodificación especulativa desactivada: vuelve a ejecutar convert_to_onnx.py "
+                               "para exportar el draft y el decoder multi-token")
+        if shortlist is not None:
+            if all(exists(name) for name in SHORTLIST_MODEL_NAMES):
+                kwargs["shortlist"] = shortlist
+                kwargs["shortlist_sessions"] = tuple(session(name) for name in SHORTLIST_MODEL_NAMES)
+            else:
+                logger.warning("Shortlist desactivada: ejecuta convert_to_onnx.py --shortlist para exportar "
+                               "los decoders con proyección restringida")
+        generator = cls(*sessions, **kwargs)
+        generator.size_bytes = size_bytes
+        generator.sources = sources
+        return generator
+
+    def recreate_sessions(self, sess_options):
+        """
+        Vuelve a crear las sesiones con otras opciones (p. ej. otros threads)
+        desde los mismos modelos: los bytes precargados o los ficheros de
+        from_pretrained. El tokenizer, la shortlist y el resto del generador
+        se conservan
+        """
+        sessions = {name: _create_session(source, sess_options) for name, source in self.sources.items()}
+        self.encoder_session, self.decoder_session, self.decoder_with_past_session = (
+            sessions[name] for name in MODEL_NAMES
+        )
+        if self.draft_sessions is not None:
+            self.draft_sessions = tuple(sessions[name] for name in DRAFT_MODEL_NAMES)
+        if self.shortlist_sessions is not None:
+            self.shortlist_sessions = tuple(sessions[name] for name in SHORTLIST_MODEL_NAMES)
+        # Los IO bindings de cada thread apuntan a las sesiones anteriores
+        self._local = threading.local()
+
+    def bucket_length(self, length: int) -> int:
+        """Menor bucket >= length (la propia length si no hay buckets o no cabe en ninguno)"""
+        return next((bucket for bucket in self.length_buckets if bucket >= length), length)
+
+    def pad_to_bucket(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> tuple:
+        """Rellena a la derecha (pad_token_id, máscara 0) hasta bucket_length"""
+        padding = self.bucket_length(input_ids.shape[1]) - input_ids.shape[1]
+        if padding == 0:
+            return input_ids, attention_mask
+        return (np.pad(input_ids, ((0, 0), (0, padding)), constant_values=self.pad_token_id),
+                np.pad(attention_mask, ((0, 0), (0, padding))))
+
+    def _run_encoder(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        # El cache del encoder puede pedir solo las frases nuevas con menos columnas: también al bucket
+        width = input_ids.shape[1]
+        input_ids, attention_mask = self.pad_to_bucket(input_ids, attention_mask)
+        return self.encoder_session.run(
+            ["last_hidden_state"],
+            {"input_ids": input_ids, "attention_mask": attention_mask}
+        )[0][:, :width]
+
+    def encode(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """Ejecuta el encoder una vez para todo el lote (solo las frases que no estén en el cache)"""
+        start = time.perf_counter()
+        if self.encoder_cache is not None:
+            hidden_states = self.encoder_cache.encode(input_ids, attention_mask, self._run_encoder,
+                                                      self.cache_namespace)
+        else:
+            hidden_states = self._run_encoder(input_ids, attention_mask)
+        self._observe("encoder", start)
+        return hidden_states
+
+    def _buffers(self) -> DecodeBuffers:
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = self._local.buffers = DecodeBuffers()
+        return buffers
+
+    def _steps(self, vocab=None) -> _Steps:
+        return _BoundSteps(self, self._buffers(), vocab) if self.io_binding else _Steps(self, vocab)
+
+    def shortlist_vocab(self, input_ids: np.ndarray):
+        """Ids candidatos del lote, o None si no hay shortlist"""
+        if self.shortlist_sessions is None:
+            return None
+        return self.shortlist.candidates(input_ids)
+
+    def _first_step(self, input_ids, encoder_hidden_states, encoder_attention_mask, session=None,
+                    stage: str = "decoder_step", vocab=None):
+        """
+        Primer paso del decoder: devuelve logits y el cache {nombre_past: tensor}.
+        Con vocab, los logits son solo los de esos ids (en el mismo orden)
+        """
+        feed = {
+            "input_ids": input_ids,
+            "encoder_hidden_states": encoder_hidden_states,
+            "encoder_attention_mask": encoder_attention_mask,
+        }
+        if vocab is not None:
+            session = session or self.shortlist_sessions[0]
+            feed["vocab_ids"] = vocab
+        session = session or self.decoder_session
+        start = time.perf_counter()
+        outputs = session.run(None, feed)
+        names = [o.name for o in session.get_outputs()]
+        past = {name.replace("present.", "past_key_values."): value
+                for name, value in zip(names[1:], outputs[1:])}
+        self._observe(stage, start)
+        return outputs[0], past
+
+    def _next_step(self, input_ids, encoder_attention_mask, past, session=None, stage: str = "decoder_step",
+                   vocab=None):
+        """Paso incremental: solo se recalcula el cache de self-attention del decoder"""
+        feed = {"input_ids": input_ids, "encoder_attention_mask": encoder_attention_mask}
+        feed.update(past)
+        if vocab is not None:
+            session = session or self.shortlist_sessions[1]
+            feed["vocab_ids"] = vocab
+        session = session or self.decoder_with_past_session
+        start = time.perf_counter()
+        outputs = session.run(None, feed)
+        names = [o.name for o in session.get_outputs()]
+        # El cache de cross-attention (encoder) no cambia entre pasos
+        for name, value in zip(names[1:], outputs[1:]):
+            past[name.replace("present.", "past_key_values.")] = value
+        self._observe(stage, start)
+        return outputs[0], past
+
+    @staticmethod
+    def _truncate_past(past: dict, length: int) -> dict:
+        """Descarta del cache de self-attention las posiciones a partir de length"""
+        return {name: value[:, :, :length] if ".decoder." in name else value for name, value in past.items()}
+
+    def _next_token_logits(self, logits: np.ndarray, cur_len: int, max_length: int, vocab=None) -> np.ndarray:
+        """
+        Aplica las mismas restricciones que generation_config.json (sin <pad>, EOS forzado).
+        Con vocab, las columnas son posiciones dentro de vocab (que ya no incluye <pad>)
+        """
+        # Sin copia: los logits de cada paso solo se usan aquí
+        scores = logits[:, -1, :].astype(np.float32, copy=False)
+        if vocab is None:
+            scores[:, self.pad_token_id] = -np.inf
+            eos_column = self.eos_token_id
+        else:
+            eos_column = int(np.searchsorted(vocab, self.eos_token_id))
+        if cur_len == max_length - 1:
+            forced = np.full_like(scores, -np.inf)
+            forced[:, eos_column] = 0.0
+            scores = forced
+        return scores
+
+    @staticmethod
+    def _token_ids(columns: np.ndarray, vocab=None) -> np.ndarray:
+        """Columnas de los logits -> ids del vocabulario"""
+        return columns if vocab is None else vocab[columns]
+
+    def generate(self, input_ids: np.ndarray, attention_mask: np.ndarray, max_length: int = 512,
+                 num_beams: int = 1, length_penalty: float = 1.0, use_shortlist: bool = True) -> np.ndarray:
+        """
+        Traduce un lote. Devuelve un array (batch, seq) con los ids generados,
+        rellenado con pad_token_id, igual que MarianMTModel.generate.
+        use_shortlist=False fuerza el vocabulario completo (comparaciones de calidad)
+        """
+        input_ids, attention_mask = self.pad_to_bucket(input_ids.astype(np.int64, copy=False),
+                                                       attention_mask.astype(np.int64, copy=False))
+        encoder_hidden_states = self.encode(input_ids, attention_mask)
+        vocab = self.shortlist_vocab(input_ids) if use_shortlist else None
+
+        start = time.perf_counter()
+        if num_beams > 1:
+            sequences = self._beam_search(encoder_hidden_states, attention_mask, max_length, num_beams,
+                                          length_penalty, vocab)
+        elif self.speculative and input_ids.shape[0] == 1:
+            # El draft y la verificación usan el vocabulario completo
+            sequences = [self._speculative(encoder_hidden_states, attention_mask, max_length)]
+        else:
+            sequences = self._greedy(encoder_hidden_states, attention_mask, max_length, vocab)
+        self._observe("decoder", start)
+        if self.io_binding:
+            self._buffers().trim(self.buffer_retain_bytes)
+
+        width = max(len(s) for s in sequences)
+        output = np.full((len(sequences), width), self.pad_token_id, dtype=np.int64)
+        for i, seq in enumerate(sequences):
+            output[i, :len(seq)] = seq
+        return output
+
+    def warm_up_buckets(self, batch_sizes: tuple = (1,), decoder_steps: int = 2) -> int:
+        """
+        Ejecuta el encoder y los primeros pasos del decoder con cada bucket de
+        longitud y cada tamaño de lote (frases x beams): onnxruntime prepara
+        esas formas y el arena reserva su memoria antes de recibir tráfico.
+        No pasa por el cache del encoder. Devuelve cuántas formas ejecutó
+        """
+        shapes = 0
+        for length in self.length_buckets:
+            for batch_size in batch_sizes:
+                input_ids = np.full((batch_size, length), self.eos_token_id, dtype=np.int64)
+                attention_mask = np.ones_like(input_ids)
+                steps = self._steps()
+                steps.first(batch_size, self._run_encoder(input_ids, attention_mask), attention_mask)
+                tokens = np.full(batch_size, self.eos_token_id, dtype=np.int64)
+                for _ in range(decoder_steps):
+                    steps.next(tokens)
+                shapes += 1
+        if self.io_binding:
+            self._buffers().trim(self.buffer_retain_bytes)
+        return shapes
+
+    def stream(self, input_ids: np.ndarray, attention_mask: np.ndarray, max_length: int = 512):
+        """
+        Decodificación greedy de una sola frase que va devolviendo cada token
+        en cuanto sale del decoder (para streaming). Termina al emitir EOS.
+        """
+        input_ids, attention_mask = self.pad_to_bucket(input_ids.astype(np.int64, copy=False),
+                                                       attention_mask.astype(np.int64, copy=False))
+        encoder_hidden_states = self.encode(input_ids, attention_mask)
+        vocab = self.shortlist_vocab(input_ids)
+
+        tokens = np.full((1, 1), self.decoder_start_token_id, dtype=np.int64)
+        logits, past = self._first_step(tokens, encoder_hidden_states, attention_mask, vocab=vocab)
+
+        cur_len = 1
+        while True:
+            column = self._next_token_logits(logits, cur_len, max_length, vocab).argmax(axis=-1)
+            token = int(self._token_ids(column, vocab)[0])
+            cur_len += 1
+            yield token
+            if token == self.eos_token_id or cur_len >= max_length:
+                return
+            tokens[0, 0] = token
+            logits, past = self._next_step(tokens, attention_mask, past, vocab=vocab)
+
+    def _greedy(self, encoder_hidden_states, attention_mask, max_length, vocab=None):
+        batch_size = encoder_hidden_states.shape[0]
+        sequences = [[self.decoder_start_token_id] for _ in range(batch_size)]
+        # Filas que siguen decodificando; las que emiten EOS salen del lote
+        active = np.arange(batch_size)
+
+        steps = self._steps(vocab)
+        logits = steps.first(batch_size, encoder_hidden_states, attention_mask)
+
+        cur_len = 1
+        while True:
+            next_tokens = self._token_ids(self._next_token_logits(logits, cur_len, max_length, vocab).argmax(axis=-1),
+                                          vocab)
+            for row, token in zip(active, next_tokens):
+                sequences[row].append(int(token))
+            cur_len += 1
+
+            keep = next_tokens != self.eos_token_id
+            if not keep.any() or cur_len >= max_length:
+                break
+            if not keep.all():
+                active = active[keep]
+                next_tokens = next_tokens[keep]
+                steps.select(np.flatnonzero(keep))
+
+            logits = steps.next(next_tokens)
+
+        return sequences
+
+    def _speculative(self, encoder_hidden_states, attention_mask, max_length):
+        """
+        Greedy especulativo para una frase. El draft propone hasta
+        num_draft_tokens tokens; el decoder principal procesa el último token
+        confirmado más las propuestas en una sola pasada, acepta el prefijo
+        que coincide con su propio argmax y añade su token en la primera
+        discrepancia. Así cada token sale del argmax del decoder principal,
+        igual que en _greedy.
+        """
+        draft_decoder, draft_with_past = self.draft_sessions
+        start_tokens = np.full((1, 1), self.decoder_start_token_id, dtype=np.int64)
+        logits, past = self._first_step(start_tokens, encoder_hidden_states, attention_mask)
+        _, draft_past = self._first_step(start_tokens, encoder_hidden_states, attention_mask,
+                                         draft_decoder, "draft_step")
+
+        sequence = [self.decoder_start_token_id, int(self._next_token_logits(logits, 1, max_length).argmax(axis=-1)[0])]
+        # Tokens de sequence que ya están en el cache del decoder principal / del draft
+        main_len = draft_len = 1
+
+        while sequence[-1] != self.eos_token_id and len(sequence) < max_length:
+            # 1) El draft se pone al día con la secuencia y propone tokens greedy
+            proposals = []
+            budget = min(self.num_draft_tokens, max_length - len(sequence) - 1)
+            if budget > 0:
+                pending = np.array([sequence[draft_len:]], dtype=np.int64)
+                draft_logits, draft_past = self._next_step(pending, attention_mask, draft_past,
+                                                           draft_with_past, "draft_step")
+                draft_len = len(sequence)
+                while True:
+                    scores = self._next_token_logits(draft_logits, len(sequence) + len(proposals), max_length)
+                    proposals.append(int(scores.argmax(axis=-1)[0]))
+                    if proposals[-1] == self.eos_token_id or len(proposals) == budget:
+                        break
+                    draft_logits, draft_past = self._next_step(np.array([[proposals[-1]]], dtype=np.int64),
+                                                               attention_mask, draft_past, draft_with_past, "draft_step")
+                    draft_len += 1
+
+            # 2) El decoder principal verifica todas las propuestas en una pasada
+            pending = sequence[main_len:]
+            logits, past = self._next_step(np.array([pending + proposals], dtype=np.int64), attention_mask, past)
+            accepted = 0
+            for j in range(len(proposals) + 1):
+                position = len(pending) - 1 + j
+                scores = self._next_token_logits(logits[:, :position + 1], len(sequence), max_length)
+                token = int(scores.argmax(axis=-1)[0])
+                sequence.append(token)
+                if j == len(proposals) or token != proposals[j]:
+                    break
+                accepted += 1
+                if token == self.eos_token_id:
+                    break
+
+            self.draft_proposed += len(proposals)
+            self.draft_accepted += accepted
+            # 3) Descartar del cache las posiciones de las propuestas rechazadas
+            main_len += len(pending) + accepted
+            past = self._truncate_past(past, main_len)
+            draft_len = min(draft_len, main_len)
+            draft_past = self._truncate_past(draft_past, draft_len)
+
+        return sequence
+
+    def _beam_search(self, encoder_hidden_states, attention_mask, max_length, num_beams, length_penalty, vocab=None):
+        batch_size = encoder_hidden_states.shape[0]
+        # Expandir el encoder una sola vez: (batch * num_beams, ...)
+        encoder_hidden_states = np.repeat(encoder_hidden_states, num_beams, axis=0)
+        attention_mask = np.repeat(attention_mask, num_beams, axis=0)
+
+        # Historias de las beams en dos buffers fijos: cada paso se reordenan de uno al otro
+        history = np.full((batch_size * num_beams, max_length), self.pad_token_id, dtype=np.int64)
+        history[:, 0] = self.decoder_start_token_id
+        reordered = np.empty_like(history)
+        beam_scores = np.zeros((batch_size, num_beams), dtype=np.float32)
+        beam_scores[:, 1:] = -1e9  # Al inicio todas las beams son iguales: usar solo la primera
+        hypotheses = [[] for _ in range(batch_size)]
+        done = np.zeros(batch_size, dtype=bool)
+
+        steps = self._steps(vocab)
+        logits = steps.first(batch_size * num_beams, encoder_hidden_states, attention_mask)
+
+        cur_len = 1
+        while True:
+            # log_softmax y la suma de puntuaciones sobre los propios logits; el único array nuevo de
+            # batch x vocab son los índices de argpartition
+            scores = self._next_token_logits(logits, cur_len, max_length, vocab)
+            work = steps.buffers.view("work", scores.shape, scores.dtype) if self.io_binding else None
+            scores = log_softmax(scores, out=scores, work=work)
+            vocab_size = scores.shape[-1]
+            scores += beam_scores.reshape(-1, 1)
+            scores = scores.reshape(batch_size, num_beams * vocab_size)
+
+            # Los 2 * num_beams mejores candidatos por frase (los EOS no ocupan beam)
+            top = np.argpartition(scores, -2 * num_beams, axis=-1)[:, -2 * num_beams:]
+            top_scores = np.take_along_axis(scores, top, axis=-1)
+            order = np.argsort(-top_scores, axis=-1)
+            top = np.take_along_axis(top, order, axis=-1)
+            top_scores = np.take_along_axis(top_scores, order, axis=-1)
+
+            next_tokens = np.full((batch_size, num_beams), self.pad_token_id, dtype=np.int64)
+            next_indices = np.zeros((batch_size, num_beams), dtype=np.int64)
+            cur_len += 1
+
+            for b in range(batch_size):
+                if done[b]:
+                    next_indices[b] = b * num_beams
+                    beam_scores[b] = 0.0
+                    continue
+                slot = 0
+                for rank, (candidate, score) in enumerate(zip(top[b], top_scores[b])):
+                    beam_id = b * num_beams + candidate // vocab_size
+                    token = int(self._token_ids(candidate % vocab_size, vocab))
+                    if token == self.eos_token_id:
+                        if rank < num_beams:
+                            hyp = history[beam_id, :cur_len - 1].tolist() + [token]
+                            hypotheses[b].append((float(score) / (len(hyp) ** length_penalty), hyp))
+                        continue
+                    next_tokens[b, slot] = token
+                    next_indices[b, slot] = beam_id
+                    beam_scores[b, slot] = score
+                    slot += 1
+                    if slot == num_beams:
+                        break
+                # early_stopping=True: basta con num_beams hipótesis terminadas
+                if len(hypotheses[b]) >= num_beams or cur_len >= max_length:
+                    done[b] = True
+
+            if done.all():
+                break
+
+            flat_indices = next_indices.reshape(-1)
+            np.take(history, flat_indices, axis=0, out=reordered)
+            history, reordered = reordered, history
+            history[:, cur_len - 1] = next_tokens.reshape(-1)
+            # Las beams nuevas salen de beams de la misma frase: el cache de cross-attention no se reordena
+            steps.select(flat_indices, same_source=True)
+            logits = steps.next(next_tokens.reshape(-1))
+
+        sequences = []
+        for b in range(batch_size):
+            if not hypotheses[b]:
+                hypotheses[b].append((0.0, history[b * num_beams, :cur_len - 1].tolist()))
+            sequences.append(max(hypotheses[b], key=lambda h: h[0])[1])
+        return sequences
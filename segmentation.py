@@ -0,0 +1,62 @@
+"""
+Segmentación de documentos largos en frases para traducirlas por separado
+Conserva los espacios y saltos de línea originales para reconstruir el texto
+"""
+import re
+from typing import List, Tuple
+
+# Fin de frase: puntuación final (+ comillas/paréntesis de cierre) seguida de
+# espacio y de algo que parece el inicio de otra frase
+_SENTENCE_END = re.compile(r'[.!?…]+["\'”’»)\]]*(?=\s+["\'“‘«(\[¿¡]?[A-Z0-9ÁÉÍÓÚÑ])')
+_LINE_BREAK = re.compile(r"(\s*\n\s*)")
+_ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "etc", "e.g", "i.e", "no", "fig"}
+
+
+def _split_sentences(chunk: str) -> Tuple[List[str], List[str]]:
+    """Divide un fragmento sin saltos de línea en frases y los espacios entre ellas"""
+    segments, separators = [], []
+    start = 0
+    for match in _SENTENCE_END.finditer(chunk):
+        words = chunk[start:match.start()].split()
+        if words and words[-1].lower().rstrip(".") in _ABBREVIATIONS and match.group().startswith("."):
+            continue
+        end = match.end()
+        gap = len(chunk[end:]) - len(chunk[end:].lstrip())
+        segments.append(chunk[start:end])
+        separators.append(chunk[end:end + gap])
+        start = end + gap
+    segments.append(chunk[start:])
+    return segments, separators
+
+
+def split_segments(text: str) -> Tuple[List[str], List[str]]:
+    """
+    Divide un documento en frases/párrafos.
+
+    Devuelve (segmentos, separadores) con len(separadores) == len(segmentos) + 1,
+    de forma que join_segments(segmentos, separadores) == text.
+    """
+    stripped = text.strip()
+    leading = text[:len(text) - len(text.lstrip())]
+    trailing = text[len(leading) + len(stripped):]
+    if not stripped:
+        return [], [text]
+
+    segments, separators = [], [leading]
+    parts = _LINE_BREAK.split(stripped)
+    # parts alterna [texto, salto, texto, salto, ..., texto]
+    for i in range(0, len(parts), 2):
+        chunk_segments, chunk_separators = _split_sentences(parts[i])
+        segments.extend(chunk_segments)
+        separators.extend(chunk_separators)
+        separators.append(parts[i + 1] if i + 1 < len(parts) else trailing)
+    return segments, separators
+
+
+def join_segments(segments: List[str], separators: List[str]) -> str:
+    """Reconstruye el documento intercalando los separadores originales"""
+    pieces = [separators[0]]
+    for segment, separator in zip(segments, separators[1:]):
+        pieces.append(segment)
+        pieces.append(separator)
+    return "".join(pieces)
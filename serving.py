@@ -0,0 +1,279 @@
+"""
+Piezas comunes de los dos servidores: app.py (ONNX) y app_simple.py (PyTorch)
+Cada app crea sus propios objetos (registry, pool de inferencia,
+micro-batcher, caches, trabajos) con su configuración y se los pasa a estas
+funciones; los endpoints y la lógica que no dependen del backend viven aquí
+para no mantener dos copias.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+import metrics
+from decoding_policy import QUALITY_HINTS
+from jobs import JobNotFoundError, JobTooLargeError, parse_upload_line, public_view
+from model_registry import UnknownPairError
+
+logger = logging.getLogger(__name__)
+
+
+def check_quality(quality: Optional[str]):
+    """400 si la pista de calidad no es válida"""
+    if quality is not None and quality not in QUALITY_HINTS:
+        raise HTTPException(status_code=400, detail=f"quality debe ser uno de: {', '.join(QUALITY_HINTS)}")
+
+
+def inference_load(inference_executor, batcher, background: int = 0) -> float:
+    """
+    Ocupación de la inferencia (0 = libre, 1 = colas llenas) para la política
+    de decodificación. background: lotes de trabajos en segundo plano en
+    curso, que cuentan como tareas del pool aunque se ejecuten fuera de él
+    """
+    executor_load = (inference_executor.pending + background) / (inference_executor.max_workers
+                                                                   + inference_executor.max_queue)
+    queued = batcher.queue.qsize() if batcher.queue is not None else 0
+    return min(max(executor_load, queued / max(batcher.max_queue, 1)), 1.0)
+
+
+def interactive_idle(ready: bool, inference_executor, batcher) -> bool:
+    """Sin inferencia interactiva pendiente: los trabajos en segundo plano solo avanzan entonces"""
+    queued = batcher.queue.qsize() if batcher.queue is not None else 0
+    return ready and inference_executor.pending == 0 and queued == 0
+
+
+async def resolve_pair(registry, source_language: str, target_language: str):
+    """
+    Modelo del par pedido. Si aún no está cargado se carga aquí, fuera del
+    pool de inferencia; 400 si el par no está configurado
+    """
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, registry.get, f"{source_language}-{target_language}"
+        )
+    except UnknownPairError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error cargando el modelo {source_language}-{target_language}: {e}")
+        raise HTTPException(status_code=503, detail=f"No se pudo cargar el modelo: {e}",
+                            headers={"Retry-After": "30"})
+
+
+def memory_lookup(translation_memory, text: str, entry):
+    """Coincidencia en la memoria de traducción (solo para el par de su corpus), o None"""
+    if translation_memory is None or translation_memory.pair != entry.pair:
+        return None
+    match = translation_memory.lookup(text)
+    metrics.TRANSLATION_MEMORY_LOOKUPS.inc(result=match.match if match is not None else "miss")
+    return match
+
+
+def job_chunk_translator(registry, translation_memory, translate_many):
+    """
+    Función que traduce un bloque de un trabajo (/jobs): coincidencias
+    exactas de la memoria de traducción y, para el resto, translate_many
+    (cache y lotes por longitud). Las aproximadas van como sugerencia
+    """
+    def translate_job_chunk(texts: list[str], params: dict) -> list[dict]:
+        entry = registry.get(params["pair"])
+        matches = [memory_lookup(translation_memory, text, entry) if text.strip() else None for text in texts]
+        exact = [match is not None and match.exact for match in matches]
+        model_texts = [text for text, is_exact in zip(texts, exact) if text.strip() and not is_exact]
+        translations = iter(translate_many(model_texts, params["max_length"], entry.pair, params["num_beams"])
+                            if model_texts else [])
+        results = []
+        for text, match, is_exact in zip(texts, matches, exact):
+            result = {"translated": match.target if is_exact else next(translations) if text.strip() else "",
+                      "origin": "memory" if is_exact else "model"}
+            if match is not None:
+                result["memory"] = match.as_dict()
+            results.append(result)
+        return results
+    return translate_job_chunk
+
+
+def job_params(registry, decoding_policy, default_pair: str, max_length: int, source_language: str,
+               target_language: str, quality: Optional[str]) -> dict:
+    """
+    Parámetros fijos de un trabajo. Los beams dependen solo de quality (sin
+    carga: el trabajo corre cuando no hay tráfico interactivo)
+    """
+    check_quality(quality)
+    pair = f"{source_language}-{target_language}"
+    if pair != default_pair and pair not in registry.pairs:
+        raise HTTPException(status_code=400, detail=f"Par de idiomas no disponible: {pair}")
+    num_beams = decoding_policy.choose("", max_length, quality=quality).num_beams
+    return {"max_length": max_length, "pair": pair, "num_beams": num_beams}
+
+
+async def in_thread(fn, *args):
+    """Ejecuta fn(*args) en el threadpool por defecto (disco, sin bloquear el event loop)"""
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+def jobs_router(job_store, job_runner, registry, decoding_policy, default_pair: str,
+                default_max_length: int) -> APIRouter:
+    """
+    Endpoints de /jobs (trabajos en segundo plano) sobre job_store y
+    job_runner. Toda la lectura y escritura de job_store va al threadpool
+    """
+    router = APIRouter()
+    default_source, default_target = default_pair.split("-", 1)
+
+    def params_for(max_length, source_language, target_language, quality):
+        return job_params(registry, decoding_policy, default_pair, max_length, source_language, target_language,
+                          quality)
+
+    @router.post("/jobs", status_code=202)
+    async def create_job(texts: list[str], max_length: int = default_max_length,
+                         source_language: str = default_source, target_language: str = default_target,
+                         quality: Optional[str] = None):
+        """
+        Crea un trabajo en segundo plano con una lista de textos y devuelve su id.
+        El progreso está en GET /jobs/{id} y los resultados en GET /jobs/{id}/results
+        """
+        if not texts:
+            raise HTTPException(status_code=400, detail="La lista de textos no puede estar vacía")
+        params = params_for(max_length, source_language, target_language, quality)
+        try:
+            meta = await in_thread(job_store.create, texts, params)
+        except JobTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        job_runner.wake()
+        return public_view(meta)
+
+    @router.post("/jobs/upload", status_code=202)
+    async def upload_job(request: Request, format: str = "txt", text_field: str = "text",
+                         max_length: int = default_max_length, source_language: str = default_source,
+                         target_language: str = default_target, quality: Optional[str] = None):
+        """
+        Crea un trabajo con un fichero enviado como cuerpo de la petición (se
+        escribe a disco a medida que llega, sin cargarlo en memoria):
+
+        - **format**: "txt" (un texto por línea) o "jsonl" (un objeto por línea con el texto en **text_field**)
+        """
+        if format not in ("txt", "jsonl"):
+            raise HTTPException(status_code=400, detail="format debe ser txt o jsonl")
+        params = params_for(max_length, source_language, target_language, quality)
+        writer = await in_thread(job_store.writer, params)
+
+        def add_lines(lines):
+            for line in lines:
+                text = parse_upload_line(line, format, text_field)
+                if text is not None:
+                    writer.add(text)
+
+        try:
+            pending = b""
+            async for block in request.stream():
+                *lines, pending = (pending + block).split(b"\n")
+                if lines:
+                    await in_thread(add_lines, lines)
+            await in_thread(add_lines, [pending])
+        except JobTooLargeError as e:
+            await in_thread(writer.abort)
+            raise HTTPException(status_code=413, detail=str(e))
+        except (ValueError, AttributeError) as e:
+            # JSON inválido, UTF-8 inválido (UnicodeDecodeError es un ValueError) o líneas que no son objetos
+            await in_thread(writer.abort)
+            raise HTTPException(status_code=400, detail=f"Fichero no válido: {e}")
+        except BaseException:
+            # Cancelación o desconexión: se borra sin esperar al threadpool
+            writer.abort()
+            raise
+        if writer.total == 0:
+            await in_thread(writer.abort)
+            raise HTTPException(status_code=400, detail="El fichero no contiene textos")
+        meta = await in_thread(writer.finish)
+        job_runner.wake()
+        return public_view(meta)
+
+    @router.get("/jobs/{job_id}")
+    async def get_job(job_id: str):
+        """Estado y progreso de un trabajo (queued, running, done o failed)"""
+        try:
+            return public_view(await in_thread(job_store.get, job_id))
+        except JobNotFoundError:
+            raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+
+    @router.get("/jobs/{job_id}/results")
+    async def get_job_results(job_id: str, start: int = 0):
+        """
+        Resultados en JSON lines ({"index", "original", "translated", "origin"}),
+        en el orden de entrada. Con el trabajo en curso devuelve los ya
+        traducidos; **start** salta los primeros para descargar solo los nuevos
+        """
+        try:
+            meta = await in_thread(job_store.get, job_id)
+        except JobNotFoundError:
+            raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+        # StreamingResponse lee el fichero en el threadpool, por bloques
+        return StreamingResponse(job_store.results(job_id, start), media_type="application/x-ndjson",
+                                 headers={"X-Job-Status": meta["status"], "X-Job-Done": str(meta["done"])})
+
+    @router.delete("/jobs/{job_id}")
+    async def delete_job(job_id: str):
+        """Cancela (si está en curso) y borra un trabajo y sus resultados"""
+        try:
+            await in_thread(job_store.delete, job_id)
+        except JobNotFoundError:
+            raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+        return {"job_id": job_id, "status": "deleted"}
+
+    return router
+
+
+def register_metrics(server):
+    """
+    Métricas comunes a las dos apps. server es el módulo de la app: sus
+    globales (ready, encoder_cache, thread_decision...) cambian al cargar el
+    modelo, así que se leen en cada render
+    """
+    metrics.register_callback(
+        "translation_models_loaded", "Pares de idiomas con el modelo cargado",
+        lambda: {(("pair", pair),): 1 for pair in server.registry.stats()["loaded"]}
+    )
+    metrics.register_callback("translation_model_memory_bytes", "Memoria de los modelos cargados (pesos)",
+                              lambda: server.registry.used_bytes)
+    metrics.register_callback(
+        "translation_model_registry_events", "Cargas y desalojos de modelos por par",
+        lambda: {(("event", "load"),): server.registry.loads, (("event", "eviction"),): server.registry.evictions}
+    )
+    metrics.register_callback("translation_ready", "1 si el modelo está cargado y calentado",
+                              lambda: int(server.ready))
+    metrics.register_callback("translation_startup_seconds", "Segundos desde el import hasta estar listo",
+                              lambda: server.startup_seconds or 0)
+    metrics.register_callback("translation_num_beams", "Beams sin carga (la política adaptativa puede usar menos)",
+                              lambda: server.NUM_BEAMS)
+    metrics.register_callback("translation_intra_op_threads", "Threads intra-op por proceso",
+                              lambda: server.INTRA_OP_THREADS)
+    metrics.register_callback(
+        "translation_thread_config", "Configuración de threads en uso y su origen (env, benchmark o file)",
+        lambda: {tuple((name, str(value)) for name, value in server.thread_decision["config"].items())
+                 + (("source", server.thread_decision["source"]),): 1} if server.thread_decision else {}
+    )
+    metrics.register_callback(
+        "translation_cache_lookups", "Consultas al cache de traducciones por resultado",
+        lambda: {(("result", "hit"),): server.translation_cache.hits,
+                 (("result", "miss"),): server.translation_cache.misses}
+    )
+    metrics.register_callback("translation_cache_hit_ratio", "Proporción de aciertos del cache",
+                              lambda: server.translation_cache.stats()["hit_rate"])
+    metrics.register_callback(
+        "translation_encoder_cache_lookups", "Frases buscadas en el cache del encoder por resultado",
+        lambda: {(("result", "hit"),): server.encoder_cache.hits, (("result", "miss"),): server.encoder_cache.misses}
+        if server.encoder_cache is not None else {}
+    )
+    metrics.register_callback("translation_cache_entries", "Entradas en el cache LRU",
+                              lambda: server.translation_cache.stats()["entries"])
+    metrics.register_callback("translation_inference_pending", "Tareas de inferencia en ejecución o en cola",
+                              lambda: server.inference_executor.pending)
+    metrics.register_callback("translation_job_texts", "Textos de trabajos en segundo plano traducidos por este proceso",
+                              lambda: server.job_runner.translated)
+    metrics.register_callback("translation_coalesced_requests",
+                              "Peticiones que esperaron una traducción idéntica en vuelo",
+                              lambda: server.inflight.coalesced)
+    metrics.register_callback("translation_batcher_queue", "Peticiones esperando en el micro-batcher",
+                              lambda: server.batcher.queue.qsize() if server.batcher.queue is not None else 0)
@@ -0,0 +1,283 @@
+"""
+Shortlist léxica para la proyección de salida del decoder (como las shortlists de Marian)
+Cada paso del decoder proyecta sobre las 65001 filas del vocabulario aunque una
+frase solo use unos cientos de tokens. Con una tabla de co-ocurrencias
+fuente->destino construida offline, la proyección se restringe por lote a la
+unión de los candidatos y los índices se traducen de vuelta a ids del vocabulario.
+
+Uso:
+    python shortlist.py build --corpus corpus.txt --output shortlist.npz
+    python shortlist.py check --corpus dev.txt --shortlist shortlist.npz
+
+corpus.txt tiene una frase por línea, opcionalmente "fuente<TAB>traducción".
+Las líneas sin traducción se traducen con los modelos ONNX (vocabulario completo).
+"""
+import argparse
+from contextlib import contextmanager
+import logging
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Vocabulario restringido del lote en curso, por thread (backend PyTorch)
+_active = threading.local()
+
+
+class Shortlist:
+    """
+    Candidatos de salida por token fuente, en formato CSR:
+    indices[indptr[s]:indptr[s + 1]] son los tokens destino del token fuente s.
+    frequent son los tokens destino más frecuentes, que siempre se incluyen.
+    """
+
+    def __init__(self, frequent: np.ndarray, indptr: np.ndarray, indices: np.ndarray,
+                 eos_token_id: int = 0, pad_token_id: int = 65000):
+        self.frequent = np.asarray(frequent, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.eos_token_id = eos_token_id
+        self.pad_token_id = pad_token_id
+        self.vocab_size = len(self.indptr) - 1
+        # Lotes consultados y candidatos devueltos (métricas)
+        self.batches = 0
+        self.candidates_total = 0
+
+    @classmethod
+    def load(cls, path: str, **kwargs):
+        with np.load(path) as data:
+            return cls(data["frequent"], data["indptr"], data["indices"], **kwargs)
+
+    def save(self, path: str):
+        np.savez(path, frequent=self.frequent, indptr=self.indptr, indices=self.indices.astype(np.int32))
+
+    def candidates(self, input_ids: np.ndarray) -> np.ndarray:
+        """
+        Ids destino permitidos para un lote (ordenados, sin <pad>, con EOS).
+        Incluye los propios ids fuente: el vocabulario es compartido y así se
+        pueden copiar nombres, números y URLs.
+        """
+        source = np.unique(np.asarray(input_ids))
+        source = source[(source >= 0) & (source < self.vocab_size)]
+        rows = [self.indices[self.indptr[s]:self.indptr[s + 1]] for s in source]
+        vocab = np.unique(np.concatenate([self.frequent, source, [self.eos_token_id]] + rows))
+        vocab = vocab[vocab != self.pad_token_id]
+        self.batches += 1
+        self.candidates_total += len(vocab)
+        return vocab
+
+    @classmethod
+    def build(cls, pairs, vocab_size: int, first: int = 100, best: int = 100, min_prob: float = 0.01,
+              special_ids=(), eos_token_id: int = 0, pad_token_id: int = 65000, chunk_size: int = 10000):
+        """
+        Construye la tabla a partir de pares (ids_fuente, ids_destino).
+
+        Para cada token fuente s se guardan los best tokens destino t con mayor
+        p(t|s) = frases donde aparecen ambos / frases donde aparece s, siempre
+        que p(t|s) >= min_prob. Los first tokens destino más frecuentes entran
+        en todas las shortlists.
+        """
+        special = np.asarray(sorted(special_ids), dtype=np.int64)
+        codes = np.zeros(0, dtype=np.int64)
+        counts = np.zeros(0, dtype=np.float64)
+        source_counts = np.zeros(vocab_size, dtype=np.float64)
+        target_counts = np.zeros(vocab_size, dtype=np.float64)
+
+        def merge(chunk):
+            nonlocal codes, counts
+            merged, inverse = np.unique(np.concatenate([codes] + chunk), return_inverse=True)
+            weights = np.concatenate([counts, np.ones(len(inverse) - len(counts))])
+            codes, counts = merged, np.bincount(inverse, weights=weights)
+
+        chunk = []
+        for source_ids, target_ids in pairs:
+            source = np.setdiff1d(np.asarray(source_ids, dtype=np.int64), special)
+            target = np.setdiff1d(np.asarray(target_ids, dtype=np.int64), special)
+            source_counts[source] += 1
+            target_counts[target] += 1
+            chunk.append((source[:, None] * vocab_size + target[None, :]).ravel())
+            if len(chunk) == chunk_size:
+                merge(chunk)
+                chunk = []
+        if chunk:
+            merge(chunk)
+
+        source, target = codes // vocab_size, codes % vocab_size
+        prob = counts / np.maximum(source_counts[source], 1)
+        keep = prob >= min_prob
+        source, target, prob = source[keep], target[keep], prob[keep]
+
+        # Ordenar por fuente y, dentro de cada fuente, por probabilidad descendente
+        order = np.lexsort((-prob, source))
+        source, target = source[order], target[order]
+        starts = np.searchsorted(source, source)
+        keep = np.arange(len(source)) - starts < best
+        source, target = source[keep], target[keep]
+
+        indptr = np.zeros(vocab_size + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(source, minlength=vocab_size))
+        frequent = np.argsort(-target_counts, kind="stable")[:first]
+        frequent = frequent[target_counts[frequent] > 0]
+        return cls(np.sort(frequent), indptr, target, eos_token_id=eos_token_id, pad_token_id=pad_token_id)
+
+
+@contextmanager
+def restrict(vocab: np.ndarray):
+    """Dentro del bloque, el lm_head parcheado con patch_lm_head solo proyecta sobre vocab (este thread)"""
+    previous = getattr(_active, "vocab", None)
+    _active.vocab = vocab
+    try:
+        yield
+    finally:
+        _active.vocab = previous
+
+
+def patch_lm_head(model):
+    """
+    Backend PyTorch: el lm_head calcula solo las filas del vocabulario activo
+    (restrict) y deja el resto de logits en -inf. generate() sigue viendo ids
+    del vocabulario completo, así que no hay que traducirlos de vuelta.
+    Los modelos que comparten el módulo (el draft especulativo) también lo usan.
+    """
+    import torch
+
+    head = model.lm_head
+    full_forward = head.forward
+
+    def forward(hidden_states):
+        vocab = getattr(_active, "vocab", None)
+        if vocab is None:
+            return full_forward(hidden_states)
+        index = torch.from_numpy(vocab).to(hidden_states.device)
+        logits = hidden_states.new_full((*hidden_states.shape[:-1], head.out_features), float("-inf"))
+        logits[..., index] = torch.nn.functional.linear(hidden_states, head.weight[index])
+        return logits
+
+    head.forward = forward
+    return model
+
+
+def read_corpus(path: str, limit: int = None) -> list:
+    """Líneas "fuente" o "fuente<TAB>traducción" -> [(fuente, traducción o None)]"""
+    pairs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            source, _, target = line.rstrip("\n").partition("\t")
+            if source.strip():
+                pairs.append((source, target or None))
+            if limit and len(pairs) >= limit:
+                break
+    return pairs
+
+
+def _load_generator(args, shortlist: Shortlist = None):
+    from onnx_decoder import OnnxMarianGenerator
+    return OnnxMarianGenerator.from_pretrained(args.onnx_dir, use_quantized=not args.fp32, shortlist=shortlist)
+
+
+def _translate_ids(generator, tokenizer, texts: list, args, use_shortlist: bool) -> list:
+    """Ids generados (sin el token inicial ni el padding) para cada texto"""
+    outputs = []
+    for i in range(0, len(texts), args.batch_size):
+        input_ids, attention_mask = tokenizer.encode_batch(texts[i:i + args.batch_size], max_length=args.max_length)
+        generated = generator.generate(input_ids, attention_mask, max_length=args.max_length,
+                                       num_beams=args.num_beams, use_shortlist=use_shortlist)
+        outputs += [row[1:][row[1:] != tokenizer.pad_token_id] for row in generated]
+    return outputs
+
+
+def build_command(args, tokenizer):
+    corpus = read_corpus(args.corpus, args.limit)
+    untranslated = [source for source, target in corpus if target is None]
+    translated = iter([])
+    if untranslated:
+        print(f"Traduciendo {len(untranslated)} frases sin referencia con los modelos ONNX...")
+        translated = iter(_translate_ids(_load_generator(args), tokenizer, untranslated, args, use_shortlist=False))
+
+    def target_ids(target):
+        if target is None:
+            return next(translated)
+        pieces = tokenizer.spm_target.encode(target, out_type=str)
+        return [tokenizer.encoder.get(piece, tokenizer.unk_token_id) for piece in pieces]
+
+    pairs = ((tokenizer.encode(source, truncation=True, max_length=args.max_length), target_ids(target))
+             for source, target in corpus)
+    shortlist = Shortlist.build(pairs, len(tokenizer.vocab), first=args.first, best=args.best,
+                                min_prob=args.min_prob, special_ids=tokenizer.all_special_ids,
+                                eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id)
+    shortlist.save(args.output)
+    per_source = np.diff(shortlist.indptr)
+    print(f"✅ Shortlist en {args.output}: {len(corpus)} frases, {len(shortlist.frequent)} tokens frecuentes, "
+          f"{(per_source > 0).sum()} tokens fuente con candidatos (media {per_source[per_source > 0].mean():.1f})")
+
+
+def check_command(args, tokenizer):
+    """
+    Calidad frente al vocabulario completo. En greedy, la salida es idéntica
+    siempre que cada token de la traducción completa esté en la shortlist;
+    con beam search puede variar aunque estén todos.
+    """
+    shortlist = Shortlist.load(args.shortlist, eos_token_id=tokenizer.eos_token_id,
+                               pad_token_id=tokenizer.pad_token_id)
+    generator = _load_generator(args, shortlist)
+    if generator.shortlist_sessions is None:
+        raise SystemExit("No hay grafos de shortlist: ejecuta convert_to_onnx.py --shortlist")
+    texts = [source for source, _ in read_corpus(args.corpus, args.limit)]
+
+    timings = {}
+    outputs = {}
+    for use_shortlist in (False, True):
+        start = time.perf_counter()
+        outputs[use_shortlist] = _translate_ids(generator, tokenizer, texts, args, use_shortlist)
+        timings[use_shortlist] = time.perf_counter() - start
+
+    identical = covered = candidates = 0
+    for i, (full, short) in enumerate(zip(outputs[False], outputs[True])):
+        vocab = shortlist.candidates(np.array(tokenizer.encode(texts[i], truncation=True, max_length=args.max_length)))
+        candidates += len(vocab)
+        covered += bool(np.isin(full, vocab).all())
+        identical += np.array_equal(full, short)
+
+    total = max(len(texts), 1)
+    print(f"Frases: {len(texts)} | candidatos por frase: {candidates / total:.0f} de {len(tokenizer.vocab)}")
+    print(f"Traducción completa cubierta por la shortlist: {covered / total:.1%}")
+    print(f"Salida idéntica al vocabulario completo: {identical / total:.1%}")
+    print(f"Tiempo: completo {timings[False]:.2f}s | shortlist {timings[True]:.2f}s "
+          f"({timings[False] / max(timings[True], 1e-9):.2f}x)")
+    if identical / total < args.min_identical:
+        print(f"❌ Menos de un {args.min_identical:.0%} de salidas idénticas")
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shortlist léxica para la proyección de salida del decoder")
+    parser.add_argument("command", choices=["build", "check"])
+    parser.add_argument("--corpus", required=True, help="Una frase por línea, opcionalmente fuente<TAB>traducción")
+    parser.add_argument("--model_dir", default=".", help="Directorio del tokenizer")
+    parser.add_argument("--onnx_dir", default="./onnx_models", help="Modelos ONNX")
+    parser.add_argument("--fp32", action="store_true", help="Usar los modelos ONNX sin cuantizar")
+    parser.add_argument("--output", default="shortlist.npz", help="build: fichero de salida")
+    parser.add_argument("--shortlist", default="shortlist.npz", help="check: shortlist a evaluar")
+    parser.add_argument("--first", type=int, default=100, help="Tokens destino más frecuentes que siempre se incluyen")
+    parser.add_argument("--best", type=int, default=100, help="Candidatos por token fuente")
+    parser.add_argument("--min_prob", type=float, default=0.01, help="p(destino|fuente) mínima")
+    parser.add_argument("--num_beams", type=int, default=1)
+    parser.add_argument("--max_length", type=int, default=256)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--limit", type=int, default=None, help="Máximo de líneas del corpus")
+    parser.add_argument("--min_identical", type=float, default=0.95,
+                        help="check: sale con código 1 por debajo de esta proporción de salidas idénticas")
+    args = parser.parse_args()
+
+    from marian_tokenizer import load_tokenizer
+    tokenizer = load_tokenizer(args.model_dir)
+    if args.command == "build":
+        build_command(args, tokenizer)
+    else:
+        check_command(args, tokenizer)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,9 +1,102 @@
 #!/usr/bin/env python
+"""
+Script de inicio del servidor
+
+- WORKERS=1 (default): un solo proceso uvicorn, como antes.
+- WORKERS>1: modo pre-fork. El proceso maestro carga el modelo una sola vez
+  (preload_models de la app) y hace fork de los workers, que comparten los
+  pesos copy-on-write y aceptan conexiones del mismo socket.
+
+THREADS_PER_WORKER fija los threads intra-op de cada worker; por defecto se
+reparten los núcleos disponibles entre los workers.
+"""
+import gc
 import os
+import signal
+import socket
 import sys
+import time
 
 # Obtener el puerto de la variable de entorno
 port = os.environ.get("PORT", "8000")
+app_module = os.environ.get("APP_MODULE", "app")
+workers = max(1, int(os.environ.get("WORKERS", "1")))
+
+def available_cpus() -> int:
+    """Núcleos que este proceso puede usar (respeta taskset/cpuset)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Repartir los núcleos: workers * threads_por_worker ≈ núcleos disponibles.
+# Se exporta antes de importar torch/onnxruntime para que lo respeten.
+threads = int(os.environ.get("THREADS_PER_WORKER") or max(1, available_cpus() // workers))
+os.environ["INTRA_OP_THREADS"] = str(threads)
+os.environ["OMP_NUM_THREADS"] = str(threads)
+
+def prefork():
+    """Carga el modelo en el maestro y lanza los workers con fork"""
+    import importlib
+    import uvicorn
+
+    module = importlib.import_module(app_module)
+    print(f"Precargando modelo en el maestro (pid {os.getpid()})...")
+    module.preload_models()
+
+    # Congelar los objetos existentes para que el GC de los workers no toque
+    # sus páginas (lo que rompería el copy-on-write)
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", int(port)))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            config = uvicorn.Config(module.app, lifespan="on")
+            uvicorn.Server(config).run(sockets=[sock])
+            os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"Lanzando {workers} workers x {threads} threads en el puerto {port}")
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} terminó (estado {status}); relanzando...", file=sys.stderr)
+            time.sleep(1)
+            spawn()
 
-# Ejecutar uvicorn con el puerto correcto
-os.execvp("uvicorn", ["uvicorn", "app:app", "--host", "0.0.0.0", "--port", port, "--workers", "1"])
+if workers == 1:
+    # Ejecutar uvicorn con el puerto correcto
+    os.execvp("uvicorn", ["uvicorn", f"{app_module}:app", "--host", "0.0.0.0", "--port", port, "--workers", "1"])
+else:
+    prefork()
@@ -0,0 +1,252 @@
+"""
+Pruebas de batching con una función de traducción de prueba (sin modelo)
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import random
+import threading
+import time
+
+import pytest
+
+from batching import InferenceExecutor, MicroBatcher, QueueFullError, SingleFlight, bucket_by_length, run_bucketed
+
+
+class FakeTranslator:
+    """translate_batch_fn de prueba: guarda los lotes y cuántos se ejecutan a la vez"""
+
+    def __init__(self, delay: float = 0.02):
+        self.delay = delay
+        self.batches = []
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, texts, *params):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+            self.batches.append((list(texts), params))
+        return [f"{text}:{params}" for text in texts]
+
+
+def test_batcher_follows_executor_resize():
+    async def main():
+        translator = FakeTranslator()
+        executor = InferenceExecutor(max_workers=1)
+        batcher = MicroBatcher(translator, max_batch_size=1, max_wait_ms=1, executor=executor)
+        await batcher.start()
+        try:
+            await asyncio.gather(*(batcher.submit(str(i)) for i in range(4)))
+            assert translator.peak == 1
+            # El auto-ajuste cambia las sesiones con el batcher ya arrancado
+            executor.resize(4)
+            await asyncio.gather(*(batcher.submit(str(i)) for i in range(8)))
+            assert translator.peak == 4
+            # Las medidas del auto-ajuste llegan desde threads fuera del event loop
+            loop = asyncio.get_running_loop()
+            assert await loop.run_in_executor(None, batcher.submit_from_thread, "x", 128) == "x:(128,)"
+        finally:
+            await batcher.stop()
+            executor.shutdown()
+
+    asyncio.run(main())
+
+
+def test_batcher_groups_by_params():
+    async def main():
+        translator = FakeTranslator()
+        batcher = MicroBatcher(translator, max_batch_size=8, max_wait_ms=20)
+        await batcher.start()
+        try:
+            results = await asyncio.gather(
+                batcher.submit("a", 128, "en-es"), batcher.submit("b", 128, "en-es"),
+                batcher.submit("c", 64, "en-es"), batcher.submit("d", 128, "en-fr"),
+            )
+        finally:
+            await batcher.stop()
+        assert results == ["a:(128, 'en-es')", "b:(128, 'en-es')", "c:(64, 'en-es')", "d:(128, 'en-fr')"]
+        # Una ventana, un lote por parámetros distintos
+        assert sorted(translator.batches) == [(["a", "b"], (128, "en-es")), (["c"], (64, "en-es")),
+                                              (["d"], (128, "en-fr"))]
+
+    asyncio.run(main())
+
+
+def test_batcher_queue_full_and_errors():
+    async def main():
+        translator = FakeTranslator(delay=0.2)
+        batcher = MicroBatcher(translator, max_batch_size=1, max_wait_ms=1, max_queue=2)
+        await batcher.start()
+        try:
+            running = asyncio.create_task(batcher.submit("running"))
+            await asyncio.sleep(0.05)
+            queued = [asyncio.create_task(batcher.submit(text)) for text in ("q1", "q2")]
+            await asyncio.sleep(0.01)
+            with pytest.raises(QueueFullError):
+                await batcher.submit("rejected")
+            assert await asyncio.gather(running, *queued) == ["running:()", "q1:()", "q2:()"]
+        finally:
+            await batcher.stop()
+
+        def broken(texts, *params):
+            raise ValueError("modelo roto")
+
+        batcher = MicroBatcher(broken, max_wait_ms=10)
+        await batcher.start()
+        try:
+            results = await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+            assert [type(result) for result in results] == [ValueError, ValueError]
+        finally:
+            await batcher.stop()
+
+    asyncio.run(main())
+
+
+def test_batcher_skips_expired_requests():
+    async def main():
+        translator = FakeTranslator(delay=0.1)
+        batcher = MicroBatcher(translator, max_batch_size=1, max_wait_ms=1)
+        await batcher.start()
+        try:
+            first = asyncio.create_task(batcher.submit("first"))
+            await asyncio.sleep(0.02)
+            # Expira mientras espera en cola: no llega a traducirse
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(batcher.submit("expired"), 0.02)
+            assert await first == "first:()"
+            assert await batcher.submit("next") == "next:()"
+        finally:
+            await batcher.stop()
+        assert [texts for texts, _ in translator.batches] == [["first"], ["next"]]
+
+    asyncio.run(main())
+
+
+def test_executor_backpressure_and_timeout():
+    async def main():
+        executor = InferenceExecutor(max_workers=1, max_queue=1)
+        started = []
+
+        def work(name, seconds):
+            started.append(name)
+            time.sleep(seconds)
+            return name
+
+        try:
+            assert await executor.run(work, "quick", 0) == "quick"
+            running = asyncio.create_task(executor.run(work, "slow", 0.2))
+            await asyncio.sleep(0.02)
+            # Una en ejecución y otra en cola: la siguiente no cabe
+            queued = asyncio.create_task(executor.run(work, "queued", 0, timeout=0.05))
+            await asyncio.sleep(0)
+            assert executor.pending == 2
+            with pytest.raises(QueueFullError):
+                await executor.run(work, "rejected", 0)
+
+            # La tarea en cola agota su timeout antes de empezar: se cancela sin ejecutarse
+            with pytest.raises(asyncio.TimeoutError):
+                await queued
+            assert await running == "slow"
+            await asyncio.sleep(0.01)
+            assert started == ["quick", "slow"] and executor.pending == 0
+        finally:
+            executor.shutdown()
+
+    asyncio.run(main())
+
+
+def test_single_flight_coalesces_and_survives_cancelled_waiters():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+
+        async def translate(text):
+            calls.append(text)
+            await asyncio.sleep(0.05)
+            return text.upper()
+
+        results = await asyncio.gather(*(flight.do(("hola", 128), translate, "hola") for _ in range(5)),
+                                       flight.do(("adiós", 128), translate, "adiós"))
+        assert results == ["HOLA"] * 5 + ["ADIÓS"]
+        assert calls == ["hola", "adiós"] and flight.coalesced == 4 and flight.inflight == 0
+
+        # Un cliente que se va no cancela la traducción que espera otro
+        first = asyncio.create_task(flight.do("k", translate, "k"))
+        second = asyncio.create_task(flight.do("k", translate, "k"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "K"
+        assert first.cancelled() and calls.count("k") == 1
+
+        # Igual con un timeout: el que espera menos falla, el otro recibe el resultado
+        second = asyncio.create_task(flight.do("t", translate, "t"))
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(flight.do("t", translate, "t"), 0.01)
+        assert await second == "T" and calls.count("t") == 1
+
+        # Terminada la traducción, la clave vuelve a ejecutarse
+        assert await flight.do("k", translate, "k") == "K" and calls.count("k") == 2
+
+    asyncio.run(main())
+
+
+def test_single_flight_cancels_when_nobody_waits_and_shares_errors():
+    async def main():
+        flight = SingleFlight()
+        finished = []
+
+        async def slow():
+            await asyncio.sleep(0.2)
+            finished.append(True)
+
+        waiters = [asyncio.create_task(flight.do("k", slow)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.sleep(0.3)
+        assert finished == [] and flight.inflight == 0
+
+        async def broken():
+            await asyncio.sleep(0.01)
+            raise ValueError("modelo roto")
+
+        results = await asyncio.gather(flight.do("e", broken), flight.do("e", broken), return_exceptions=True)
+        assert [type(result) for result in results] == [ValueError, ValueError]
+
+    asyncio.run(main())
+
+
+def test_buckets_respect_limits_and_cover_every_index():
+    lengths = [random.Random(0).randint(1, 120) for _ in range(300)]
+    lengths[7] = 900  # Más largo que el presupuesto: va solo en su bucket
+    buckets = bucket_by_length(lengths, max_tokens_per_batch=512, max_batch_size=16)
+    assert sorted(i for bucket in buckets for i in bucket) == list(range(len(lengths)))
+    assert [7] in buckets
+    for bucket in buckets:
+        assert len(bucket) <= 16
+        assert len(bucket) == 1 or len(bucket) * max(lengths[i] for i in bucket) <= 512
+    assert bucket_by_length([]) == []
+
+
+def test_run_bucketed_keeps_input_order():
+    rng = random.Random(1)
+    texts = ["x" * rng.randint(1, 60) + f"#{i}" for i in range(200)]
+    lengths = [len(text) for text in texts]
+    seen = []
+
+    def translate_bucket(indices):
+        seen.append(list(indices))
+        time.sleep(rng.random() / 1000)
+        return [texts[i].upper() for i in indices]
+
+    expected = [text.upper() for text in texts]
+    assert run_bucketed(lengths, translate_bucket, max_tokens_per_batch=256, max_batch_size=8) == expected
+    assert len(seen) > 1
+    # En paralelo los buckets terminan en cualquier orden; el resultado no cambia
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        assert run_bucketed(lengths, translate_bucket, max_tokens_per_batch=256, max_batch_size=8,
+                            executor=pool) == expected
@@ -0,0 +1,61 @@
+"""
+Pruebas de decoding_policy: umbrales de carga, pistas de calidad,
+presupuesto de latencia, max_length por escalones y length_penalty
+"""
+from decoding_policy import DecodingPolicy, estimate_tokens
+
+SHORT = "Hello"  # 5 bytes -> 3 tokens estimados
+LONG = "word " * 90  # 450 bytes -> 152 tokens estimados
+
+
+def test_load_thresholds():
+    policy = DecodingPolicy(default_beams=4)
+    assert policy.choose(SHORT, 512, load=0.0).num_beams == 4
+    assert policy.choose(SHORT, 512, load=0.39).num_beams == 4
+    choice = policy.choose(SHORT, 512, load=0.4)
+    assert (choice.num_beams, choice.reason) == (2, "load")
+    choice = policy.choose(SHORT, 512, load=0.75)
+    assert (choice.num_beams, choice.reason) == (1, "load")
+    # Con 2 beams por defecto, la carga media no los reduce
+    assert DecodingPolicy(default_beams=2).choose(SHORT, 512, load=0.5).num_beams == 2
+
+
+def test_quality_hints():
+    policy = DecodingPolicy(default_beams=2, max_beams=4)
+    assert policy.choose(SHORT, 512, quality="fast").as_dict()["reason"] == "quality_hint"
+    assert policy.choose(SHORT, 512, quality="fast").num_beams == 1
+    assert policy.choose(SHORT, 512, quality="best").num_beams == 4
+    assert policy.choose(SHORT, 512, quality="balanced").num_beams == 2
+    # La carga manda sobre la pista
+    assert policy.choose(SHORT, 512, load=0.9, quality="best").num_beams == 1
+
+
+def test_latency_budget():
+    policy = DecodingPolicy(default_beams=4)
+    # Sin medidas no se puede estimar: no se reduce
+    assert policy.choose(LONG, 512, latency_budget_ms=1).num_beams == 4
+    policy.record_step(4, 0.010)
+    policy.record_step(2, 0.001)
+    choice = policy.choose(LONG, 512, latency_budget_ms=200)
+    assert (choice.num_beams, choice.reason) == (2, "latency_budget")
+    assert policy.choose(LONG, 512, latency_budget_ms=5000).num_beams == 4
+    # Sin medida para 1 beam tras bajar a 2 y no caber: greedy
+    assert policy.choose(LONG, 512, latency_budget_ms=10).num_beams == 1
+
+
+def test_max_length_and_length_penalty():
+    policy = DecodingPolicy(default_beams=4)
+    assert estimate_tokens(SHORT) == 3
+    assert policy.choose(SHORT, 512).max_length == 16
+    assert policy.choose(SHORT, 8).max_length == 8
+    assert policy.choose(LONG, 512).max_length == 512
+    assert policy.choose(LONG, 128).max_length == 128
+
+    assert policy.choose(SHORT, 512).length_penalty == 1.0
+    assert policy.choose(LONG, 512).length_penalty == 1.5
+    assert policy.choose(LONG, 512, quality="fast").length_penalty == 1.0
+
+
+def test_disabled_policy():
+    choice = DecodingPolicy(default_beams=4, enabled=False).choose(LONG, 300, load=1.0, quality="fast")
+    assert choice.as_dict() == {"num_beams": 4, "length_penalty": 1.0, "max_length": 300, "reason": "fixed"}
@@ -0,0 +1,89 @@
+"""
+Pruebas de encoder_cache con un encoder de prueba en NumPy (sin modelo):
+claves por modelo y por ids truncados, lotes mixtos y desalojo por memoria
+"""
+import numpy as np
+
+from encoder_cache import EncoderCache
+
+HIDDEN = 4
+
+
+class FakeEncoder:
+    """Estados ocultos deterministas por token; guarda las filas que codifica"""
+
+    def __init__(self, offset: float = 0.0):
+        self.offset = offset
+        self.calls = []
+
+    def __call__(self, input_ids, attention_mask):
+        self.calls.append(input_ids.tolist())
+        states = input_ids[..., None].astype(np.float32) + np.arange(HIDDEN, dtype=np.float32) + self.offset
+        return states * attention_mask[..., None].astype(np.float32)
+
+
+def batch(*sentences, pad_id: int = 0):
+    """input_ids/attention_mask con padding a la derecha, como el tokenizer"""
+    width = max(len(ids) for ids in sentences)
+    input_ids = np.full((len(sentences), width), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((len(sentences), width), dtype=np.int64)
+    for i, ids in enumerate(sentences):
+        input_ids[i, :len(ids)] = ids
+        attention_mask[i, :len(ids)] = 1
+    return input_ids, attention_mask
+
+
+def test_key_includes_model_and_truncated_ids():
+    cache = EncoderCache()
+    ids = np.array([5, 6, 7, 8])
+    assert cache.make_key(ids, "en-es") == cache.make_key(ids.tolist(), "en-es")
+    assert cache.make_key(ids, "en-es") != cache.make_key(ids, "en-fr")
+    # Con otro max_length el tokenizer trunca los ids: la frase es otra clave
+    assert cache.make_key(ids[:3], "en-es") != cache.make_key(ids, "en-es")
+
+    encoder_es, encoder_fr = FakeEncoder(0.0), FakeEncoder(100.0)
+    input_ids, attention_mask = batch([5, 6, 7, 8])
+    es = cache.encode(input_ids, attention_mask, encoder_es, "en-es")
+    fr = cache.encode(input_ids, attention_mask, encoder_fr, "en-fr")
+    assert not np.array_equal(es, fr) and len(encoder_fr.calls) == 1
+
+    truncated_ids, truncated_mask = batch([5, 6, 7])
+    cache.encode(truncated_ids, truncated_mask, encoder_es, "en-es")
+    assert len(encoder_es.calls) == 2
+    np.testing.assert_array_equal(cache.encode(input_ids, attention_mask, encoder_es, "en-es"), es)
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (3, 1, 3)
+
+
+def test_mixed_batch_encodes_only_new_sentences():
+    cache = EncoderCache()
+    encoder = FakeEncoder()
+    cache.encode(*batch([1, 2, 3, 4, 5]), encoder, "m")
+
+    input_ids, attention_mask = batch([9, 9], [1, 2, 3, 4, 5], [7])
+    hidden_states = cache.encode(input_ids, attention_mask, encoder, "m")
+    # Solo las frases nuevas, recortadas a su longitud máxima
+    assert encoder.calls[-1] == [[9, 9], [7, 0]]
+    # Igual que sin cache: la salida no depende del lote
+    np.testing.assert_array_equal(hidden_states, FakeEncoder()(input_ids, attention_mask))
+    assert cache.stats()["hits"] == 1
+
+
+def test_eviction_by_bytes():
+    row_bytes = 3 * HIDDEN * 4
+    cache = EncoderCache(max_bytes=2 * row_bytes)
+    encoder = FakeEncoder()
+    for ids in ([1, 2, 3], [4, 5, 6], [1, 2, 3], [7, 8, 9]):
+        cache.encode(*batch(ids), encoder, "m")
+    # [1, 2, 3] se usó después de [4, 5, 6]: sale [4, 5, 6]
+    assert cache.stats()["entries"] == 2 and cache.stats()["bytes"] == 2 * row_bytes
+    calls = len(encoder.calls)
+    cache.encode(*batch([1, 2, 3]), encoder, "m")
+    assert len(encoder.calls) == calls
+    cache.encode(*batch([4, 5, 6]), encoder, "m")
+    assert len(encoder.calls) == calls + 1
+
+    # Una frase más grande que todo el cache no se guarda ni desaloja nada
+    small = EncoderCache(max_bytes=row_bytes - 1)
+    small.encode(*batch([1, 2, 3]), encoder, "m")
+    assert small.stats()["entries"] == 0
@@ -0,0 +1,125 @@
+"""
+Pruebas de jobs: reanudación tras un corte, descarga de resultados desde un
+índice, borrado durante la traducción y prioridad interactiva entre lotes.
+translate_fn es una función de prueba (sin modelo)
+"""
+import asyncio
+import json
+import tempfile
+
+import pytest
+
+from jobs import JobNotFoundError, JobRunner, JobStore, JobTooLargeError, parse_upload_line, public_view
+
+
+def upper(texts, params):
+    return [{"translated": text.upper()} for text in texts]
+
+
+def run_jobs(store: JobStore, translate_fn=upper, idle_fn=lambda: True, seconds: float = 0.3, **kwargs) -> JobRunner:
+    async def main():
+        runner = JobRunner(store, translate_fn, idle_fn, poll_interval=0.01, **kwargs)
+        await runner.start()
+        await asyncio.sleep(seconds)
+        await runner.stop()
+        return runner
+    return asyncio.run(main())
+
+
+def read_results(store: JobStore, job_id: str, start: int = 0) -> list:
+    return [json.loads(line) for line in b"".join(store.results(job_id, start)).splitlines()]
+
+
+def test_resume_after_partial_write():
+    with tempfile.TemporaryDirectory() as directory:
+        store = JobStore(directory)
+        meta = store.create([f"t{i}" for i in range(10)], {})
+        path = store.root / meta["job_id"]
+        # Corte tras 4 textos guardados y una línea a medio escribir
+        lines = (path / "input.jsonl").read_bytes().splitlines(keepends=True)
+        done = b"".join(json.dumps({"translated": f"X{i}", "index": i, "original": f"t{i}"}).encode() + b"\n"
+                        for i in range(4))
+        (path / "output.jsonl").write_bytes(done + b'{"partial')
+        meta.update(status="running", done=4, input_offset=sum(map(len, lines[:4])), output_bytes=len(done))
+        store.save(meta)
+
+        runner = run_jobs(store, chunk_size=3)
+        assert runner.translated == 6
+        meta = store.get(meta["job_id"])
+        assert (meta["status"], meta["done"]) == ("done", 10)
+        results = read_results(store, meta["job_id"])
+        assert [result["index"] for result in results] == list(range(10))
+        assert [result["translated"] for result in results] == [f"X{i}" for i in range(4)] + \
+            [f"T{i}" for i in range(4, 10)]
+
+
+def test_results_from_offset():
+    with tempfile.TemporaryDirectory() as directory:
+        store = JobStore(directory)
+        job_id = store.create(["a", "b\nc", "d"], {"pair": "en-es"})["job_id"]
+        run_jobs(store, chunk_size=2)
+        assert [result["original"] for result in read_results(store, job_id)] == ["a", "b\nc", "d"]
+        assert [result["index"] for result in read_results(store, job_id, start=1)] == [1, 2]
+        assert read_results(store, job_id, start=3) == []
+        assert read_results(store, job_id, start=10) == []
+
+        # Solo se sirve hasta el último bloque guardado (output_bytes)
+        with open(store.root / job_id / "output.jsonl", "ab") as output:
+            output.write(b'{"partial')
+        assert len(read_results(store, job_id)) == 3
+
+
+def test_delete_while_translating():
+    with tempfile.TemporaryDirectory() as directory:
+        store = JobStore(directory)
+        job_id = store.create([str(i) for i in range(20)], {})["job_id"]
+
+        def translate_and_delete(texts, params):
+            store.delete(job_id)
+            return upper(texts, params)
+
+        runner = run_jobs(store, translate_and_delete, chunk_size=5)
+        assert runner.translated == 0
+        with pytest.raises(JobNotFoundError):
+            store.get(job_id)
+        assert store.pending() == []
+
+
+def test_waits_for_idle_between_batches():
+    with tempfile.TemporaryDirectory() as directory:
+        store = JobStore(directory)
+        job_id = store.create([str(i) for i in range(10)], {})["job_id"]
+        batches = []
+        idle = {"value": True}
+
+        def translate(texts, params):
+            batches.append(len(texts))
+            idle["value"] = False  # Llega una petición interactiva durante el primer lote
+            return upper(texts, params)
+
+        run_jobs(store, translate, lambda: idle["value"], seconds=0.2, chunk_size=8, batch_size=3)
+        assert batches == [3]
+        meta = store.get(job_id)
+        assert (meta["status"], meta["done"]) == ("running", 0)
+
+        idle["value"] = True
+        runner = run_jobs(store, upper, chunk_size=8, batch_size=3)
+        assert runner.translated == 10 and not runner.busy
+        assert store.get(job_id)["status"] == "done"
+
+
+def test_limits_and_upload_lines():
+    with tempfile.TemporaryDirectory() as directory:
+        store = JobStore(directory, max_texts=2)
+        with pytest.raises(JobTooLargeError):
+            store.create(["a", "b", "c"], {})
+        assert list(store.root.iterdir()) == []
+        view = public_view(store.create(["a"], {}))
+        assert view["progress"] == 0.0 and "output_bytes" not in view
+
+    assert parse_upload_line(b"hola\r") == "hola"
+    assert parse_upload_line(b"   ") is None
+    assert parse_upload_line(b'{"text": "hola", "id": 1}', "jsonl") == "hola"
+    assert parse_upload_line(b'{"en": "hello"}', "jsonl", text_field="en") == "hello"
+    with pytest.raises(ValueError):
+        parse_upload_line(b"{no json", "jsonl")
@@ -0,0 +1,90 @@
+"""
+Pruebas de model_registry con un loader de prueba (sin modelos): una sola
+carga por par con peticiones simultáneas y desalojo LRU por memoria
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+
+from model_registry import ModelRegistry, PairModel, UnknownPairError, parse_pairs
+
+PAIRS = {"en-es": "m/en-es", "en-fr": "m/en-fr", "en-de": "m/en-de", "de-en": "m/de-en"}
+
+
+class SlowLoader:
+    """Cuenta las cargas por par; cada una tarda delay segundos y ocupa size_bytes"""
+
+    def __init__(self, delay: float = 0.1, size_bytes: int = 100, fail: set = ()):
+        self.delay = delay
+        self.size_bytes = size_bytes
+        self.fail = set(fail)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, pair: str, location: str) -> PairModel:
+        with self._lock:
+            self.calls.append(pair)
+        time.sleep(self.delay)
+        if pair in self.fail:
+            raise OSError(f"No se pudo descargar {location}")
+        return PairModel(pair, object(), object(), location, True, size_bytes=self.size_bytes)
+
+
+def test_concurrent_first_requests_load_once():
+    loader = SlowLoader()
+    registry = ModelRegistry(loader, PAIRS)
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        entries = list(pool.map(registry.get, ["en-fr"] * 12 + ["en-de"] * 4))
+    assert sorted(loader.calls) == ["en-de", "en-fr"]
+    assert all(entry is entries[0] for entry in entries[:12])
+    assert all(entry is entries[12] for entry in entries[12:])
+    assert registry.loads == 2 and registry.stats()["loading"] == []
+
+
+def test_failed_load_reaches_every_waiter_and_can_retry():
+    loader = SlowLoader(fail={"en-fr"})
+    registry = ModelRegistry(loader, PAIRS)
+
+    def get(pair):
+        try:
+            return registry.get(pair)
+        except OSError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(get, ["en-fr"] * 8))
+    assert loader.calls == ["en-fr"]
+    assert all(isinstance(result, OSError) for result in results)
+
+    loader.fail.clear()
+    assert registry.get("en-fr").pair == "en-fr"
+    assert loader.calls == ["en-fr", "en-fr"]
+
+
+def test_lru_eviction_order():
+    loader = SlowLoader(delay=0, size_bytes=100)
+    registry = ModelRegistry(loader, PAIRS, max_bytes=250)
+    registry.register("en-es", PairModel("en-es", object(), object(), "m/en-es", True, size_bytes=50))
+
+    registry.get("en-fr")
+    registry.get("en-de")
+    assert registry.stats()["loaded"] == ["en-es", "en-fr", "en-de"]
+    # Usar en-fr la deja como la más reciente: al cargar de-en sale en-de
+    registry.get("en-fr")
+    registry.get("de-en")
+    assert registry.stats()["loaded"] == ["en-es", "en-fr", "de-en"]
+    registry.get("en-de")
+    assert registry.stats()["loaded"] == ["en-es", "de-en", "en-de"]
+    # El par fijado del arranque no se desaloja nunca
+    assert registry.evictions == 2 and registry.used_bytes == 250
+    assert loader.calls == ["en-fr", "en-de", "de-en", "en-de"]
+
+
+def test_unknown_pair_and_parse_pairs():
+    registry = ModelRegistry(SlowLoader(delay=0), PAIRS)
+    with pytest.raises(UnknownPairError):
+        registry.get("fr-ja")
+    assert parse_pairs("en-fr, de-en=/models/de-en,", "Helsinki-NLP/opus-mt-{source}-{target}") == {
+        "en-fr": "Helsinki-NLP/opus-mt-en-fr", "de-en": "/models/de-en"}
@@ -0,0 +1,42 @@
+"""
+Pruebas de segmentation: los documentos se reconstruyen con los espacios y
+saltos de línea originales
+"""
+from segmentation import join_segments, split_segments
+
+DOCUMENTS = [
+    "Hello world. This is a test! Is it? Yes.",
+    "  Leading spaces.  Two spaces between.\n\nNew paragraph.\r\n\tTabbed line.   \n",
+    "Dr. Smith arrived at 5 p.m. He said \"Hi.\" (Then he left.) The end…",
+    "una línea sin puntuación",
+    "Title\n\n\n  \n- item one\n- item two\n",
+    "¿Qué tal? ¡Muy bien! Gracias.",
+]
+
+
+def test_round_trip_keeps_whitespace():
+    for text in DOCUMENTS:
+        segments, separators = split_segments(text)
+        assert len(separators) == len(segments) + 1
+        assert join_segments(segments, separators) == text
+        # Los segmentos no llevan espacios en los bordes: van en los separadores
+        assert all(segment and segment == segment.strip() for segment in segments)
+
+
+def test_sentences_and_abbreviations():
+    segments, separators = split_segments("  Hello world. This is Dr. Smith.\n\nBye!  ")
+    assert segments == ["Hello world.", "This is Dr. Smith.", "Bye!"]
+    assert separators == ["  ", " ", "\n\n", "  "]
+
+
+def test_translated_segments_keep_layout():
+    text = "First line.\n\n  Second one. Third!\n"
+    segments, separators = split_segments(text)
+    assert join_segments([segment.upper() for segment in segments], separators) == \
+        "FIRST LINE.\n\n  SECOND ONE. THIRD!\n"
+
+
+def test_blank_documents():
+    for text in ("", "   ", "\n\t\n"):
+        segments, separators = split_segments(text)
+        assert segments == [] and join_segments(segments, separators) == text
@@ -0,0 +1,72 @@
+"""
+Pruebas de shortlist: construcción de la tabla a partir de pares de ids y
+candidatos por lote, con un vocabulario de juguete (sin modelos)
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from shortlist import Shortlist
+
+VOCAB_SIZE = 10
+EOS, PAD = 0, 9
+
+# (ids fuente, ids destino); p(5|1) = 1, p(6|1) = 1/2, p(7|3) = 1, p(8|4) = 1/4
+PAIRS = [
+    ([1, 2, EOS], [5, 6, EOS]),
+    ([1, EOS], [5, EOS]),
+    ([2, 3], [7]),
+    ([4], [8]),
+    ([4], [5]),
+    ([4], [5]),
+    ([4], [7]),
+]
+
+
+def build(**kwargs) -> Shortlist:
+    options = dict(first=1, best=2, min_prob=0.3, special_ids=(EOS, PAD), eos_token_id=EOS, pad_token_id=PAD)
+    options.update(kwargs)
+    return Shortlist.build(PAIRS, VOCAB_SIZE, **options)
+
+
+def row(shortlist: Shortlist, source: int) -> list:
+    return shortlist.indices[shortlist.indptr[source]:shortlist.indptr[source + 1]].tolist()
+
+
+def test_build_keeps_best_targets():
+    shortlist = build()
+    assert shortlist.vocab_size == VOCAB_SIZE
+    # Ordenados por p(t|s) descendente; sin especiales
+    assert row(shortlist, 1) == [5, 6]
+    assert row(shortlist, 3) == [7]
+    # p(8|4) = 1/4 no llega a min_prob
+    assert row(shortlist, 4) == [5]
+    assert row(shortlist, EOS) == [] and row(shortlist, 6) == []
+    # El destino más frecuente entra siempre
+    assert shortlist.frequent.tolist() == [5]
+
+    assert row(build(best=1), 1) == [5]
+    assert row(build(min_prob=0.0, best=3), 4) == [5, 7, 8]
+
+
+def test_candidates():
+    shortlist = build()
+    vocab = shortlist.candidates(np.array([[3, 1, PAD], [VOCAB_SIZE + 5, -1, PAD]]))
+    # frecuentes + ids fuente (copia) + EOS + filas; sin <pad> ni ids fuera del vocabulario
+    assert vocab.tolist() == [EOS, 1, 3, 5, 6, 7]
+    assert shortlist.candidates(np.array([[4]])).tolist() == [EOS, 4, 5]
+    assert (shortlist.batches, shortlist.candidates_total) == (2, 9)
+
+
+def test_save_and_load():
+    shortlist = build()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "shortlist.npz")
+        shortlist.save(path)
+        loaded = Shortlist.load(path, eos_token_id=EOS, pad_token_id=PAD)
+    np.testing.assert_array_equal(loaded.indptr, shortlist.indptr)
+    np.testing.assert_array_equal(loaded.indices, shortlist.indices)
+    np.testing.assert_array_equal(loaded.frequent, shortlist.frequent)
+    ids = np.array([[1, 4, 3]])
+    np.testing.assert_array_equal(loaded.candidates(ids), shortlist.candidates(ids))
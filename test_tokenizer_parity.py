@@ -0,0 +1,98 @@
+"""
+Prueba de paridad: marian_tokenizer.MarianSpmTokenizer vs transformers.MarianTokenizer
+Codificación por lotes (ids + máscara) y decodificación deben ser idénticas
+
+Uso:
+    python test_tokenizer_parity.py   (también lo recoge pytest)
+"""
+import random
+
+import numpy as np
+from transformers import MarianTokenizer
+
+from marian_tokenizer import MarianSpmTokenizer
+
+MODEL_DIR = "."
+
+TEXTS = [
+    "Hello, how are you?",
+    "Good morning, have a nice day",
+    "Save",
+    "Cancel",
+    "",
+    "   ",
+    "Settings > Privacy > Location services",
+    "The quick brown fox jumps over the lazy dog. It wasn't amused!",
+    "Price: $1,299.99 (20% off) — today only…",
+    "Émojis 😀 and 中文 text, ñandú, façade",
+    "Tabs\tand\nnewlines\n\nin the middle",
+    "Literal special tokens: a</s>b <pad> c<unk>d",
+    ">>es<< Hello there",
+    "Email me at someone@example.com or visit https://example.com/path?q=1",
+    "word " * 700,
+]
+
+
+def _random_texts(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    # Sin códigos de idioma a mitad de texto: ahí cada versión de transformers hace algo distinto
+    words = [w for w in " ".join(TEXTS).split() if ">>" not in w]
+    words += ["A", "the", "of", "I'm", "don't", "«quoted»", "¿what?", "x" * 30]
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(1, 40))) for _ in range(count)]
+
+
+def load_tokenizers():
+    return MarianTokenizer.from_pretrained(MODEL_DIR), MarianSpmTokenizer.from_files(MODEL_DIR)
+
+
+def test_encode_parity():
+    reference, tokenizer = load_tokenizers()
+    texts = TEXTS + _random_texts(200)
+    for max_length in (8, 64, 512):
+        expected = reference(texts, return_tensors="np", padding=True, truncation=True, max_length=max_length)
+        input_ids, attention_mask = tokenizer.encode_batch(texts, truncation=True, max_length=max_length)
+        assert input_ids.dtype == np.int64 and attention_mask.dtype == np.int64
+        np.testing.assert_array_equal(input_ids, expected["input_ids"])
+        np.testing.assert_array_equal(attention_mask, expected["attention_mask"])
+
+    # Sin padding (listas) y texto suelto
+    expected = reference(texts, truncation=True, max_length=512)["input_ids"]
+    assert tokenizer(texts, truncation=True, max_length=512)["input_ids"] == expected
+    for text in TEXTS:
+        assert tokenizer(text)["input_ids"] == reference(text)["input_ids"], text
+
+
+def test_encode_into_preallocated_buffers():
+    _, tokenizer = load_tokenizers()
+    out_ids = np.zeros((32, 128), dtype=np.int64)
+    out_mask = np.zeros((32, 128), dtype=np.int64)
+    input_ids, attention_mask = tokenizer.encode_batch(TEXTS[:4], max_length=128, out_ids=out_ids, out_mask=out_mask)
+    assert np.shares_memory(input_ids, out_ids) and np.shares_memory(attention_mask, out_mask)
+    expected_ids, expected_mask = tokenizer.encode_batch(TEXTS[:4], max_length=128)
+    np.testing.assert_array_equal(input_ids, expected_ids)
+    np.testing.assert_array_equal(attention_mask, expected_mask)
+
+
+def test_decode_parity():
+    reference, tokenizer = load_tokenizers()
+    rng = np.random.default_rng(0)
+    vocab_size = len(tokenizer.vocab)
+
+    # Ids aleatorios (piezas raras incluidas) y salidas "reales": textos codificados
+    random_ids = rng.integers(0, vocab_size, size=(100, 40))
+    random_ids[:, -5:] = tokenizer.pad_token_id
+    random_ids[::3, -6] = tokenizer.eos_token_id
+    encoded = reference(TEXTS + _random_texts(50, seed=1), return_tensors="np", padding=True)["input_ids"]
+
+    # Los servidores siempre decodifican con skip_special_tokens=True; sin él,
+    # los espacios junto a los tokens especiales cambian entre versiones de transformers
+    for sequences in (random_ids, encoded):
+        expected = reference.batch_decode(sequences, skip_special_tokens=True)
+        assert tokenizer.batch_decode(sequences, skip_special_tokens=True) == expected
+    assert tokenizer.decode(encoded[0], skip_special_tokens=True) == reference.decode(encoded[0], skip_special_tokens=True)
+
+
+if __name__ == "__main__":
+    for test in (test_encode_parity, test_encode_into_preallocated_buffers, test_decode_parity):
+        test()
+        print(f"✅ {test.__name__}")
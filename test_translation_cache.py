@@ -0,0 +1,50 @@
+"""
+Pruebas de translation_cache: claves por parámetros, expulsión LRU y nivel
+SQLite que sobrevive a un reinicio
+"""
+import os
+import tempfile
+
+from translation_cache import TranslationCache
+
+
+def test_key_includes_normalized_text_and_params():
+    cache = TranslationCache()
+    cache.put("Café ", "Café", "model", 512, 4)
+    assert cache.get(" Café", "model", 512, 4) == "Café"
+    assert cache.get("Café", "model", 512, 1) is None
+    assert cache.get("Café", "other-model", 512, 4) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["persistent"]) == (1, 2, False)
+
+
+def test_lru_eviction():
+    cache = TranslationCache(max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"  # "b" pasa a ser la más antigua
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("A", "C")
+
+    cache = TranslationCache(max_bytes=200)
+    for i in range(10):
+        cache.put(str(i), "x" * 50)
+    assert cache.stats()["bytes"] <= 200 and cache.stats()["entries"] < 10
+
+
+def test_sqlite_tier_survives_restart():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "cache.sqlite")
+        cache = TranslationCache(db_path=db_path)
+        cache.put("Save", "Guardar", "model", 128, 4)
+        cache.put("Save", "Guardar cambios", "model", 128, 4)
+
+        # Nuevo proceso: memoria vacía, el valor sale de SQLite y pasa al LRU
+        restarted = TranslationCache(db_path=db_path)
+        assert restarted.get("Save", "model", 128, 4) == "Guardar cambios"
+        assert restarted.get("Save", "model", 128, 4) == "Guardar cambios"
+        assert restarted.get("Save", "model", 128, 1) is None
+        stats = restarted.stats()
+        assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (2, 1, 1)
+        assert stats["persistent"] and stats["entries"] == 1
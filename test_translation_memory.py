@@ -0,0 +1,74 @@
+"""
+Pruebas de translation_memory: coincidencia exacta, aproximada (opcional) y
+control de cifras, sobre un índice pequeño en un directorio temporal
+"""
+import os
+import tempfile
+
+from translation_memory import TranslationMemory, canonical, similarity
+
+PAIRS = [
+    ("Delete the selected file", "Eliminar el archivo seleccionado"),
+    ("Hello, how are you today?", "Hola, ¿qué tal estás hoy?"),
+    ("Add 5 items to the cart.", "Añade 5 artículos al carrito."),
+    ("Save", "Guardar"),
+    ("Save", "Guardar cambios"),  # Fuente repetida: gana la última
+    ("", "vacía"),
+]
+
+
+def build_memory(directory: str, **kwargs) -> TranslationMemory:
+    path = os.path.join(directory, "memoria.sqlite")
+    assert TranslationMemory.build(path, PAIRS, pair="en-es") == 4
+    return TranslationMemory(path, **kwargs)
+
+
+def test_exact_match():
+    with tempfile.TemporaryDirectory() as directory:
+        memory = build_memory(directory)
+        assert memory.pair == "en-es" and memory.segments == 4
+        match = memory.lookup("  Hello,   how are you today? ")
+        assert match.exact and match.score == 1.0
+        assert match.target == "Hola, ¿qué tal estás hoy?"
+        assert match.as_dict() == {"match": "exact", "score": 1.0, "source": "Hello, how are you today?",
+                                   "target": "Hola, ¿qué tal estás hoy?"}
+        assert memory.lookup("Save").target == "Guardar cambios"
+        assert memory.lookup("Something else") is None
+
+
+def test_fuzzy_is_off_by_default():
+    with tempfile.TemporaryDirectory() as directory:
+        memory = build_memory(directory)
+        assert memory.fuzzy_threshold == 1.0
+        assert memory.lookup("Delete the selected files") is None
+        assert memory.lookup("hello, how are you today!") is None
+        stats = memory.stats()
+        assert (stats["exact_hits"], stats["fuzzy_hits"], stats["misses"]) == (0, 0, 2)
+
+
+def test_fuzzy_match_when_enabled():
+    with tempfile.TemporaryDirectory() as directory:
+        memory = build_memory(directory, fuzzy_threshold=0.9)
+        match = memory.lookup("Delete the selected files")
+        assert match is not None and not match.exact
+        assert match.source == "Delete the selected file"
+        assert match.target == "Eliminar el archivo seleccionado"
+        assert 0.9 <= match.score < 1.0
+        # Por debajo del umbral no hay coincidencia
+        assert memory.lookup("Delete every file in the folder") is None
+        stats = memory.stats()
+        assert (stats["fuzzy_hits"], stats["misses"]) == (1, 1)
+
+
+def test_fuzzy_requires_same_digits():
+    with tempfile.TemporaryDirectory() as directory:
+        memory = build_memory(directory, fuzzy_threshold=0.8)
+        assert similarity("Add 6 items to the cart.", "Add 5 items to the cart.") > 0.9
+        assert memory.lookup("Add 6 items to the cart.") is None
+        assert memory.lookup("Add 5 items to the cart!").target == "Añade 5 artículos al carrito."
+
+
+def test_canonical_and_similarity():
+    assert canonical("  a \t b\n") == "a b"
+    assert similarity("Hello", "hello") == 1.0
+    assert similarity("Hello", "Goodbye", threshold=0.9) == 0.0
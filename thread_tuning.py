@@ -0,0 +1,258 @@
+"""
+Auto-ajuste de threads al arrancar
+Detecta los núcleos disponibles (afinidad y cuota del cgroup), mide con el
+modelo real unas pocas combinaciones de threads intra-op, inter-op y
+sesiones concurrentes (threads de inferencia) y se queda con la mejor para
+el objetivo elegido. La decisión se guarda en un fichero JSON para que los
+siguientes arranques en la misma máquina no repitan las medidas.
+"""
+from contextlib import contextmanager
+import json
+import math
+import os
+from pathlib import Path
+import threading
+import time
+
+OBJECTIVES = ("latency", "throughput", "balanced")
+# balanced: el mayor throughput cuyo p95 no pase de esta proporción del mejor p95
+BALANCED_LATENCY_SLACK = 1.5
+
+# Frases de longitudes variadas para las medidas (se traducen de una en una, como /translate)
+SAMPLE_TEXTS = (
+    "Hello, how are you today?",
+    "The meeting has been moved to Thursday afternoon.",
+    "Please make sure that all the documents are signed before the end of the week, "
+    "otherwise the shipment will be delayed.",
+    "Thank you!",
+    "Our new phone comes with a larger battery, a brighter screen and a camera that works well in low light.",
+)
+
+
+def cgroup_cpu_limit():
+    """Núcleos que permite la cuota de CPU del cgroup (v2 o v1), o None sin límite"""
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        quota = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text())
+        period = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def cpu_budget(processes: int = 1) -> dict:
+    """
+    Núcleos para este proceso: los de su afinidad, limitados por la cuota del
+    cgroup (redondeada hacia abajo: el exceso se paga en throttling) y
+    repartidos entre los processes procesos que los comparten
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    quota = cgroup_cpu_limit()
+    usable = cores if quota is None else max(1, min(cores, math.floor(quota)))
+    return {"cores": cores, "cgroup_quota": quota, "processes": processes, "cpus": max(1, usable // processes)}
+
+
+class ThreadConfig:
+    """Threads intra-op e inter-op por sesión y sesiones (threads de inferencia) concurrentes"""
+
+    def __init__(self, intra_op: int, inter_op: int = 1, sessions: int = 1):
+        self.intra_op = intra_op
+        self.inter_op = inter_op
+        self.sessions = sessions
+
+    def as_dict(self) -> dict:
+        return {"intra_op": self.intra_op, "inter_op": self.inter_op, "sessions": self.sessions}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ThreadConfig":
+        return cls(int(data["intra_op"]), int(data.get("inter_op", 1)), int(data.get("sessions", 1)))
+
+    def __eq__(self, other):
+        return isinstance(other, ThreadConfig) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return f"ThreadConfig({self.intra_op}, {self.inter_op}, {self.sessions})"
+
+
+def candidate_configs(cpus: int, inter_op: bool = True) -> list:
+    """
+    Combinaciones a medir sin pasar de cpus threads en total: intra-op en
+    potencias de 2 (y cpus) con una sesión o con tantas como quepan, y si
+    inter_op, una con 2 threads inter-op (solo onnxruntime los aprovecha)
+    """
+    intras = sorted({2 ** i for i in range(int(math.log2(cpus)) + 1)} | {cpus})
+    candidates = []
+    for intra in intras:
+        for sessions in sorted({1, cpus // intra}):
+            candidates.append(ThreadConfig(intra, 1, sessions))
+    if inter_op and cpus >= 2:
+        candidates.append(ThreadConfig(max(1, cpus // 2), 2, 1))
+    return candidates
+
+
+def benchmark(fn, concurrency: int, seconds: float, min_calls: int = 3) -> dict:
+    """
+    Llama a fn(i) desde concurrency threads durante seconds segundos (y al
+    menos min_calls veces en total). fn devuelve cuántas frases tradujo
+    """
+    latencies = []
+    items = [0]
+    lock = threading.Lock()
+    counter = iter(range(1 << 62))
+    start = time.perf_counter()
+    deadline = start + seconds
+
+    def worker():
+        while True:
+            with lock:
+                if time.perf_counter() >= deadline and len(latencies) >= min_calls:
+                    return
+                i = next(counter)
+            t0 = time.perf_counter()
+            done = fn(i)
+            elapsed = time.perf_counter() - t0
+            with lock:
+                latencies.append(elapsed)
+                items[0] += done
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "throughput": round(items[0] / wall, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+        "calls": len(latencies),
+    }
+
+
+def select(results: list, objective: str) -> int:
+    """Índice del mejor resultado para el objetivo"""
+    if objective == "latency":
+        return min(range(len(results)), key=lambda i: (results[i]["p50_ms"], -results[i]["throughput"]))
+    if objective == "throughput":
+        return max(range(len(results)), key=lambda i: results[i]["throughput"])
+    limit = min(r["p95_ms"] for r in results) * BALANCED_LATENCY_SLACK
+    return max((i for i, r in enumerate(results) if r["p95_ms"] <= limit), key=lambda i: results[i]["throughput"])
+
+
+def tune(apply, run, candidates: list, objective: str = "balanced", seconds: float = 2.0, log=None) -> dict:
+    """
+    Mide cada candidato: apply(config) lo aplica (recrea sesiones si hace
+    falta), una llamada a run(i) de calentamiento y benchmark(run, ...).
+    Deja aplicada la mejor configuración y devuelve la decisión
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Objetivo desconocido: {objective} (opciones: {', '.join(OBJECTIVES)})")
+    results = []
+    for config in candidates:
+        apply(config)
+        run(0)
+        result = dict(config.as_dict(), **benchmark(run, config.sessions, seconds))
+        results.append(result)
+        if log is not None:
+            log(f"Threads {config.as_dict()}: {result['throughput']} frases/s, "
+                f"p50 {result['p50_ms']}ms, p95 {result['p95_ms']}ms")
+    best = candidates[select(results, objective)]
+    if best is not candidates[-1]:
+        apply(best)
+    return {"config": best.as_dict(), "objective": objective, "source": "benchmark",
+            "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+
+
+def fingerprint(model_id: str, budget: dict, objective: str) -> str:
+    """Clave de la decisión: la misma máquina (núcleos, cuota), modelo y objetivo"""
+    return f"{model_id}|cores={budget['cores']}|quota={budget['cgroup_quota']}|cpus={budget['cpus']}|{objective}"
+
+
+def load_decision(path: str, key: str):
+    """Decisión guardada para key, o None"""
+    try:
+        return json.loads(Path(path).read_text()).get(key)
+    except (OSError, ValueError):
+        return None
+
+
+def save_decision(path: str, key: str, decision: dict):
+    """Guarda la decisión junto a las de otras claves (escritura atómica)"""
+    path = Path(path)
+    try:
+        decisions = json.loads(path.read_text())
+    except (OSError, ValueError):
+        decisions = {}
+    decisions[key] = decision
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(decisions, indent=2))
+    os.replace(tmp, path)
+
+
+@contextmanager
+def tuning_lock(path: str):
+    """
+    Con varios workers (start.py) solo uno mide a la vez; los demás esperan y
+    reutilizan su decisión en lugar de medir compitiendo por los núcleos
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def auto_tune(key: str, path: str, apply, run, candidates: list, objective: str = "balanced",
+              seconds: float = 2.0, log=None) -> dict:
+    """Aplica la decisión guardada para key o, si no la hay, mide los candidatos y la guarda"""
+    with tuning_lock(path):
+        decision = load_decision(path, key)
+        if decision is not None:
+            apply(ThreadConfig.from_dict(decision["config"]))
+            return dict(decision, source="file")
+        decision = tune(apply, run, candidates, objective, seconds, log)
+        save_decision(path, key, decision)
+        return decision
+
+
+def configure_threads(enabled: bool, current: ThreadConfig, model_id: str, apply, translate,
+                      processes: int = 1, inter_op: bool = True, objective: str = "balanced",
+                      path: str = "thread_tuning.json", seconds: float = 2.0, log=None) -> dict:
+    """
+    Configuración de threads de un servidor y su origen (lo que se muestra en
+    /health). Sin enabled se usa current (variables de entorno); con enabled,
+    la decisión guardada para esta máquina, modelo y objetivo o una medida
+    nueva traduciendo SAMPLE_TEXTS de uno en uno con translate(text). Para
+    medir lo que sirve el tráfico, translate debe pasar por el mismo camino
+    que /translate (micro-batcher y pool de inferencia)
+    """
+    budget = cpu_budget(processes)
+    if not enabled:
+        return {"config": current.as_dict(), "source": "env", "budget": budget}
+
+    def run(i: int) -> int:
+        translate(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)])
+        return 1
+
+    decision = auto_tune(
+        fingerprint(model_id, budget, objective), path, apply, run,
+        candidate_configs(budget["cpus"], inter_op=inter_op), objective, seconds, log
+    )
+    if log:
+        log(f"✅ Threads: {decision['config']} ({decision['source']}, objetivo {objective})")
+    return dict(decision, budget=budget)
@@ -0,0 +1,123 @@
+"""
+Cache de traducciones: LRU en memoria + nivel opcional en disco (SQLite)
+Evita pasar por el modelo los textos repetidos (botones, menús, onboarding...)
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza el texto fuente para que variantes triviales compartan entrada"""
+    return unicodedata.normalize("NFC", text).strip()
+
+
+class TranslationCache:
+    """
+    Cache LRU de traducciones limitado por número de entradas y por memoria.
+
+    La clave combina el texto normalizado con los parámetros de decodificación
+    (modelo, max_length, num_beams...), así que cambiar cualquiera de ellos no
+    devuelve resultados obsoletos. Si se indica db_path, las traducciones se
+    guardan también en SQLite y sobreviven a reinicios.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024, db_path: str = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        self.db_path = db_path
+        self._db = None
+        self._db_pid = None
+
+    @staticmethod
+    def make_key(text: str, *params) -> str:
+        """Clave estable: hash del texto normalizado + parámetros"""
+        raw = "\0".join([normalize_text(text)] + [str(p) for p in params])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, text: str, *params):
+        """Devuelve la traducción cacheada o None"""
+        key = self.make_key(text, *params)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+            db = self._connection()
+            if db is not None:
+                row = db.execute("SELECT value FROM translations WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._store(key, row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, translation: str, *params):
+        """Guarda una traducción en memoria (y en disco si está activado)"""
+        key = self.make_key(text, *params)
+        with self._lock:
+            self._store(key, translation)
+            db = self._connection()
+            if db is not None:
+                db.execute("INSERT OR REPLACE INTO translations (key, value) VALUES (?, ?)", (key, translation))
+                db.commit()
+
+    def _connection(self):
+        """
+        Conexión SQLite de este proceso. Se abre de forma perezosa y se reabre
+        tras un fork (start.py en modo pre-fork): SQLite no admite compartir
+        una conexión entre procesos.
+        """
+        if not self.db_path:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.commit()
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _store(self, key: str, value: str):
+        """Inserta en el LRU y expulsa las entradas más antiguas si se pasan los límites"""
+        if key in self._entries:
+            self._bytes -= self._entry_size(key, self._entries.pop(key))
+        self._entries[key] = value
+        self._bytes += self._entry_size(key, value)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            old_key, old_value = self._entries.popitem(last=False)
+            self._bytes -= self._entry_size(old_key, old_value)
+
+    @staticmethod
+    def _entry_size(key: str, value: str) -> int:
+        return len(key) + len(value.encode("utf-8"))
+
+    def stats(self) -> dict:
+        """Contadores de aciertos/fallos y ocupación"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "persistent": bool(self.db_path),
+            }
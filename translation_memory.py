@@ -0,0 +1,284 @@
+"""
+Memoria de traducción: traducciones aprobadas que se devuelven tal cual
+Los textos que ya tienen una traducción revisada no pasan por el modelo
+(ahorra cómputo y mantiene la redacción aprobada). El corpus se indexa
+offline en un fichero SQLite compacto:
+
+- Coincidencia exacta: hash de 64 bits del texto normalizado.
+- Coincidencia aproximada (opcional, con fuzzy_threshold < 1): firmas MinHash
+  de los trigramas de caracteres con LSH por bandas. Los candidatos se
+  verifican con la similitud real (difflib) y solo se aceptan desde
+  fuzzy_threshold y con las mismas cifras. Es la traducción de otra frase,
+  así que solo sirve como sugerencia: no sustituye a la del modelo.
+
+Uso:
+    python translation_memory.py build aprobadas.tsv --output memoria.sqlite
+    python translation_memory.py build aprobadas.jsonl --output memoria.sqlite --source_field en --target_field es
+    python translation_memory.py lookup memoria.sqlite "Texto a buscar"
+
+TSV: "fuente<TAB>traducción" por línea. JSONL: un objeto por línea con los
+campos --source_field y --target_field.
+"""
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+
+from translation_cache import normalize_text
+
+NUM_PERM = 64  # Permutaciones de la firma MinHash
+BANDS = 16  # Bandas LSH (NUM_PERM / BANDS filas por banda): candidatos desde ~0.6 de Jaccard
+_PRIME = 4294967311  # Primo > 2^32 para las permutaciones (a * x + b) mod p
+_DIGITS = re.compile(r"\d+")
+
+
+def canonical(text: str) -> str:
+    """Forma de la coincidencia exacta: NFC, sin espacios sobrantes"""
+    return " ".join(normalize_text(text).split())
+
+
+def _int64(data: bytes) -> int:
+    """Hash de 64 bits con signo (el tipo INTEGER de SQLite)"""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little", signed=True)
+
+
+def exact_key(text: str) -> int:
+    return _int64(canonical(text).encode("utf-8"))
+
+
+class MinHasher:
+    """Firmas MinHash de los trigramas de caracteres (en minúsculas) de un texto"""
+
+    def __init__(self, num_perm: int = NUM_PERM, bands: int = BANDS, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2 ** 32, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 2 ** 32, num_perm, dtype=np.uint64)
+        self.bands = bands
+
+    def signature(self, text: str) -> np.ndarray:
+        padded = f" {canonical(text).lower()} "
+        # crc32 y no hash(): tiene que ser el mismo al construir y al consultar
+        shingles = np.array([zlib.crc32(padded[i:i + 3].encode("utf-8"))
+                             for i in range(max(1, len(padded) - 2))], dtype=np.uint64)
+        # a, x < 2^32: el producto cabe en uint64
+        hashed = (np.outer(self.a, shingles) % _PRIME + self.b[:, None]) % _PRIME
+        return hashed.min(axis=1).astype(np.uint32)
+
+    def band_keys(self, signature: np.ndarray) -> list:
+        rows = len(signature) // self.bands
+        return [_int64(bytes([band]) + signature[band * rows:(band + 1) * rows].tobytes())
+                for band in range(self.bands)]
+
+
+class MemoryMatch:
+    """Traducción encontrada en la memoria y cómo se encontró"""
+
+    def __init__(self, target: str, match: str, score: float, source: str):
+        self.target = target
+        self.match = match  # "exact" o "fuzzy"
+        self.score = score
+        self.source = source  # Texto fuente de la entrada de la memoria
+
+    @property
+    def exact(self) -> bool:
+        """Solo una coincidencia exacta puede usarse como traducción"""
+        return self.match == "exact"
+
+    def as_dict(self) -> dict:
+        return {"match": self.match, "score": self.score, "source": self.source, "target": self.target}
+
+
+def similarity(a: str, b: str, threshold: float = 0.0) -> float:
+    """Similitud de caracteres (difflib) sin distinguir mayúsculas; 0 si seguro que no llega a threshold"""
+    matcher = difflib.SequenceMatcher(None, canonical(a).lower(), canonical(b).lower(), autojunk=False)
+    if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+        return 0.0
+    return matcher.ratio()
+
+
+class TranslationMemory:
+    """
+    Consulta de un índice creado con TranslationMemory.build (solo lectura,
+    compartible entre threads). lookup() prueba la coincidencia exacta y, si
+    fuzzy_threshold < 1, la mejor aproximada entre max_candidates candidatos
+    (por defecto solo exactas)
+    """
+
+    def __init__(self, path: str, fuzzy_threshold: float = 1.0, max_candidates: int = 32):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No existe la memoria de traducción {path}")
+        self.path = path
+        self.fuzzy_threshold = fuzzy_threshold
+        self.max_candidates = max_candidates
+        self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        meta = dict(self._db.execute("SELECT name, value FROM meta"))
+        self.pair = meta["pair"]
+        self.segments = int(meta["segments"])
+        self.hasher = MinHasher(int(meta["num_perm"]), int(meta["bands"]), int(meta["seed"]))
+
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+
+    def lookup(self, text: str):
+        """MemoryMatch para text, o None"""
+        with self._lock:
+            match = self._exact(text)
+            if match is None and self.fuzzy_threshold < 1.0:
+                match = self._fuzzy(text)
+            if match is None:
+                self.misses += 1
+            elif match.match == "exact":
+                self.exact_hits += 1
+            else:
+                self.fuzzy_hits += 1
+            return match
+
+    def _exact(self, text: str):
+        row = self._db.execute("SELECT source, target FROM segments WHERE key = ?", (exact_key(text),)).fetchone()
+        # Comprobar el texto: dos textos distintos podrían compartir hash
+        if row is not None and canonical(row[0]) == canonical(text):
+            return MemoryMatch(row[1], "exact", 1.0, row[0])
+        return None
+
+    def _fuzzy(self, text: str):
+        keys = self.hasher.band_keys(self.hasher.signature(text))
+        rows = self._db.execute(
+            f"SELECT s.source, s.target FROM segments s JOIN ("
+            f"  SELECT segment, COUNT(*) AS bands FROM bands WHERE key IN ({','.join('?' * len(keys))})"
+            f"  GROUP BY segment ORDER BY bands DESC LIMIT ?"
+            f") c ON s.id = c.segment",
+            keys + [self.max_candidates]
+        ).fetchall()
+        digits = _DIGITS.findall(text)
+        best = None
+        for source, target in rows:
+            # Una cifra distinta (precios, cantidades, fechas) cambia el significado
+            if _DIGITS.findall(source) != digits:
+                continue
+            score = similarity(text, source, self.fuzzy_threshold)
+            if score >= self.fuzzy_threshold and (best is None or score > best.score):
+                best = MemoryMatch(target, "fuzzy", round(score, 4), source)
+        return best
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.exact_hits + self.fuzzy_hits + self.misses
+            return {
+                "pair": self.pair,
+                "segments": self.segments,
+                "fuzzy_threshold": self.fuzzy_threshold,
+                "exact_hits": self.exact_hits,
+                "fuzzy_hits": self.fuzzy_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.exact_hits + self.fuzzy_hits) / total, 4) if total else 0.0,
+            }
+
+    @staticmethod
+    def build(path: str, pairs, pair: str = "en-es", num_perm: int = NUM_PERM, bands: int = BANDS,
+              seed: int = 1, batch_size: int = 10000) -> int:
+        """
+        Crea (o reemplaza) el índice en path a partir de pares (fuente,
+        traducción). Si una fuente se repite gana la última. Devuelve el
+        número de entradas
+        """
+        tmp = f"{path}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        db = sqlite3.connect(tmp)
+        db.executescript("""
+            CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE segments (id INTEGER PRIMARY KEY, key INTEGER UNIQUE, source TEXT, target TEXT);
+            CREATE TABLE bands (key INTEGER, segment INTEGER, PRIMARY KEY (key, segment)) WITHOUT ROWID;
+        """)
+
+        def insert_segments(rows):
+            db.executemany("INSERT INTO segments (key, source, target) VALUES (?, ?, ?) "
+                           "ON CONFLICT (key) DO UPDATE SET source = excluded.source, target = excluded.target", rows)
+
+        rows = []
+        for source, target in pairs:
+            if source.strip() and target.strip():
+                rows.append((exact_key(source), source, target))
+            if len(rows) >= batch_size:
+                insert_segments(rows)
+                rows = []
+        insert_segments(rows)
+
+        # Bandas LSH en una segunda pasada: así los duplicados conservan un solo id
+        hasher = MinHasher(num_perm, bands, seed)
+        cursor = db.execute("SELECT id, source FROM segments")
+        while True:
+            chunk = cursor.fetchmany(batch_size)
+            if not chunk:
+                break
+            db.executemany("INSERT OR IGNORE INTO bands (key, segment) VALUES (?, ?)",
+                           [(key, segment) for segment, source in chunk
+                            for key in hasher.band_keys(hasher.signature(source))])
+
+        count = db.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+        db.executemany("INSERT INTO meta (name, value) VALUES (?, ?)", [
+            ("pair", pair), ("segments", str(count)), ("num_perm", str(num_perm)),
+            ("bands", str(bands)), ("seed", str(seed)),
+        ])
+        db.commit()
+        db.execute("VACUUM")
+        db.close()
+        os.replace(tmp, path)
+        return count
+
+
+def read_corpus(path: str, source_field: str = "source", target_field: str = "target"):
+    """Pares (fuente, traducción) de un TSV o JSONL (según la extensión)"""
+    jsonl = path.endswith((".jsonl", ".json"))
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                continue
+            if jsonl:
+                record = json.loads(line)
+                yield str(record.get(source_field) or ""), str(record.get(target_field) or "")
+            else:
+                columns = line.split("\t")
+                if len(columns) >= 2:
+                    yield columns[0], columns[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria de traducción con búsqueda exacta y aproximada")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Indexar un corpus TSV/JSONL de traducciones aprobadas")
+    build.add_argument("corpus")
+    build.add_argument("--output", required=True)
+    build.add_argument("--pair", default="en-es", help="Par de idiomas del corpus")
+    build.add_argument("--source_field", default="source", help="JSONL: campo con el texto fuente")
+    build.add_argument("--target_field", default="target", help="JSONL: campo con la traducción")
+
+    lookup = subparsers.add_parser("lookup", help="Buscar un texto en un índice")
+    lookup.add_argument("memory")
+    lookup.add_argument("text")
+    lookup.add_argument("--fuzzy_threshold", type=float, default=1.0,
+                        help="Similitud mínima de las coincidencias aproximadas (1 = solo exactas)")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        count = TranslationMemory.build(args.output, read_corpus(args.corpus, args.source_field, args.target_field),
+                                        args.pair)
+        print(f"✅ {count} traducciones indexadas en {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB)")
+    else:
+        match = TranslationMemory(args.memory, args.fuzzy_threshold).lookup(args.text)
+        print(json.dumps(match.as_dict() if match else None, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()